@@ -0,0 +1,249 @@
+'''
+Where the capture server gets gaze data and screenshots from.
+
+The tracker backend is anything shaped like the tobii_research module: a
+find_all_eyetrackers() returning EyeTracker-like objects (address,
+apply_licenses, subscribe_to, unsubscribe_from) and EYETRACKER_GAZE_DATA.
+The screen backend is a grab() returning a screenshot.Frame. Both are picked
+by name, and nothing touches the SDK or the display until it is first used:
+
+    tracker_backend("tobii")                 # the Tobii Pro SDK
+    tracker_backend("replay:eye_tracker_data/[12]-2023-11-30_14-02-11.gaze")
+    tracker_backend("none")                  # events and screenshots only
+    screen_grabber("mss")                    # the primary monitor
+    screen_grabber("replay:screenshots")     # screenshots on disk, in turn
+    screen_grabber("blank")                  # a white frame
+
+The replay backends run in-process, so a machine without a tracker or a
+display (an analysis machine, CI) can run the whole pipeline on a recorded
+session.
+'''
+
+import itertools
+import os
+import threading
+import time
+
+import numpy as np
+
+from geometry import X_PIXELS, Y_PIXELS
+from screenshot import Frame
+
+TRACKERS = ("tobii", "replay", "none")
+SCREENS = ("mss", "replay", "blank")
+# the value of tobii_research.EYETRACKER_GAZE_DATA
+GAZE_DATA = "gaze_data"
+IMAGE_EXTENSIONS = (".png", ".webp", ".jpg", ".jpeg")
+
+
+class TobiiSDK:
+    '''tobii_research, imported on first use: it loads the SDK's native library'''
+
+    def __getattr__(self, name):
+        import tobii_research
+
+        return getattr(tobii_research, name)
+
+
+class ReplayEyeTracker:
+    '''
+    Stands in for a tobii_research.EyeTracker by playing a recording back to
+    its gaze subscribers in real time (or `speed` times faster), on a thread
+    of its own like the SDK's callbacks. Timestamps are moved to the live
+    clock: at speed 1 system_time_stamp is time.monotonic in microseconds,
+    as the SDK gives it, and device_time_stamp keeps its offset to it. The
+    recording starts over when it runs out.
+
+    recording is the path of a session (or legacy JSON file) or a list of
+    packets.
+    '''
+
+    def __init__(self, recording, speed=1., serial_number="replay-1"):
+        self.recording = recording
+        self.speed = speed
+        self.address = f"replay://{serial_number}"
+        self.device_name = "Replay"
+        self.model = "replay"
+        self.serial_number = serial_number
+        self.subscribers = []
+        self.lock = threading.Lock()
+        # held while callbacks run
+        self.delivering = threading.Lock()
+        self.thread = None
+        self.session = None
+        self.packets_sent = 0
+
+    def apply_licenses(self, licenses):
+        return ()
+
+    def subscribe_to(self, stream, callback, as_dictionary=False):
+        if stream != GAZE_DATA:
+            raise ValueError(f"The replay tracker only has the {GAZE_DATA} stream")
+        if not as_dictionary:
+            raise ValueError("The replay tracker only sends dictionaries")
+        with self.lock:
+            self.subscribers.append(callback)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="replay-tracker", daemon=True)
+                self.thread.start()
+
+    def unsubscribe_from(self, stream, callback=None):
+        with self.lock:
+            if callback is None:
+                self.subscribers.clear()
+            else:
+                self.subscribers[:] = [c for c in self.subscribers if c != callback]
+        if threading.current_thread() is not self.thread:
+            # like the SDK, no callback runs once this returns
+            with self.delivering:
+                pass
+
+    def packets(self):
+        if not isinstance(self.recording, (str, os.PathLike)):
+            return iter(self.recording)
+        if self.session is None:
+            import gazefile
+
+            self.session = gazefile.open_session(self.recording)
+        return self.session.packets()
+
+    def _run(self):
+        # live microseconds of the first packet, and recorded microseconds
+        # replayed by the laps before this one
+        start = time.monotonic_ns() // 1000
+        elapsed = 0
+        while True:
+            first = previous = None
+            period = 0
+            for packet in self.packets():
+                recorded = packet["system_time_stamp"]
+                if first is None:
+                    first = recorded
+                if previous is not None:
+                    period = recorded - previous
+                previous = recorded
+                # the recorded spacing is kept; only the delivery is sped up
+                offset = elapsed + recorded - first
+                wait = (start + offset / self.speed) / 1_000_000 - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                packet = dict(packet)
+                packet["device_time_stamp"] += start + offset - recorded
+                packet["system_time_stamp"] = start + offset
+                with self.lock:
+                    subscribers = list(self.subscribers)
+                    if not subscribers:
+                        self.thread = None
+                        return
+                with self.delivering:
+                    for callback in subscribers:
+                        if callback in self.subscribers:
+                            callback(packet)
+                self.packets_sent += 1
+            if first is None:
+                with self.lock:
+                    self.thread = None
+                return
+            # start over one sample period after the last packet
+            elapsed += previous - first + period
+
+
+class ReplayTracking:
+    '''
+    A tobii_research stand-in whose trackers (replay-1, replay-2, ... by
+    serial number) each replay a recording on a thread of their own. To try
+    out what happens around discovery, find_all_eyetrackers() can take
+    discovery_seconds, as the SDK's does, and find nothing the first
+    `misses` times it is called.
+    '''
+
+    EYETRACKER_GAZE_DATA = GAZE_DATA
+
+    def __init__(self, recording, speed=1., discovery_seconds=0., misses=0, trackers=1):
+        self.trackers = [ReplayEyeTracker(recording, speed, f"replay-{i + 1}") for i in range(trackers)]
+        self.discovery_seconds = discovery_seconds
+        self.misses = misses
+        self.discoveries = 0
+
+    def find_all_eyetrackers(self):
+        self.discoveries += 1
+        time.sleep(self.discovery_seconds)
+        if self.discoveries <= self.misses:
+            return []
+        return list(self.trackers)
+
+
+def tracker_backend(spec):
+    '''
+    Return the tracker backend for a spec: "tobii", "replay:<recording>" or
+    "none" (None is returned). Anything that is not a string is taken to be
+    a backend already.
+    '''
+    if not isinstance(spec, str):
+        return spec
+    name, _, argument = spec.partition(":")
+    if name == "tobii":
+        return TobiiSDK()
+    if name == "replay":
+        if not argument:
+            raise ValueError("replay needs a recording, e.g. replay:eye_tracker_data/[1]-....gaze")
+        return ReplayTracking(argument)
+    if name == "none":
+        return None
+    raise ValueError(f"Unknown tracker {spec}, expected one of {TRACKERS}")
+
+
+class BlankScreen:
+    '''A grab that returns the same white frame, for running without a display'''
+
+    def __init__(self, size=(X_PIXELS, Y_PIXELS)):
+        self.frame = Frame(size, bytes([255]) * (size[0] * size[1] * 4))
+
+    def __call__(self):
+        return self.frame
+
+
+class ReplayScreen:
+    '''A grab that returns the screenshots in a folder, in name order, over and over'''
+
+    def __init__(self, folder):
+        self.paths = sorted(
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        ) if os.path.isdir(folder) else [folder]
+        if not self.paths:
+            raise ValueError(f"No screenshots in {folder}")
+        self.cycle = itertools.cycle(self.paths)
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        from PIL import Image
+
+        with self.lock:
+            path = next(self.cycle)
+        with Image.open(path) as image:
+            rgb = np.asarray(image.convert("RGB"))
+        bgra = np.empty(rgb.shape[:2] + (4,), dtype=np.uint8)
+        bgra[..., 0] = rgb[..., 2]
+        bgra[..., 1] = rgb[..., 1]
+        bgra[..., 2] = rgb[..., 0]
+        bgra[..., 3] = 255
+        return Frame((rgb.shape[1], rgb.shape[0]), bgra.tobytes())
+
+
+def screen_grabber(spec):
+    '''Return the grab for a spec: "mss", "replay:<folder or image>" or "blank"'''
+    if not isinstance(spec, str):
+        return spec
+    name, _, argument = spec.partition(":")
+    if name == "mss":
+        from screenshot import ScreenGrabber
+
+        return ScreenGrabber()
+    if name == "replay":
+        if not argument:
+            raise ValueError("replay needs a folder of screenshots, e.g. replay:screenshots")
+        return ReplayScreen(argument)
+    if name == "blank":
+        return BlankScreen()
+    raise ValueError(f"Unknown screen grabber {spec}, expected one of {SCREENS}")
@@ -0,0 +1,128 @@
+'''
+Load test for /capture-screenshot/
+
+Fires a burst of concurrent events at the endpoint with a fake screen grabber
+and reports p50/p99 request latency, once with the old inline handler (sleep,
+grab and insert on the event loop) and once with the capture pipeline.
+
+Run from apps/backend:
+
+    python -m benchmarks.capture_load --events 200
+'''
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+
+import numpy as np
+from fastapi import APIRouter, FastAPI
+import httpx
+
+import database
+import models
+from capture import CapturePipeline
+from database import insert_event_data
+from models import EventData
+
+
+def fake_grabber(cost):
+    def grab(participant_id=None):
+        # stands in for the mss grab
+        time.sleep(cost)
+        return f"screenshots/{uuid.uuid4()}.png"
+
+    return grab
+
+
+def inline_app(grab, delay):
+    '''The handler as it was before the pipeline: everything on the event loop'''
+    router = APIRouter()
+
+    async def take_screenshot(event_data: EventData):
+        time.sleep(delay)
+        event_data.Screenshot_file = grab()
+        event = insert_event_data(event_data)
+        return {"id": event.id}
+
+    router.add_api_route("/capture-screenshot/", take_screenshot, methods=["POST"])
+    app = FastAPI()
+    app.include_router(router)
+    return app, None
+
+
+def pipeline_app(grab, delay):
+    from main import API
+
+    pipeline = CapturePipeline(grab=grab, delay=delay)
+    api = API(pipeline=pipeline)
+    app = FastAPI()
+    app.include_router(api.router)
+    return app, pipeline
+
+
+async def fire(app, pipeline, events):
+    if pipeline is not None:
+        pipeline.start()
+
+    latencies = []
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+
+        async def send(i):
+            payload = {
+                "timestamp": int(time.time() * 1000) + i,
+                "agent": "USER",
+                "event": "NEXT_PAGE",
+                "participantId": 1,
+            }
+            start = time.perf_counter()
+            response = await client.post("/capture-screenshot/", json=payload)
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(events)))
+        accepted = time.perf_counter() - start
+
+        if pipeline is not None:
+            await pipeline.drain()
+        stored = time.perf_counter() - start
+
+    return np.array(latencies), accepted, stored
+
+
+def report(name, latencies, accepted, stored):
+    print(
+        f"{name:>9}: p50 {np.percentile(latencies, 50) * 1000:9.1f} ms"
+        f"  p99 {np.percentile(latencies, 99) * 1000:9.1f} ms"
+        f"  all accepted {accepted:6.2f} s  all stored {stored:6.2f} s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds before the grab")
+    parser.add_argument("--grab-cost", type=float, default=0.08, help="seconds per fake grab")
+    parser.add_argument("--skip-inline", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "events.db")
+        models.db.init(path)
+        database.initialize_database()
+
+        grab = fake_grabber(args.grab_cost)
+        print(f"{args.events} concurrent events, {args.delay}s delay, {args.grab_cost}s grab")
+        if not args.skip_inline:
+            report("inline", *asyncio.run(fire(*inline_app(grab, args.delay), args.events)))
+        report("pipeline", *asyncio.run(fire(*pipeline_app(grab, args.delay), args.events)))
+
+        database.close_database()
+
+
+if __name__ == "__main__":
+    main()
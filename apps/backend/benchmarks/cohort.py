@@ -0,0 +1,84 @@
+'''
+Runs the cohort pipeline on a synthetic cohort of columnar gaze sessions with
+different worker counts, checks every run gives the same tables as a run in
+this process, and reports the speedup over a single worker. One unit points
+at a missing recording to show it is reported without stopping the others.
+
+Run from apps/backend (the speedup is bounded by the cores available):
+
+    python -m benchmarks.cohort --participants 16 --books 3 --minutes 15
+'''
+
+import argparse
+import os
+import tempfile
+
+import pandas as pd
+
+import gazefile
+from benchmarks.synthetic import BOOKS, gaze_columns
+from cohort import CohortUnit, analyse_cohort
+
+START_EPOCH = 1_700_000_000
+
+
+def write_cohort(folder, participants, books, minutes, page_seconds=20):
+    units = []
+    for p in range(participants):
+        for b in range(books):
+            seed = p * books + b
+            columns = gaze_columns(minutes * 60, seed=seed, pupils=True)
+            start_epoch = START_EPOCH + seed * 3600
+            header = {
+                "participantId": p,
+                "start_time": start_epoch * 1000,
+                # the clock anchors line system_time_stamp up with start_epoch
+                "system_start_time_mono": int(columns["system_time_stamp"][0]) * 1000,
+                "system_start_time_epoch": start_epoch,
+            }
+            path = gazefile.write_columns(os.path.join(folder, f"[{p}]-{b}"), header, columns)
+            starts = range(start_epoch * 1000, (start_epoch + int(minutes * 60)) * 1000, page_seconds * 1000)
+            units.append(CohortUnit(
+                participant_id=p,
+                book=BOOKS[b % len(BOOKS)],
+                gaze_file=path,
+                dominant_eye="left" if p % 3 == 0 else "right",
+                pages=[(seed * 1000 + i, s, s + page_seconds * 1000) for i, s in enumerate(starts)],
+            ))
+    return units
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--participants", type=int, default=16)
+    parser.add_argument("--books", type=int, default=3)
+    parser.add_argument("--minutes", type=float, default=15, help="length of each recording")
+    parser.add_argument("--max-workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        units = write_cohort(tmp, args.participants, args.books, args.minutes)
+        units.append(CohortUnit(999, BOOKS[0], os.path.join(tmp, "missing.gaze"), pages=[(0, 0, 1)]))
+        print(f"{len(units)} units ({args.minutes} min at 250 Hz each), {os.cpu_count()} cores")
+
+        expected = analyse_cohort(units, workers=0, progress=None, sacvel=80)
+        assert len(expected.errors) == 1 and expected.errors[0][0].participant_id == 999
+        print(
+            f"{len(expected.fixations)} fixations, {len(expected.saccades)} saccades,"
+            f" {len(expected.pupils)} pupil summaries; 1 unit failed as expected"
+        )
+
+        single = None
+        workers = 1
+        while workers <= args.max_workers:
+            result = analyse_cohort(units, workers=workers, progress=None, sacvel=80)
+            for table in ("fixations", "saccades", "pupils"):
+                pd.testing.assert_frame_equal(getattr(result, table), getattr(expected, table))
+            assert len(result.errors) == 1
+            single = single or result.seconds
+            print(f"  {workers} workers {result.seconds:7.2f} s  speedup {single / result.seconds:5.2f}x")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
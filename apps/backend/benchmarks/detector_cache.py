@@ -0,0 +1,79 @@
+'''
+Times a cold and a warm run of the cohort pipeline with the detector cache,
+checks the warm run returns the same tables, and shows that changing a
+detector parameter misses the cache while the size bound evicts old entries.
+Also times a single cached detector call against computing it.
+
+Run from apps/backend:
+
+    python -m benchmarks.detector_cache --participants 16 --books 3 --minutes 15
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import velocityThreshold
+from benchmarks.cohort import write_cohort
+from benchmarks.synthetic import gaze_trace
+from cohort import analyse_cohort
+from detectorcache import DetectorCache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--participants", type=int, default=16)
+    parser.add_argument("--books", type=int, default=3)
+    parser.add_argument("--minutes", type=float, default=15)
+    parser.add_argument("--workers", type=int, default=0, help="0 runs in this process")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        units = write_cohort(tmp, args.participants, args.books, args.minutes)
+        folder = os.path.join(tmp, "cache")
+        print(f"{len(units)} units of {args.minutes} min")
+
+        uncached = analyse_cohort(units, workers=args.workers, progress=None, sacvel=80)
+        cold = analyse_cohort(units, workers=args.workers, progress=None, cache=folder, sacvel=80)
+        warm = analyse_cohort(units, workers=args.workers, progress=None, cache=folder, sacvel=80)
+        for table in ("fixations", "saccades", "pupils"):
+            pd.testing.assert_frame_equal(getattr(warm, table), getattr(uncached, table))
+        changed = analyse_cohort(units, workers=args.workers, progress=None, cache=folder, sacvel=60)
+
+        cache = DetectorCache(folder)
+        print(f"  no cache      {uncached.seconds:7.2f} s")
+        print(f"  cold cache    {cold.seconds:7.2f} s")
+        print(f"  warm cache    {warm.seconds:7.2f} s  ({uncached.seconds / warm.seconds:.0f}x)")
+        print(f"  sacvel=60     {changed.seconds:7.2f} s  (new key, computed)")
+        print(f"  cache size    {cache.size() / 2**20:7.1f} MiB in {len(cache.entries())} entries")
+
+        max_bytes = cache.max_bytes
+        cache.max_bytes = cache.size() // 2
+        cache.evict()
+        print(f"  bounded to half: {len(cache.entries())} entries, {cache.size() / 2**20:.1f} MiB")
+        # with the cache still full, storing the traces below would evict them
+        # straight away and the "cached" timing would be another computation
+        cache.max_bytes = max_bytes
+
+        df = gaze_trace(250 * 60 * 10)
+        for detector, params in ((velocityThreshold.detect_fix_ivt, {"sacvel": 80}),
+                                 (velocityThreshold.detect_fix_idt, {"dispval": 1})):
+            cached = cache.wrap(detector)
+            start = time.perf_counter()
+            expected = detector(df, **params)
+            compute = time.perf_counter() - start
+            cached(df, **params)
+            start = time.perf_counter()
+            hit = cached(df, **params)
+            read = time.perf_counter() - start
+            pd.testing.assert_frame_equal(hit[0], expected[0])
+            assert all(np.array_equal(a, b) for a, b in zip(hit[1:], expected[1:]) if a is not None)
+            print(f"  {detector.__name__} on {len(df)} samples: {compute * 1000:.0f} ms, cached {read * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
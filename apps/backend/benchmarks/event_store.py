@@ -0,0 +1,173 @@
+'''
+Benchmarks the event store: insert throughput with the old settings
+(rollback journal, an fsync per autocommitted insert), with WAL, and with WAL
+plus group commit through EventWriter; then typical analysis queries on a
+large synthetic table before and after the index migration.
+
+Run from apps/backend:
+
+    python -m benchmarks.event_store --inserts 5000 --rows 10000000
+'''
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import database
+import models
+from database import EventWriter, insert_event_data
+from models import EventData, Events
+
+EVENTS = np.array(["NEXT_PAGE", "PREV_PAGE", "CHANGE_FONT_SIZE", "OPEN_BOOK", "CLOSE_BOOK", "SELECT_TREATMENT"])
+WEIGHTS = np.array([.85, .05, .04, .02, .02, .02])
+
+
+def event(i):
+    return EventData(
+        timestamp=1_700_000_000_000 + i,
+        agent="USER",
+        event="NEXT_PAGE",
+        participantId=i % 40,
+        oldValue=str(i),
+        newValue=str(i + 1),
+        Screenshot_file=f"screenshots/{i}.png",
+    )
+
+
+def timed_inserts(path, pragmas, inserts, group_commit, threads=8):
+    models.db.init(path, pragmas=pragmas)
+    database.initialize_database()
+    start = time.perf_counter()
+    if group_commit:
+        writer = EventWriter()
+        writer.start()
+
+        def submit(offset):
+            futures = [writer.submit(event(i)) for i in range(offset, inserts, threads)]
+            for future in futures:
+                future.result()
+
+        workers = [threading.Thread(target=submit, args=(t,)) for t in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        writer.close()
+    else:
+        for i in range(inserts):
+            insert_event_data(event(i))
+    elapsed = time.perf_counter() - start
+    database.close_database()
+    return inserts / elapsed
+
+
+def fill(path, rows, participants=400, seed=0):
+    '''Bulk load a table with the current schema but none of the indexes'''
+    models.db.init(path, pragmas=models.PRAGMAS)
+    models.db.connect()
+    models.db.create_tables([Events], safe=True)
+    for index in (
+        "events_participant_id_event_time",
+        "events_participant_id_time",
+        "events_participant_id_time_event_agent",
+    ):
+        models.db.execute_sql(f"DROP INDEX IF EXISTS {index}")
+    models.db.close()
+
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=wal")
+    conn.execute("PRAGMA synchronous=off")
+    chunk = 1_000_000
+    time_base = 1_700_000_000_000
+    for offset in range(0, rows, chunk):
+        n = min(chunk, rows - offset)
+        # events arrive interleaved between participants, as they would with
+        # several stations, so rows for one participant are spread out
+        participant = rng.integers(0, participants, n)
+        times = time_base + offset * 50 + np.arange(n) * 50
+        events = rng.choice(EVENTS, n, p=WEIGHTS)
+        conn.executemany(
+            "INSERT INTO events (time, agent, event, participant_id, old_value, new_value, screenshot_file)"
+            " VALUES (?, 'USER', ?, ?, NULL, NULL, NULL)",
+            zip(times.tolist(), events.tolist(), participant.tolist()),
+        )
+        conn.commit()
+    conn.close()
+
+
+def analysis_queries(rows, participants=20):
+    rng = np.random.default_rng(1)
+    ids = rng.integers(0, 400, participants).tolist()
+    results = {}
+
+    def run(name, f):
+        start = time.perf_counter()
+        for p in ids:
+            f(p)
+        results[name] = (time.perf_counter() - start) / len(ids)
+
+    run("participant's events by time", lambda p: list(
+        Events.select().where(Events.participant_id == p).order_by(Events.time).tuples()))
+    run("participant's OPEN_BOOKs", lambda p: list(
+        Events.select().where((Events.participant_id == p) & (Events.event == "OPEN_BOOK")).tuples()))
+
+    def close_after(p):
+        open_book = Events.select().where(
+            (Events.participant_id == p) & (Events.event == "OPEN_BOOK")).order_by(Events.time).first()
+        if open_book is not None:
+            Events.select().where(
+                (Events.participant_id == p) & (Events.event == "CLOSE_BOOK")
+                & (Events.time > open_book.time)).order_by(Events.time).first()
+
+    run("CLOSE_BOOK after an OPEN_BOOK", close_after)
+    run("page events in a time range", lambda p: list(
+        Events.select().where(
+            (Events.participant_id == p) & (Events.event == "NEXT_PAGE")
+            & (Events.time.between(1_700_000_000_000, 1_700_000_000_000 + 50 * rows // 4))
+        ).tuples()))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--inserts", type=int, default=5_000)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"insert throughput, {args.inserts} events")
+        old = timed_inserts(os.path.join(tmp, "old.db"), {}, args.inserts, False)
+        old_group = timed_inserts(os.path.join(tmp, "old-group.db"), {}, args.inserts, True)
+        wal = timed_inserts(os.path.join(tmp, "wal.db"), models.PRAGMAS, args.inserts, False)
+        group = timed_inserts(os.path.join(tmp, "group.db"), models.PRAGMAS, args.inserts, True)
+        print(f"  default pragmas, autocommit  {old:10.0f} events/s")
+        print(f"  default pragmas, group commit {old_group:9.0f} events/s")
+        print(f"  WAL, autocommit              {wal:10.0f} events/s")
+        print(f"  WAL, group commit, 8 threads {group:10.0f} events/s")
+
+        path = os.path.join(tmp, "big.db")
+        start = time.perf_counter()
+        fill(path, args.rows)
+        print(f"\n{args.rows} rows loaded in {time.perf_counter() - start:.0f} s")
+
+        models.db.init(path, pragmas=models.PRAGMAS)
+        before = analysis_queries(args.rows)
+        start = time.perf_counter()
+        database.initialize_database()
+        migration = time.perf_counter() - start
+        after = analysis_queries(args.rows)
+        database.close_database()
+
+        print(f"  migration (creating indexes) {migration:.1f} s")
+        for name in before:
+            print(f"  {name:<32} {before[name] * 1000:9.1f} ms -> {after[name] * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
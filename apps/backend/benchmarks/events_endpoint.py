@@ -0,0 +1,99 @@
+'''
+Benchmarks GET /events/ on a large synthetic table: the old handler (the whole
+table as one JSON list) against a page of the keyset-paginated endpoint, a
+filtered page deep into the table, and an NDJSON stream of every row, giving
+response time and peak Python memory (traced, so times are inflated alike).
+
+Run from apps/backend:
+
+    python -m benchmarks.events_endpoint --rows 1000000
+'''
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+from fastapi import APIRouter, FastAPI
+
+import database
+import models
+from benchmarks.event_store import fill
+from models import Events
+
+
+def legacy_app():
+    '''The handler as it was: every row, as dicts, in one response'''
+    router = APIRouter()
+
+    async def get_all_events():
+        return list(Events.select().dicts())
+
+    router.add_api_route("/events/", get_all_events, methods=["GET"])
+    app = FastAPI()
+    app.include_router(router)
+    return app
+
+
+def current_app():
+    from main import API
+
+    app = FastAPI()
+    app.include_router(API().router)
+    return app
+
+
+async def fetch(app, params):
+    async with httpx.AsyncClient(app=app, base_url="http://bench", timeout=None) as client:
+        tracemalloc.start()
+        start = time.perf_counter()
+        size = 0
+        async with client.stream("GET", "/events/", params=params) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+        total = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return total, size, peak
+
+
+def report(name, total, size, peak):
+    print(
+        f"  {name:<34} {total * 1000:9.1f} ms"
+        f"  {size / 2**20:8.1f} MiB  peak memory {peak / 2**20:8.1f} MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "events.db")
+        fill(path, args.rows)
+        models.db.init(path, pragmas=models.PRAGMAS)
+        database.initialize_database()
+
+        app = current_app()
+        deep = 1_700_000_000_000 + 50 * (args.rows * 3 // 4)
+        print(f"{args.rows} events")
+        if not args.skip_legacy:
+            report("old handler, whole table", *asyncio.run(fetch(legacy_app(), {})))
+        report("first page of 1000", *asyncio.run(fetch(app, {})))
+        report("participant 7, late page", *asyncio.run(fetch(app, {
+            "participant_id": 7, "cursor": f"{deep}:0"})))
+        report("NDJSON, whole table", *asyncio.run(fetch(app, {"format": "ndjson"})))
+        report("NDJSON, time and event only", *asyncio.run(fetch(app, {
+            "format": "ndjson", "fields": "time,event"})))
+
+        database.close_database()
+
+
+if __name__ == "__main__":
+    main()
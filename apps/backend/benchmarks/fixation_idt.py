@@ -0,0 +1,76 @@
+'''
+Checks the sliding-window detect_fix_idt against the original implementation
+on synthetic traces, then times both over growing recording lengths and
+fixation lengths to show how each scales.
+
+Run from apps/backend:
+
+    python -m benchmarks.fixation_idt
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+import velocityThreshold
+from benchmarks import legacy
+from benchmarks.fixation_ivt import same_fixations
+from benchmarks.synthetic import gaze_trace
+
+
+def check_equivalence():
+    cases = [gaze_trace(n) for n in (0, 1, 2, 5, 7)]
+    cases += [gaze_trace(3_000, noise=noise, seed=seed) for seed in range(4) for noise in (0.005, 0.05, 0.3)]
+
+    holes = gaze_trace(3_000, seed=9)
+    holes.loc[holes.sample(60, random_state=0).index, ["x", "y"]] = np.nan
+    cases.append(holes)
+
+    for df in cases:
+        for dispval in (0.1, 0.5, 1., 3.):
+            for minwindow in (1, 6, 25):
+                old, _, _ = legacy.detect_fix_idt(df, dispval=dispval, minwindow=minwindow)
+                new, _, _ = velocityThreshold.detect_fix_idt(df, dispval=dispval, minwindow=minwindow)
+                assert same_fixations(old, new), f"fixations differ (dispval={dispval}, minwindow={minwindow})"
+    print(f"equivalent on {len(cases)} traces x 4 dispersions x 3 windows")
+
+
+def timed(detect, df, **kwargs):
+    start = time.perf_counter()
+    detect(df, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--max-samples", type=int, default=128_000)
+    parser.add_argument("--skip-legacy-above", type=float, default=30., help="seconds")
+    args = parser.parse_args()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        check_equivalence()
+
+    print(f"{'samples':>9} {'fixation':>9} {'minwindow':>9} {'original':>10} {'sliding':>10}")
+    for fixation in (100, 10_000, 1_000_000):
+        # gaze_trace fixations last 0.1-0.4 s, so pick the rate that gives
+        # fixations of roughly this many samples
+        rate = fixation / .25
+        samples = 4_000
+        legacy_slow = False
+        while samples <= args.max_samples:
+            df = gaze_trace(samples, rate=rate, noise=0.01)
+            for minwindow in (6, 60):
+                new = timed(velocityThreshold.detect_fix_idt, df, dispval=1, minwindow=minwindow)
+                if legacy_slow:
+                    old = "skipped"
+                else:
+                    seconds = timed(legacy.detect_fix_idt, df, dispval=1, minwindow=minwindow)
+                    legacy_slow = seconds > args.skip_legacy_above
+                    old = f"{seconds:9.3f}s"
+                print(f"{samples:>9} {fixation:>9} {minwindow:>9} {old:>10} {new:9.3f}s")
+            samples *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+'''
+Checks the vectorized detect_fix_ivt against the original per-sample loop on
+synthetic traces, then times both on a long recording.
+
+Run from apps/backend:
+
+    python -m benchmarks.fixation_ivt --samples 1000000
+'''
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import velocityThreshold
+from benchmarks import legacy
+from benchmarks.synthetic import gaze_trace
+
+
+def same_fixations(a, b):
+    if len(a) != len(b):
+        return False
+    return all(
+        np.allclose(a[c].astype(float), b[c].astype(float), equal_nan=True)
+        for c in velocityThreshold.FIXATION_COLUMNS
+    )
+
+
+def check(df, sacvel):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        old_fix, old_v, old_labels = legacy.detect_fix_ivt(df.copy(), sacvel=sacvel)
+    new_fix, new_v, new_labels = velocityThreshold.detect_fix_ivt(df.copy(), sacvel=sacvel)
+
+    assert same_fixations(old_fix, new_fix), f"fixations differ (sacvel={sacvel})"
+    if old_v is None:
+        assert new_v is None and new_labels is None
+    else:
+        assert np.array_equal(old_v, new_v, equal_nan=True), "velocities differ"
+        assert np.array_equal(old_labels, new_labels), "labels differ"
+
+
+def check_equivalence():
+    cases = [
+        gaze_trace(0),
+        gaze_trace(1),
+        gaze_trace(2),
+        pd.DataFrame({"x": np.zeros(50), "y": np.zeros(50), "ts": np.arange(50) / 250}),
+    ]
+    cases += [gaze_trace(5_000, noise=noise, seed=seed) for seed in range(5) for noise in (0.005, 0.02, 0.1)]
+
+    # invalid samples that slipped through as NaN
+    holes = gaze_trace(5_000, seed=9)
+    holes.loc[holes.sample(100, random_state=0).index, ["x", "y"]] = np.nan
+    cases.append(holes)
+
+    for df in cases:
+        for sacvel in (5., 20., 80.):
+            check(df, sacvel)
+    print(f"equivalent on {len(cases)} traces x 3 thresholds")
+
+
+def timed(detect, df, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        detect(df.copy())
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--samples", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    check_equivalence()
+
+    df = gaze_trace(args.samples)
+    old = timed(legacy.detect_fix_ivt, df, 1)
+    new = timed(velocityThreshold.detect_fix_ivt, df, args.repeat)
+    print(f"{args.samples} samples: loop {old:.3f} s, vectorized {new:.3f} s ({old / new:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+'''
+Times loading a gaze recording from the JSON document Tobii.stop_tracking used
+to write against the columnar session format, for the whole file and for the
+few columns a typical analysis reads.
+
+Run from apps/backend:
+
+    python -m benchmarks.gaze_loading --minutes 30
+'''
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import simplejson
+
+import gazefile
+from benchmarks.synthetic import tobii_session
+
+COLUMNS = ("system_time_stamp", "left_gaze_point_on_display_area", "left_gaze_point_validity")
+
+
+def timed(f):
+    start = time.perf_counter()
+    result = f()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--minutes", type=float, default=30)
+    parser.add_argument("--rate", type=int, default=250)
+    args = parser.parse_args()
+
+    session = tobii_session(args.minutes * 60, rate=args.rate)
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "[1]-2023-11-14_22-13-20.json")
+        with open(json_path, "w") as f:
+            f.write(simplejson.dumps(session, ignore_nan=True))
+        del session
+
+        convert, path = timed(lambda: gazefile.convert_json(json_path))
+
+        def json_columns():
+            with open(json_path, "r") as f:
+                data = json.load(f)["data"]
+            return {
+                name: np.array([packet[name] for packet in data], dtype=float)
+                for name in COLUMNS
+            }
+
+        def columnar_columns():
+            session = gazefile.open_session(path)
+            return {name: np.asarray(session[name]) for name in COLUMNS}
+
+        def columnar_all():
+            session = gazefile.open_session(path, mmap=False)
+            return session.load(*session.columns)
+
+        load_json, _ = timed(json_columns)
+        load_columns, _ = timed(columnar_columns)
+        load_all, _ = timed(columnar_all)
+
+        json_size = os.path.getsize(json_path)
+        columnar_size = sum(
+            os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+        )
+
+    print(f"{args.minutes:g} min at {args.rate} Hz")
+    print(f"  json:     {json_size / 2**20:8.1f} MB, load + extract {len(COLUMNS)} columns {load_json * 1000:9.1f} ms")
+    print(f"  columnar: {columnar_size / 2**20:8.1f} MB, read {len(COLUMNS)} columns {load_columns * 1000:9.1f} ms, read all {load_all * 1000:9.1f} ms")
+    print(f"  one-off conversion {convert:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
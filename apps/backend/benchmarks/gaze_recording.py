@@ -0,0 +1,101 @@
+'''
+Drives SessionRecorder with a synthetic tracker callback, by default at the
+1200 Hz of the fastest Tobii trackers, and reports dropped samples, callback
+latency and resident memory over the run.
+
+Run from apps/backend:
+
+    python -m benchmarks.gaze_recording --minutes 180
+    python -m benchmarks.gaze_recording --minutes 180 --unpaced
+
+--unpaced pushes samples as fast as the callback allows instead of at the
+tracker rate, which compresses hours of recording into minutes and shows
+whether the writer keeps up.
+'''
+
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+import gazefile
+from benchmarks.synthetic import tobii_session
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # ru_maxrss is the peak rather than the current size, but it is all
+        # there is outside Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--rate", type=int, default=1200)
+    parser.add_argument("--unpaced", action="store_true")
+    parser.add_argument("--report-every", type=float, default=60, help="recorded seconds")
+    args = parser.parse_args()
+
+    templates = tobii_session(1, rate=args.rate)["data"]
+    period_us = 1_000_000 // args.rate
+    samples = int(args.minutes * 60 * args.rate)
+    batch = max(args.rate // 100, 1)
+
+    # latencies of the current report window only, so the benchmark's own
+    # memory doesn't grow with the recording
+    latencies = np.empty(int(args.report_every * args.rate) + 1, dtype=np.int64)
+    pending = 0
+    worst = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        recorder = gazefile.SessionRecorder(os.path.join(tmp, "[1]-bench"), {"participantId": 1})
+        print(f"{'recorded':>9} {'dropped':>8} {'p50 us':>7} {'p99 us':>7} {'max us':>7} {'rss MB':>7}")
+
+        start = time.perf_counter()
+        system = templates[0]["system_time_stamp"]
+        for i in range(samples):
+            packet = dict(templates[i % len(templates)])
+            packet["system_time_stamp"] = system + i * period_us
+
+            t = time.perf_counter_ns()
+            recorder.push(packet)
+            latencies[pending] = time.perf_counter_ns() - t
+            pending += 1
+
+            if not args.unpaced and i % batch == 0:
+                # the tracker delivers samples on its own clock; sleep until
+                # this batch is due
+                ahead = start + i / args.rate - time.perf_counter()
+                if ahead > 0:
+                    time.sleep(ahead)
+
+            if pending == len(latencies) or i + 1 == samples:
+                reported = (i + 1) / args.rate
+                window = latencies[:pending] / 1000
+                worst = max(worst, window.max())
+                pending = 0
+                print(
+                    f"{reported / 60:8.1f}m {recorder.dropped:>8}"
+                    f" {np.percentile(window, 50):7.1f} {np.percentile(window, 99):7.1f}"
+                    f" {window.max():7.0f} {rss_mb():7.1f}"
+                )
+
+        path = recorder.close(end_time=0)
+        elapsed = time.perf_counter() - start
+        session = gazefile.open_session(path)
+        print(
+            f"{len(session)} of {samples} samples on disk, {recorder.dropped} dropped,"
+            f" {recorder.bytes_written / 2**20:.1f} MB written in {elapsed:.1f} s;"
+            f" slowest callback {worst:.0f} us against a {period_us} us tracker period"
+        )
+
+
+if __name__ == "__main__":
+    main()
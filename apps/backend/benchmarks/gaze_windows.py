@@ -0,0 +1,84 @@
+'''
+Times page-window extraction and "first valid sample" lookups with
+GazeSession against the list scans in utils, for many event windows over one
+session, and checks both give the same samples.
+
+Run from apps/backend:
+
+    python -m benchmarks.gaze_windows --minutes 10 --windows 2000
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+import utils
+from benchmarks.synthetic import tobii_session
+from gazesession import GazeSession
+
+VALIDITY = ("left_gaze_point_validity", "right_gaze_point_validity")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--windows", type=int, default=2000)
+    parser.add_argument("--legacy-windows", type=int, default=200, help="windows timed with the utils scans")
+    args = parser.parse_args()
+
+    gaze_data = tobii_session(args.minutes * 60)
+    session = GazeSession(gaze_data)
+
+    rng = np.random.default_rng(0)
+    start = gaze_data["start_time"]
+    length = args.minutes * 60_000
+    starts = np.sort(rng.uniform(start, start + length - 30_000, args.windows)).astype(np.int64)
+    ends = starts + rng.uniform(2_000, 30_000, args.windows).astype(np.int64)
+    legacy = min(args.legacy_windows, args.windows)
+
+    for a, b in zip(starts[:20], ends[:20]):
+        expected = utils.extract_gaze_data_between_timestamps_proper(gaze_data, a, b)["data"]
+        window = session.window(a, b)
+        assert len(expected) == len(window)
+        assert [p["system_time_stamp"] for p in expected] == window.timestamps.tolist()
+
+        packet = utils.find_gaze_packet_at_timestamp(gaze_data, a, VALIDITY)
+        assert packet["system_time_stamp"] == session.timestamps[session.first_valid(a, VALIDITY)]
+
+    t = time.perf_counter()
+    for a, b in zip(starts[:legacy], ends[:legacy]):
+        utils.extract_gaze_data_between_timestamps_proper(gaze_data, a, b)
+    old_window = (time.perf_counter() - t) / legacy
+
+    t = time.perf_counter()
+    for a in starts[:legacy]:
+        utils.find_gaze_packet_at_timestamp(gaze_data, a, VALIDITY)
+    old_first = (time.perf_counter() - t) / legacy
+
+    t = time.perf_counter()
+    build = GazeSession(gaze_data)
+    build_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for a, b in zip(starts, ends):
+        build.window(a, b)["left_gaze_point_on_display_area"]
+    new_window = (time.perf_counter() - t) / args.windows
+
+    t = time.perf_counter()
+    for a in starts:
+        build.first_valid(a, VALIDITY)
+    new_first = (time.perf_counter() - t) / args.windows
+
+    print(f"{len(session)} samples, {args.windows} windows ({legacy} timed with utils)")
+    print(f"  window:      utils {old_window * 1e6:10.1f} us  GazeSession {new_window * 1e6:8.1f} us")
+    print(f"  first valid: utils {old_first * 1e6:10.1f} us  GazeSession {new_first * 1e6:8.1f} us")
+    print(f"  building the session from the JSON dict: {build_time * 1000:.0f} ms once")
+    print(
+        f"  all {args.windows} windows: utils ~{old_window * args.windows:.1f} s,"
+        f" GazeSession {new_window * args.windows + build_time:.2f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+'''
+Times heatmap rendering against the notebook's matplotlib scatter.
+
+plot-data-on-image-with-pupil-size.ipynb drew every gaze sample of a page
+as a scatter point over the screenshot; heatmap.render bins, blurs and
+blends them with NumPy. Both are timed to a PNG for a one minute page and
+for a whole hour-long session, then render_participant is timed on every
+page of a synthetic book (raw samples, and I-VT fixations weighted by
+duration with the scanpath drawn).
+
+Run from apps/backend:
+
+    python -m benchmarks.heatmap --minutes 30
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import gazefile
+import heatmap
+import utils
+from benchmarks.screenshots import page
+from benchmarks.synthetic import gaze_columns
+from geometry import X_PIXELS, Y_PIXELS
+from segmentation import gaze_file_name
+from utils import Events
+
+PARTICIPANT = 5
+START_EPOCH = 1_700_000_000
+
+
+def scatter(columns, screenshot_file, out):
+    '''The notebook's plot, saved instead of shown'''
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    valid = columns["left_gaze_point_validity"] == 1
+    point = columns["left_gaze_point_on_display_area"][valid]
+    pupil = columns["left_pupil_diameter"][valid]
+    fig, ax = plt.subplots(figsize=(X_PIXELS / 100, Y_PIXELS / 100))
+    ax.set_xlim(0, X_PIXELS)
+    ax.set_ylim(Y_PIXELS, 0)
+    ax.imshow(plt.imread(screenshot_file), extent=[0, X_PIXELS, Y_PIXELS, 0])
+    p = ax.scatter(point[:, 0] * X_PIXELS, point[:, 1] * Y_PIXELS, c=pupil, cmap="plasma", s=1)
+    fig.colorbar(p, ax=ax)
+    fig.savefig(out)
+    plt.close(fig)
+
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def write_book(folder, minutes, page_seconds):
+    '''A recorded book of one participant: gaze file, screenshots and events'''
+    screenshots = os.path.join(folder, "screenshots")
+    os.makedirs(screenshots)
+    open_time = START_EPOCH * 1000
+    columns = gaze_columns(minutes * 60, seed=PARTICIPANT, pupils=True)
+    header = {
+        "participantId": PARTICIPANT,
+        "start_time": open_time,
+        "system_start_time_mono": int(columns["system_time_stamp"][0]) * 1000,
+        "system_start_time_epoch": START_EPOCH,
+    }
+    gazefile.write_columns(
+        os.path.join(folder, gaze_file_name(PARTICIPANT, open_time)[:-len(gazefile.SUFFIX)]),
+        header,
+        columns,
+    )
+
+    rows = []
+    times = range(open_time, open_time + int(minutes * 60_000), page_seconds * 1000)
+    for i, t in enumerate(times):
+        screenshot_file = os.path.join(screenshots, f"{i}.png")
+        page(i, 0, np.random.default_rng(i)).image().save(screenshot_file, compress_level=1)
+        rows.append(dict(
+            time=t,
+            agent="USER",
+            event="OPEN_BOOK" if i == 0 else "NEXT_PAGE",
+            participant_id=PARTICIPANT,
+            new_value="Chasing Sunsets - " if i == 0 else None,
+            screenshot_file=screenshot_file,
+        ))
+    rows.append(dict(
+        time=open_time + int(minutes * 60_000), agent="USER", event="CLOSE_BOOK",
+        participant_id=PARTICIPANT,
+    ))
+    Events.insert_many(rows).execute()
+    return len(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--minutes", type=float, default=30, help="length of the book")
+    parser.add_argument("--page-seconds", type=int, default=20)
+    parser.add_argument("--skip-scatter", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        screenshot_file = os.path.join(tmp, "page.png")
+        page(0, 0, np.random.default_rng(0)).image().save(screenshot_file, compress_level=1)
+        out = os.path.join(tmp, "out.png")
+        print("one window to PNG:")
+        for minutes in (1, 60):
+            columns = gaze_columns(minutes * 60, pupils=True)
+            samples = len(columns["system_time_stamp"])
+            new, _ = timed(heatmap.render, columns, screenshot_file, out=out, eye="left")
+            line = f"  {samples:7d} samples  heatmap {new * 1000:8.1f} ms"
+            if not args.skip_scatter:
+                old, _ = timed(scatter, columns, screenshot_file, out)
+                line += f"  scatter {old * 1000:9.1f} ms  ({old / new:.0f}x)"
+            print(line)
+
+        utils.db.init(os.path.join(tmp, "events.db"))
+        utils.db.create_tables([Events])
+        pages = write_book(tmp, args.minutes, args.page_seconds)
+        print(f"every page of a {args.minutes} minute book ({pages} pages):")
+        for name, options in (
+            ("samples", {}),
+            ("fixations + scanpath", {"weight": "duration", "scanpath": True, "sacvel": 80}),
+        ):
+            seconds, written = timed(
+                heatmap.render_participant, PARTICIPANT, os.path.join(tmp, name),
+                eye="left", folder=tmp, **options,
+            )
+            print(f"  {name:<22} {seconds:6.2f} s, {seconds / len(written) * 1000:6.1f} ms per page")
+        utils.db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+'''
+Measures what the metrics and the sampling profiler cost.
+
+Times a histogram update with the metrics enabled and disabled, the tracker's
+gaze callback (recording and live detection) with and without them, rendering
+/metrics, and a CPU-bound workload (the I-VT detector) with the profiler
+sampling every thread and without.
+
+Run from apps/backend:
+
+    python -m benchmarks.instrumentation --seconds 300
+'''
+
+import argparse
+import os
+import tempfile
+import time
+from functools import partial
+
+import gazefile
+import livedetection
+import metrics
+import profiler
+from benchmarks.synthetic import gaze_trace, tobii_session
+from tobiilsl.tobii_tracking import Tobii
+
+# repetitions of the I-VT detector the profiler watches
+RUNS = 50
+
+
+def per_call(f, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        f()
+    return (time.perf_counter() - start) / calls
+
+
+def callback_cost(packets, folder):
+    '''Seconds per packet of Tobii.gaze_data_callback, without a tracker'''
+    tracker = Tobii.__new__(Tobii)
+    tracker.recorder = gazefile.SessionRecorder(os.path.join(folder, "[1]-bench"), {"participantId": 1})
+    tracker.live = livedetection.LiveSession(1, 0, eye="left", detector="ivt", sacvel=80)
+    tracker.last_sample_time = None
+    start = time.perf_counter()
+    for packet in packets:
+        tracker.gaze_data_callback(packet)
+    seconds = time.perf_counter() - start
+    tracker.recorder.close()
+    return seconds / len(packets)
+
+
+def detector_seconds(df, profiled, runs=RUNS):
+    from velocityThreshold import detect_fix_ivt
+
+    sampler = profiler.SamplingProfiler().start() if profiled else None
+    start = time.perf_counter()
+    for _ in range(runs):
+        detect_fix_ivt(df, sacvel=80)
+    seconds = time.perf_counter() - start
+    if sampler is not None:
+        sampler.finish()
+        sampler.join()
+        return seconds, sampler.samples
+    return seconds, 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--seconds", type=float, default=300, help="gaze recording to replay")
+    parser.add_argument("--calls", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    histogram = metrics.CAPTURE_STAGE_SECONDS.labels("grab")
+    print("one histogram update:")
+    for enabled in (True, False):
+        metrics.enable(enabled)
+        seconds = per_call(partial(histogram.observe, .01), args.calls)
+        print(f"  {'enabled' if enabled else 'disabled':<8} {seconds * 1e9:6.0f} ns")
+
+    packets = tobii_session(args.seconds)["data"]
+    print(f"gaze callback, {len(packets)} packets (4 ms apart):")
+    with tempfile.TemporaryDirectory() as tmp:
+        for enabled in (False, True):
+            metrics.enable(enabled)
+            seconds = callback_cost(packets, os.path.join(tmp, str(enabled)))
+            print(f"  metrics {'enabled' if enabled else 'disabled':<8} {seconds * 1e6:6.2f} us per packet")
+    metrics.enable(True)
+
+    seconds = per_call(metrics.render, 1000)
+    print(f"render /metrics: {seconds * 1000:.2f} ms, {len(metrics.render())} bytes")
+
+    df = gaze_trace(int(args.seconds * 250))
+    print(f"I-VT on {len(df)} samples, {RUNS} runs:")
+    plain, _ = detector_seconds(df, False)
+    profiled, samples = detector_seconds(df, True)
+    print(f"  unprofiled {plain:6.2f} s")
+    print(f"  profiled   {profiled:6.2f} s ({profiled / plain - 1:+.1%}), {samples} samples")
+
+
+if __name__ == "__main__":
+    main()
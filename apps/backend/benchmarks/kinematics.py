@@ -0,0 +1,75 @@
+'''
+Checks kinematics() against the per-packet velocity loop in velocity.ipynb on
+a synthetic recording, then times both, and times kinematics() alone with
+each smoothing on recordings of up to tens of millions of samples.
+
+Run from apps/backend:
+
+    python -m benchmarks.kinematics --minutes 10 --max-samples 32000000
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+import kinematics
+from benchmarks.synthetic import gaze_columns, tobii_session
+from gazesession import GazeSession
+from utils import DEGREES_PER_PIXEL, X_PIXELS, Y_PIXELS
+
+
+def notebook_velocities(gaze_data, dominant_eye):
+    '''The loop from velocity.ipynb'''
+    timestamps = []
+    velocities = []
+    for a, b in zip(gaze_data, gaze_data[1:]):
+        if a[f"{dominant_eye}_gaze_point_validity"] == 0 or b[f"{dominant_eye}_gaze_point_validity"] == 0:
+            continue
+
+        delta_x = (b[f"{dominant_eye}_gaze_point_on_display_area"][0] - a[f"{dominant_eye}_gaze_point_on_display_area"][0]) * X_PIXELS
+        delta_y = (b[f"{dominant_eye}_gaze_point_on_display_area"][1] - a[f"{dominant_eye}_gaze_point_on_display_area"][1]) * Y_PIXELS
+
+        distance = np.sqrt(delta_x ** 2 + delta_y ** 2) * DEGREES_PER_PIXEL
+
+        velocity = distance / (b["system_time_stamp"] - a["system_time_stamp"]) * 1_000_000
+
+        timestamps.append(b["system_time_stamp"])
+        velocities.append(velocity)
+    return timestamps, velocities
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--minutes", type=float, default=10, help="recording compared with the notebook loop")
+    parser.add_argument("--max-samples", type=int, default=32_000_000)
+    args = parser.parse_args()
+
+    gaze_data = tobii_session(args.minutes * 60)
+    session = GazeSession(gaze_data)
+    for eye in ("left", "right"):
+        start = time.perf_counter()
+        timestamps, velocities = notebook_velocities(gaze_data["data"], eye)
+        old = time.perf_counter() - start
+        start = time.perf_counter()
+        k = kinematics.kinematics(session, eye=eye)
+        new = time.perf_counter() - start
+
+        assert timestamps == k.ts[k.valid].tolist()
+        assert np.allclose(velocities, k.velocity[k.valid])
+        print(f"{eye:>5} eye, {len(session)} samples: notebook loop {old:.3f} s, kinematics {new:.4f} s")
+
+    print(f"\n{'samples':>10} {'smoothing':>9} {'eye':>9} {'seconds':>8}")
+    samples = 1_000_000
+    while samples <= args.max_samples:
+        columns = gaze_columns(samples / 250)
+        for smoothing in kinematics.SMOOTHING:
+            for eye in ("left", "binocular"):
+                start = time.perf_counter()
+                kinematics.kinematics(columns, eye=eye, smoothing=smoothing, window=7)
+                print(f"{samples:>10} {str(smoothing):>9} {eye:>9} {time.perf_counter() - start:8.3f}")
+        samples *= 4
+
+
+if __name__ == "__main__":
+    main()
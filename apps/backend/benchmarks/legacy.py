@@ -0,0 +1,280 @@
+'''
+Reference copies of the detectors in velocityThreshold.py as they were before
+they were vectorized, and of the participant metadata lookups and the
+saccade classification and the database merge in utils.py as they were
+before the registry, reading.py and merge.py, and of the tracker discovery
+Tobii.__init__ ran for every participant before TrackerManager. The
+benchmarks time against these and check that the new implementations give
+the same answers.
+'''
+
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+
+def calcDelta(df):
+    '''Return euclidian distance between adjacent points'''
+    return np.sqrt(np.diff(df.x, prepend=[0])**2 + np.diff(df.y, prepend=[0])**2)
+
+def calcVelocity(df):
+    '''Return velocity to reach point at given time'''
+    return np.divide(calcDelta(df), np.diff(df.ts, prepend=[1]))
+
+def detect_fix_ivt(df, sacvel = 20.):
+    '''
+    I-VT Saccadic Detection (Salvucci and Goldberg (2000))
+    Code based very loosely on gians repo code (https://github.com/gian/eventdetect)
+    '''
+    
+    def describe_fix(fixation, fixnr):
+        '''return a description of the fixation (nparray!) as a tupple'''
+
+        start = fixation[0,0]
+        l = fixation[-1,0] - start
+        xs = fixation[:,1]
+        ys = fixation[:,2]
+
+        if len(fixation)>1:
+            cov = np.cov(xs, ys)
+            sx = np.sqrt(cov[0,0])
+            sy = np.sqrt(cov[1,1])
+            rho = cov[0,1] / (sx*sy)
+        else:
+            sx = sy = rho = 0
+
+        return (start, l, fixation[0,3], len(fixation), np.mean(xs), np.mean(ys), sx, sy, rho)
+    
+    if df.size == 0:
+        return pd.DataFrame([], columns = ("ts", "len", "i", "n", "x", "y", "sx", "sy", "rho")), None, None
+    v = calcVelocity(df)
+    x = df.x.values
+    y = df.y.values
+    ts = df.ts.values
+    
+    v[0] = 10000.
+    
+    labels = np.zeros(len(v))
+    fixnr = 1   
+    fixation = []
+    fixations = []
+    prev = 0
+    for i in range(len(v)):
+        if v[i] < sacvel:
+            fixation.append((ts[prev], x[prev], y[prev], prev))
+            labels[prev] = fixnr
+            prev = i
+        elif len(fixation)==0: # and v[i] >= sacvel:
+            prev = i
+            continue
+        else:
+            # emit fixation
+            labels[prev] = fixnr
+            fixation.append((ts[prev], x[prev], y[prev], prev))
+            
+            fixations.append(describe_fix(np.array(fixation), fixnr))
+            fixnr += 1
+            
+            fixation = []
+            prev = i
+            
+                
+    if len(fixation)>0:
+        labels[i] = fixnr
+        fixations.append(describe_fix(np.array(fixation), fixnr))
+        
+    fixations = pd.DataFrame(fixations, 
+                             columns = ("ts", "len", "i", "n", "x", "y", "sx", "sy", "rho"))
+    return fixations, v, labels
+
+def detect_fix_idt(df, dispval = 1, minwindow = 6):
+    '''
+    I-DT Fixation Detetion (Salvucci and Goldberg (2000))
+    Code based very loosely on gians repo code (https://github.com/gian/eventdetect)
+    '''
+    
+    def dispersion(x, y, start, length):
+
+        if length == 0:
+            return np.nan()
+
+        minxy = np.min((x[start:start+length+1], y[start:start+length+1]), axis=1)
+        maxxy = np.max((x[start:start+length+1], y[start:start+length+1]), axis=1)
+
+        return np.sum(maxxy - minxy)
+        
+
+    def describe_fix(x, y, ts, start, length):
+        '''return a description of the fixation as a tupple'''
+
+        s = ts[start]
+        l = ts[start+length-1] - s
+        
+        if length>1:
+            cov = np.cov(x[start:start+length], y[start:start+length])
+            sx = np.sqrt(cov[0,0])
+            sy = np.sqrt(cov[1,1])
+            rho = cov[0,1] / (sx*sy)
+        else:
+            sx = sy = rho = 0
+
+        return (s, l, start, length, np.mean(x[start:start+length]), np.mean(y[start:start+length]), sx, sy, rho)
+
+    x = df.x.values
+    y = df.y.values
+    ts = df.ts.values
+    
+    fixations = []
+    i = 0
+    while (i<len(x)):
+        
+        l = np.min((minwindow, len(x)-i))
+        d = dispersion(x, y, i, l)
+        
+        if (d<=dispval):
+            while ((d<=dispval) and (i+l < len(x))):
+                l += 1
+                d = dispersion(x, y, i, l)
+                
+            fixations.append(describe_fix(x, y, ts, i, l))
+            i += l
+        else:
+            i += 1
+            
+    fixations = pd.DataFrame(fixations, 
+                             columns = ("ts", "len", "i", "n", "x", "y", "sx", "sy", "rho"))
+    return fixations, None, None
+
+def find_sacc_from_fix(fixations):
+    '''Return saccades from periods between fixations'''
+    saccades = []
+    
+    # pi = px = py = pts = 
+    pi = fixations.i[0]
+    px = fixations.x[0]
+    py = fixations.y[0]
+    pts = fixations.ts[0]
+
+    for i, f in fixations[1:].iterrows():
+        a = np.max((0, pi-1))
+        b = f.i
+        dx = f.x - px
+        dy = f.y - py
+        dxy = np.sqrt(dx**2 + dy**2)
+        dts = f.ts - pts
+        
+        if a != b:
+            # saccades.append((a, b, b - a, dxy, dts*1000))
+
+            saccades.append((pts, dts, a, b - a, dxy, dts*1000))
+
+        pi = f.i + f.n
+        pts = f.ts + f.len
+        px = f.x
+        py = f.y
+
+    return pd.DataFrame(saccades, columns = ("ts", "len", "i", "n", "dxy", "dts"))
+
+
+def get_participant_treatment(participant_id):
+    with open("participants.json", "r") as f:
+        participants = json.load(f)
+    participant = participants.get(str(participant_id))
+    if participant is None:
+       raise Exception(f"Participant {participant_id} not found in participants.json")
+    split = participant.get("split")
+    group = participant.get("group")
+    if split is None or group is None:
+        raise Exception(f"Participant {participant_id} does not have a treatment")
+    return f"Treatment {split},{group}"
+
+def load_treatment_settings(treatment):
+    with open("treatments.json", "r") as f:
+        treatments = json.load(f)
+    treatment = next((t for t in treatments if treatment in t['name']), None)
+    if treatment is None:
+        raise Exception(f"Treatment {treatment} not found in treatments.json")
+    return treatment
+
+def get_participant_dominant_eye(participant_id):
+    with open("participants.json", "r") as f:
+        participants = json.load(f)
+    participant = participants.get(str(participant_id))
+    if participant is None:
+        return "right"
+    eye = participant.get("dominant_eye")
+    if eye is None:
+        return "right"
+    return eye.lower()
+
+def identify_saccade_type_with_color(point_a, point_b):
+    dx = point_b[0] - point_a[0]
+    dy = point_b[1] - point_a[1]
+
+    angle_rad = np.arctan2(dy, dx)
+
+    # Convert the angle to degrees
+    angle = np.rad2deg(angle_rad)
+
+    # Adjust the angle to be in the range of 0 to 360 degrees
+    if angle < 0:
+        angle = angle + 360
+
+    angle = 360 - angle
+
+    if 0 <= angle <= 20 or 340 <= angle <= 360:
+        color = "green" # saccade
+    elif 45 <= angle <= 182:
+        color = "red" # regression
+    elif 182 < angle <= 200:
+        color = "blue" # return sweep
+    else:
+        color = "purple" # unknown movement
+    
+    return color
+
+
+def merge_databases(other_database_name, database_name="events.db"):
+    '''utils.merge_databases, with sqlite3 instead of peewee and the target as a parameter'''
+    db = sqlite3.connect(database_name)
+    db.executescript(
+        f"""
+        ATTACH '{other_database_name}' AS db2;
+        INSERT INTO events (
+            time,
+            agent,
+            event,
+            participant_id,
+            old_value,
+            new_value,
+            screenshot_file
+        )
+        SELECT
+            time,
+            agent,
+            event,
+            participant_id,
+            old_value,
+            new_value,
+            screenshot_file
+        FROM db2.events;
+        DETACH db2;
+        """
+    )
+    db.close()
+
+
+def select_treatment(sdk, license_path):
+    '''What Tobii.__init__ did on every SELECT_TREATMENT: find the tracker and license it'''
+    trackers = sdk.find_all_eyetrackers()
+    if len(trackers) == 0:
+        # this was exit(1)
+        raise RuntimeError("No Eye Trackers found!?")
+    tracker = trackers[0]
+    if os.path.exists(license_path):
+        with open(license_path, "rb") as f:
+            tracker.apply_licenses(f.read())
+    return tracker
@@ -0,0 +1,116 @@
+'''
+Checks the online detectors in livedetection against velocityThreshold and
+measures what LiveSession.push adds to every tracker callback.
+
+Synthetic traces (with dropped samples on some) go through OnlineIVT,
+OnlineIDT and SaccadeBuilder one sample at a time, and the resulting tables
+are compared with detect_fix_ivt, detect_fix_idt and find_sacc_from_fix on
+the whole trace. Then a recorded-like session is replayed packet by packet
+and the per-packet time is set against the 4 ms between samples at 250 Hz.
+
+Run from apps/backend:
+
+    python -m benchmarks.live_detection --seconds 600
+'''
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import livedetection
+from benchmarks.synthetic import gaze_trace, tobii_session
+from livedetection import FIXATION_COLUMNS, SACCADE_COLUMNS, LiveSession
+from velocityThreshold import detect_fix_idt, detect_fix_ivt, find_sacc_from_fix
+
+
+def replay(online, df):
+    fixations = []
+    for x, y, ts in zip(df.x.tolist(), df.y.tolist(), df.ts.tolist()):
+        fixations.extend(online.push(x, y, ts))
+    fixations.extend(online.finish())
+    return pd.DataFrame(fixations, columns=FIXATION_COLUMNS)
+
+
+def saccades(fixations):
+    builder = livedetection.SaccadeBuilder()
+    found = [builder.push(f) for f in fixations.to_dict("records")]
+    return pd.DataFrame([s for s in found if s], columns=SACCADE_COLUMNS)
+
+
+def same(expected, actual, columns):
+    if len(expected) != len(actual):
+        return False
+    return all(
+        np.allclose(
+            expected[c].to_numpy(dtype=float), actual[c].to_numpy(dtype=float),
+            rtol=1e-9, atol=1e-12, equal_nan=True,
+        )
+        for c in columns
+    )
+
+
+def check(samples, seeds):
+    checked = mismatched = 0
+    for seed in range(seeds):
+        for noise in (0.005, 0.05, 0.3):
+            df = gaze_trace(samples, noise=noise, seed=seed)
+            if seed % 2:
+                dropped = np.random.default_rng(seed).choice(samples, samples // 50, replace=False)
+                df.loc[dropped, ["x", "y"]] = np.nan
+            with np.errstate(invalid="ignore", divide="ignore"):
+                for sacvel in (5, 20, 80):
+                    offline = detect_fix_ivt(df.copy(), sacvel=sacvel)[0]
+                    online = replay(livedetection.OnlineIVT(sacvel), df)
+                    checked += 2
+                    if not same(offline, online, FIXATION_COLUMNS):
+                        mismatched += 1
+                        print(f"  I-VT differs: seed {seed}, noise {noise}, sacvel {sacvel}")
+                    elif len(offline) >= 2 and not same(find_sacc_from_fix(offline), saccades(online), SACCADE_COLUMNS):
+                        mismatched += 1
+                        print(f"  saccades differ: seed {seed}, noise {noise}, sacvel {sacvel}")
+                for dispval in (0.5, 1., 3.):
+                    for minwindow in (6, 25):
+                        offline = detect_fix_idt(df, dispval=dispval, minwindow=minwindow)[0]
+                        online = replay(livedetection.OnlineIDT(dispval, minwindow), df)
+                        checked += 1
+                        if not same(offline, online, FIXATION_COLUMNS):
+                            mismatched += 1
+                            print(f"  I-DT differs: seed {seed}, noise {noise}, dispval {dispval}, minwindow {minwindow}")
+    return checked, mismatched
+
+
+def overhead(seconds, detector, **params):
+    packets = tobii_session(seconds)["data"]
+    session = LiveSession(1, 0, eye="left", detector=detector, **params)
+    start = time.perf_counter()
+    for packet in packets:
+        session.push(packet)
+    session.finish()
+    total = time.perf_counter() - start
+    return total / len(packets), session.snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--samples", type=int, default=5000)
+    parser.add_argument("--seeds", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=600)
+    args = parser.parse_args()
+
+    checked, mismatched = check(args.samples, args.seeds)
+    print(f"{checked} comparisons with the offline detectors, {mismatched} mismatched")
+
+    period = 1 / 250
+    for detector, params in (("ivt", {"sacvel": 80}), ("idt", {"dispval": 1., "minwindow": 25})):
+        per_packet, stats = overhead(args.seconds, detector, **params)
+        print(
+            f"  {detector}: {per_packet * 1e6:6.1f} us per packet"
+            f" ({per_packet / period:.2%} of the 4 ms sample period),"
+            f" {stats['fixation_count']} fixations, {stats['saccade_count']} saccades"
+        )
+
+
+if __name__ == "__main__":
+    main()
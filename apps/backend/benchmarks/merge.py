@@ -0,0 +1,107 @@
+'''
+Times merging another station's events.db into this one.
+
+The old utils.merge_databases copied every row of the other database each
+time it was run; merge.merge upserts on the natural key. Both merge a
+synthetic station database into a fresh one twice, which shows the old merge
+duplicating every event and the new one adding nothing the second time.
+Then the station records more events and the new merge is run again, which
+only reads the rows added since.
+
+Run from apps/backend:
+
+    python -m benchmarks.merge --rows 2000000
+'''
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+import merge
+from benchmarks.event_store import EVENTS, WEIGHTS
+from benchmarks.legacy import merge_databases as old_merge
+
+TIME_BASE = 1_700_000_000_000
+
+
+def record(path, start, rows, participants=400, seed=0):
+    '''Append rows to a station's database, created with the current schema if new'''
+    merge.migrate(path)
+    rng = np.random.default_rng(seed + start)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=off")
+    chunk = 500_000
+    for offset in range(start, start + rows, chunk):
+        n = min(chunk, start + rows - offset)
+        times = TIME_BASE + (offset + np.arange(n)) * 50
+        participant = rng.integers(0, participants, n)
+        events = rng.choice(EVENTS, n, p=WEIGHTS)
+        screenshots = [f"screenshots/{seed}-{i}.png" for i in range(offset, offset + n)]
+        conn.executemany(
+            "INSERT INTO events (time, agent, event, participant_id, old_value, new_value, screenshot_file)"
+            " VALUES (?, 'USER', ?, ?, NULL, NULL, ?)",
+            zip(times.tolist(), events.tolist(), participant.tolist(), screenshots),
+        )
+        conn.commit()
+    conn.close()
+
+
+def count(path):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT count(*) FROM events").fetchone()[0]
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, default=2_000_000, help="rows of the station database")
+    parser.add_argument("--new-rows", type=int, default=100_000, help="rows recorded before the next merge")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        station = os.path.join(tmp, "station.db")
+        start = time.perf_counter()
+        record(station, 0, args.rows)
+        print(f"station database of {args.rows} rows written in {time.perf_counter() - start:.0f} s")
+
+        target = os.path.join(tmp, "old.db")
+        merge.migrate(target)
+        print("old merge (INSERT ... SELECT everything):")
+        for attempt in (1, 2):
+            start = time.perf_counter()
+            old_merge(station, target)
+            seconds = time.perf_counter() - start
+            print(
+                f"  run {attempt}: {seconds:6.1f} s, {args.rows / seconds:9.0f} rows/s,"
+                f" {count(target)} rows in the target"
+            )
+
+        target = os.path.join(tmp, "new.db")
+        print("new merge (upsert on the natural key):")
+        for attempt in (1, 2):
+            result = merge.merge(station, target)
+            print(
+                f"  run {attempt}: {result['seconds']:6.1f} s, {result['rows_per_second']:9.0f} rows/s,"
+                f" {result['inserted']} inserted, {count(target)} rows in the target"
+            )
+        result = merge.merge(station, target, full=True)
+        print(
+            f"  full re-read: {result['seconds']:6.1f} s, {result['rows_per_second']:9.0f} rows/s,"
+            f" {result['inserted']} inserted"
+        )
+
+        record(station, args.rows, args.new_rows)
+        result = merge.merge(station, target)
+        print(
+            f"  after {args.new_rows} new rows: {result['seconds']:6.1f} s,"
+            f" {result['scanned']} read, {result['inserted']} inserted, {count(target)} rows in the target"
+        )
+
+
+if __name__ == "__main__":
+    main()
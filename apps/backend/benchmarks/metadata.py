@@ -0,0 +1,57 @@
+'''
+Micro-benchmark of the participant and treatment lookups in utils: the old
+functions, which reopened and parsed the JSON files on every call, against
+the cached MetadataRegistry, in the per-participant, per-book loop the
+notebooks run.
+
+Run from apps/backend (participants.json and treatments.json are read from
+the working directory):
+
+    python -m benchmarks.metadata --books 20
+'''
+
+import argparse
+import contextlib
+import io
+import time
+
+import utils
+from benchmarks import legacy
+
+
+def lookups(module, participant_ids, books):
+    for participant_id in participant_ids:
+        for _ in range(books):
+            treatment = module.get_participant_treatment(participant_id)
+            module.load_treatment_settings(treatment)
+            module.get_participant_dominant_eye(participant_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--books", type=int, default=20, help="lookups per participant")
+    args = parser.parse_args()
+
+    participant_ids = list(utils.load_participants_metadata())
+    calls = len(participant_ids) * args.books * 3
+    results = {}
+    # the "defaulting to right eye" warnings would drown the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        for participant_id in participant_ids:
+            treatment = utils.get_participant_treatment(participant_id)
+            assert treatment == legacy.get_participant_treatment(participant_id)
+            assert utils.load_treatment_settings(treatment) == legacy.load_treatment_settings(treatment)
+            assert utils.get_participant_dominant_eye(participant_id) == legacy.get_participant_dominant_eye(participant_id)
+
+        for name, module in (("reparsing the files", legacy), ("MetadataRegistry", utils)):
+            start = time.perf_counter()
+            lookups(module, participant_ids, args.books)
+            results[name] = (time.perf_counter() - start) / calls
+
+    print(f"{len(participant_ids)} participants x {args.books} books, {calls} calls")
+    for name, per_call in results.items():
+        print(f"  {name:<20} {per_call * 1e6:8.1f} us per call")
+
+
+if __name__ == "__main__":
+    main()
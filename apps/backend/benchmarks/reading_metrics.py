@@ -0,0 +1,104 @@
+'''
+Times saccade classification and per-page reading metrics for a cohort.
+
+The notebooks classified saccades one pair of fixations at a time with
+utils.identify_saccade_type_with_color; reading.saccade_codes does all of
+them at once and must agree on every one, including moves on the band
+edges. Then the per-page metrics of a synthetic cohort's fixation table are
+computed with reading.page_metrics (group reductions) and with a loop over
+the pages calling the scalar classifier, and compared.
+
+Run from apps/backend:
+
+    python -m benchmarks.reading_metrics --participants 20 --pages 180
+'''
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import reading
+from benchmarks.legacy import identify_saccade_type_with_color
+from benchmarks.synthetic import BOOKS, gaze_trace
+from velocityThreshold import detect_fix_ivt
+
+COLOR_TYPES = {"green": "forward", "red": "regression", "blue": "return_sweep", "purple": "other"}
+
+
+def cohort_fixations(participants, pages, seed=0):
+    '''A fixation table shaped like analyse_cohort's, built from a few detected pages'''
+    templates = [
+        detect_fix_ivt(gaze_trace(5000, noise=0.05, seed=seed + k), sacvel=80)[0]
+        for k in range(8)
+    ]
+    tables = []
+    page_event_id = 0
+    for p in range(participants):
+        for page in range(pages):
+            table = templates[(p + page) % len(templates)].copy()
+            table.insert(0, "participant_id", p)
+            table.insert(1, "book", BOOKS[page * len(BOOKS) // pages])
+            table.insert(2, "page_event_id", page_event_id)
+            page_event_id += 1
+            tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+
+def looped_counts(fixations):
+    '''Per-page saccade type counts the way the notebooks would get them'''
+    rows = []
+    for keys, page in fixations.groupby(reading.PAGE_KEYS, sort=False):
+        counts = dict.fromkeys(reading.SACCADE_TYPES, 0)
+        x = page.x.tolist()
+        y = page.y.tolist()
+        for a, b in zip(range(len(x) - 1), range(1, len(x))):
+            color = identify_saccade_type_with_color((x[a], y[a]), (x[b], y[b]))
+            counts[COLOR_TYPES[color]] += 1
+        rows.append((*keys, *counts.values()))
+    return pd.DataFrame(rows, columns=reading.PAGE_KEYS + list(reading.SACCADE_TYPES))
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--saccades", type=int, default=200_000)
+    parser.add_argument("--participants", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=180, help="pages per participant")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    edges = np.deg2rad([0, 20, 45, 182, 200, 340, 360, 20.001, 44.999, 182.001, 200.001, 339.999])
+    dx = np.concatenate([rng.normal(size=args.saccades), np.cos(edges), [0., np.nan]])
+    dy = np.concatenate([rng.normal(size=args.saccades), -np.sin(edges), [0., 1.]])
+    old, colors = timed(lambda: [identify_saccade_type_with_color((0, 0), (a, b)) for a, b in zip(dx, dy)])
+    new, codes = timed(reading.saccade_codes, dx, dy)
+    expected = np.array([reading.SACCADE_TYPES.index(COLOR_TYPES[c]) for c in colors])
+    mismatched = int((expected != codes).sum())
+    print(
+        f"{len(dx)} saccades: scalar {old * 1000:8.1f} ms  vectorized {new * 1000:6.1f} ms"
+        f"  ({old / new:.0f}x), {mismatched} mismatched"
+    )
+
+    fixations = cohort_fixations(args.participants, args.pages)
+    old, counts = timed(looped_counts, fixations)
+    new, pages = timed(reading.page_metrics, fixations)
+    books_seconds, books = timed(reading.book_metrics, pages)
+    columns = reading.PAGE_KEYS + list(reading.SACCADE_TYPES)
+    same = pages[columns].reset_index(drop=True).equals(counts[columns])
+    print(
+        f"{len(fixations)} fixations on {len(pages)} pages: per-page loop {old * 1000:8.1f} ms"
+        f"  page_metrics {new * 1000:6.1f} ms ({old / new:.0f}x)"
+        f"  book_metrics {books_seconds * 1000:5.1f} ms for {len(books)} books,"
+        f" counts {'identical' if same else 'DIFFER'}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+'''
+Checks the vectorized find_sacc_from_fix against the original iterrows loop
+on fixations from synthetic traces, checks its peak and mean velocities
+against a per-saccade loop, then times both builders on long recordings.
+
+Run from apps/backend:
+
+    python -m benchmarks.saccades --minutes 60
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+import velocityThreshold
+from benchmarks import legacy
+from benchmarks.synthetic import gaze_trace
+
+
+def same_saccades(a, b):
+    if len(a) != len(b):
+        return False
+    return all(
+        np.allclose(a[c].astype(float), b[c].astype(float), equal_nan=True)
+        for c in velocityThreshold.SACCADE_COLUMNS
+    )
+
+
+def check_equivalence():
+    cases = 0
+    for samples in (2, 5, 40, 3_000):
+        for seed in range(4):
+            df = gaze_trace(samples, noise=0.02, seed=seed)
+            for detect in (velocityThreshold.detect_fix_ivt, velocityThreshold.detect_fix_idt):
+                fixations, _, _ = detect(df)
+                # a single fixation gives no saccades; the original needs one
+                for n in range(1, min(len(fixations), 3) + 1):
+                    assert same_saccades(legacy.find_sacc_from_fix(fixations[:n]),
+                                         velocityThreshold.find_sacc_from_fix(fixations[:n]))
+                if len(fixations):
+                    assert same_saccades(legacy.find_sacc_from_fix(fixations),
+                                         velocityThreshold.find_sacc_from_fix(fixations))
+                cases += 1
+
+    empty = velocityThreshold.find_sacc_from_fix(velocityThreshold.detect_fix_ivt(gaze_trace(0))[0])
+    assert len(empty) == 0 and tuple(empty.columns) == velocityThreshold.SACCADE_COLUMNS
+
+    df = gaze_trace(3_000, noise=0.02)
+    fixations, v, _ = velocityThreshold.detect_fix_ivt(df)
+    saccades = velocityThreshold.find_sacc_from_fix(fixations, velocity=v)
+    for s in saccades.itertuples():
+        segment = v[int(s.i):int(s.i + s.n)]
+        segment = segment[np.isfinite(segment)]
+        assert np.isclose(s.vpeak, segment.max()) and np.isclose(s.vmean, segment.mean())
+    print(f"equivalent on {cases} fixation tables, velocities checked on {len(saccades)} saccades")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--minutes", type=float, default=60, help="longest recording, at 250 Hz")
+    args = parser.parse_args()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        check_equivalence()
+
+        print(f"{'samples':>9} {'fixations':>9} {'iterrows':>10} {'vectorized':>10} {'+velocity':>10}")
+        minutes = 1.
+        while minutes <= args.minutes:
+            df = gaze_trace(int(minutes * 60 * 250))
+            fixations, v, _ = velocityThreshold.detect_fix_ivt(df)
+
+            start = time.perf_counter()
+            legacy.find_sacc_from_fix(fixations)
+            old = time.perf_counter() - start
+            start = time.perf_counter()
+            velocityThreshold.find_sacc_from_fix(fixations)
+            new = time.perf_counter() - start
+            start = time.perf_counter()
+            velocityThreshold.find_sacc_from_fix(fixations, velocity=v)
+            with_velocity = time.perf_counter() - start
+
+            print(f"{len(df):>9} {len(fixations):>9} {old:9.3f}s {new:9.4f}s {with_velocity:9.4f}s")
+            minutes *= 4
+
+
+if __name__ == "__main__":
+    main()
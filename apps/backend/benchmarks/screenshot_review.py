@@ -0,0 +1,113 @@
+'''
+Times opening a participant's screenshot timeline.
+
+The old way, as utils.show_screenshot_for_record did it, ran one query per
+event and decoded its full-size PNG. The review endpoints instead run one
+query for the timeline and serve WebP thumbnails. The thumbnails are timed
+cold (built on the first request, as for recordings made before they
+existed) and warm (built at capture time or by an earlier request).
+
+Run from apps/backend:
+
+    python -m benchmarks.screenshot_review --events 300
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import database
+import models
+from benchmarks.screenshots import session
+from models import Events
+from screenshot import ScreenshotStore
+from thumbnails import ThumbnailStore
+
+PARTICIPANT = 7
+
+
+def record(folder, events):
+    '''Write the screenshots of a session and an event row for each'''
+    frames = iter(session(events))
+    store = ScreenshotStore(folder=folder, grab=lambda: next(frames), thumbnails=False)
+    store.start()
+    rows = [
+        dict(
+            time=1_700_000_000_000 + 1000 * i,
+            agent="USER",
+            event="NEXT_PAGE",
+            participant_id=PARTICIPANT,
+            screenshot_file=store.capture(PARTICIPANT),
+        )
+        for i in range(events)
+    ]
+    store.close()
+    with models.db.atomic():
+        Events.insert_many(rows).execute()
+    return store.stats()["files"]
+
+
+def old_review():
+    ids = [e.id for e in Events.select(Events.id).where(Events.participant_id == PARTICIPANT)]
+    start = time.perf_counter()
+    for _id in ids:
+        event = Events.select().where(Events.id == _id).order_by(Events.time.asc()).limit(1)[0]
+        with Image.open(event.screenshot_file) as image:
+            image.load()
+    return time.perf_counter() - start, len(ids)
+
+
+def new_review(client, width):
+    start = time.perf_counter()
+    timeline = client.get(f"/participants/{PARTICIPANT}/screenshots", params={"width": width}).json()
+    # a review page shows one image per distinct screenshot
+    size = 0
+    seen = set()
+    for row in timeline:
+        if row["screenshot_file"] in seen:
+            continue
+        seen.add(row["screenshot_file"])
+        response = client.get(row["thumbnail"])
+        response.raise_for_status()
+        size += len(response.content)
+    return time.perf_counter() - start, len(seen), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument("--width", type=int, default=160)
+    args = parser.parse_args()
+
+    from main import API
+
+    with tempfile.TemporaryDirectory() as tmp:
+        models.db.init(os.path.join(tmp, "events.db"), pragmas=models.PRAGMAS)
+        database.initialize_database()
+        folder = os.path.join(tmp, "screenshots")
+        files = record(folder, args.events)
+        print(f"{args.events} events of participant {PARTICIPANT}, {files} distinct screenshots")
+
+        seconds, count = old_review()
+        print(f"  old: query and full-size decode per event   {seconds * 1000:8.1f} ms for {count} images")
+
+        app = FastAPI()
+        app.include_router(API(thumbnails=ThumbnailStore(os.path.join(folder, "thumbnails"))).router)
+        with TestClient(app) as client:
+            for name in ("cold thumbnails", "warm thumbnails"):
+                seconds, count, size = new_review(client, args.width)
+                print(
+                    f"  timeline + {name:<18} {args.width}px  {seconds * 1000:8.1f} ms"
+                    f" for {count} images, {size / 2**10:.0f} KiB"
+                )
+
+        database.close_database()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+'''
+Compares the old screenshot path with ScreenshotStore on a synthetic session.
+
+The old path encoded every frame to a level 6 PNG with mss.tools.to_png
+(what mss.shot does after grabbing) on the capture thread. The store only
+fingerprints the frame there and leaves the encoding to its own threads,
+skipping frames that look the same as the participant's previous one.
+
+Frames are rendered pages of text at the reader's resolution; most events
+(settings changes, menus, repeated page events) leave the page as it was.
+Without a display the grab itself is not timed, so capture latency is the
+work added on top of it. On a machine with fewer cores than encoder threads
+plus one, the capture thread also competes with the encoders. Reports capture latency, encode throughput and
+bytes on disk per session.
+
+Run from apps/backend:
+
+    python -m benchmarks.screenshots --events 200
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+import mss.tools
+import numpy as np
+from PIL import Image, ImageDraw
+
+from screenshot import Frame, ScreenshotStore
+
+WIDTH = 2560
+HEIGHT = 1440
+WORDS = "the quick brown fox jumps over a lazy dog while reading its book".split()
+
+
+def page(number, font_step, rng):
+    '''One page of the reader as a BGRA frame'''
+    image = Image.new("RGB", (WIDTH, HEIGHT), (250, 248, 240))
+    draw = ImageDraw.Draw(image)
+    spacing = 24 + 6 * font_step
+    for line in range(80, HEIGHT - 120, spacing):
+        words = rng.choice(WORDS, size=rng.integers(10, 24))
+        draw.text((320, line), " ".join(words), fill=(25, 25, 25))
+    draw.text((WIDTH // 2, HEIGHT - 60), str(number), fill=(90, 90, 90))
+    rgb = np.asarray(image)
+    bgra = np.empty((HEIGHT, WIDTH, 4), dtype=np.uint8)
+    bgra[:, :, :3] = rgb[:, :, ::-1]
+    bgra[:, :, 3] = 255
+    return Frame((WIDTH, HEIGHT), bytearray(bgra.tobytes()))
+
+
+def session(events, seed=0):
+    '''Return the frame shown at each event: a new page about a third of the time'''
+    rng = np.random.default_rng(seed)
+    pages = {}
+    current = (0, 0)
+    frames = []
+    for _ in range(events):
+        r = rng.random()
+        if r < .3:
+            current = (current[0] + 1, current[1])
+        elif r < .35:
+            current = (current[0], (current[1] + 1) % 4)
+        if current not in pages:
+            pages[current] = page(current[0], current[1], np.random.default_rng(current))
+        frames.append(pages[current])
+    return frames
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+
+
+def old_path(frames, folder):
+    latencies = []
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        rgb = frame.image().tobytes()
+        mss.tools.to_png(rgb, frame.size, level=6, output=os.path.join(folder, f"{i}.png"))
+        latencies.append(time.perf_counter() - start)
+    return latencies, sum(latencies), len(frames), folder_size(folder)
+
+
+def store_path(frames, folder, format, level):
+    remaining = iter(frames)
+    store = ScreenshotStore(
+        folder=folder, format=format, level=level, grab=lambda: next(remaining), thumbnails=False
+    )
+    store.start()
+    latencies = []
+    for _ in frames:
+        start = time.perf_counter()
+        store.capture(participant_id=1)
+        latencies.append(time.perf_counter() - start)
+    store.close()
+    stats = store.stats()
+    return latencies, stats["encode_seconds"], stats["files"], folder_size(folder)
+
+
+def report(name, latencies, encode_seconds, files, size, events):
+    megapixels = files * WIDTH * HEIGHT / 1e6
+    print(
+        f"  {name:<22} capture p50 {np.percentile(latencies, 50) * 1000:7.1f} ms"
+        f"  p99 {np.percentile(latencies, 99) * 1000:7.1f} ms"
+        f"  encode {megapixels / encode_seconds if encode_seconds else float('nan'):6.1f} Mpx/s"
+        f"  {files:4d}/{events} files  {size / 2**20:7.1f} MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--events", type=int, default=200)
+    args = parser.parse_args()
+
+    frames = session(args.events)
+    print(f"{args.events} events, {len(set(map(id, frames)))} distinct frames of {WIDTH}x{HEIGHT}")
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, "old")
+        os.makedirs(folder)
+        report("old: mss png 6", *old_path(frames, folder), args.events)
+        for format, level in (("png", 6), ("png", 1), ("webp", 80), ("jpeg", 85)):
+            folder = os.path.join(tmp, f"{format}{level}")
+            report(f"store: {format} {level}", *store_path(frames, folder, format, level), args.events)
+
+
+if __name__ == "__main__":
+    main()
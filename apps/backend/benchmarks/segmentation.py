@@ -0,0 +1,83 @@
+'''
+Times splitting the Events table into books and pages the way the notebooks
+do it (a query per book and per page) against segmentation.segment_events()
+on a synthetic cohort, and checks they find the same books.
+
+Run from apps/backend:
+
+    python -m benchmarks.segmentation --participants 40
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+import utils
+from benchmarks.synthetic import events_table
+from segmentation import gaze_file_name, segment_events
+from utils import Events
+
+
+def notebook_segments(participant_ids):
+    '''The per-book/per-page queries of main-sequence.ipynb'''
+    pages_found = []
+    subquery = Events.select().where(Events.participant_id.in_(participant_ids))
+    for participant in participant_ids:
+        books = subquery.where(
+            (Events.event == "OPEN_BOOK") & (Events.participant_id == participant)
+        )
+        for book in books:
+            book_end = (
+                subquery.where(Events.event == "CLOSE_BOOK")
+                .where(Events.participant_id == participant)
+                .where(Events.time > book.time)
+                .get()
+            )
+            pages = subquery.where(
+                (Events.event.contains("_PAGE") | (Events.event == "OPEN_BOOK"))
+                & (Events.participant_id == participant)
+                & (Events.time >= book.time)
+                & (Events.time < book_end.time)
+            )
+            for page in pages:
+                page_end = subquery.where(
+                    (Events.event.contains("_PAGE"))
+                    & (Events.participant_id == participant)
+                    & (Events.time > page.time)
+                ).get_or_none()
+                pages_found.append((participant, gaze_file_name(participant, book.time), page.id, page_end))
+    return pages_found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--participants", type=int, default=40)
+    parser.add_argument("--pages", type=int, default=60)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        utils.db.init(os.path.join(tmp, "events.db"))
+        rows = events_table(utils.db, Events, args.participants, pages=args.pages)
+        participant_ids = list(range(1, args.participants + 1))
+
+        t = time.perf_counter()
+        old = notebook_segments(participant_ids)
+        old_time = time.perf_counter() - t
+
+        t = time.perf_counter()
+        new = segment_events(participant_ids)
+        new_time = time.perf_counter() - t
+
+        assert len(old) == len(new)
+        assert sorted({(p, f) for p, f, _, _ in old}) == sorted(set(zip(new.participant_id, new.gaze_file)))
+        assert sorted(page for _, _, page, _ in old) == sorted(new.page_event_id)
+        utils.db.close()
+
+    print(f"{rows} events, {args.participants} participants, {len(new)} pages")
+    print(f"  notebook queries {old_time:8.3f} s")
+    print(f"  single scan      {new_time:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+'''
+Measures how long the capture server takes to start, and what its imports cost.
+
+Every run is a fresh interpreter in an empty folder, so nothing is cached in
+the process:
+
+  boot      `import main`, the startup handlers and the first POST answered,
+            with EYE_TRACKER=none and SCREEN_GRABBER=blank. FastAPI is
+            imported before the clock starts, since the test client needs it
+  import    the largest imports by -X importtime, FastAPI's own included
+  headless  the same with tobii_research, pyautogui and mss made impossible
+            to import, as on a machine without the SDK or a display
+  replay    a participant reads a book with EYE_TRACKER=replay:<synthetic
+            session>; the gaze session written must hold the replayed samples
+
+Run from apps/backend:
+
+    python -m benchmarks.startup --runs 10
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import gazefile
+from benchmarks.synthetic import tobii_session
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HARDWARE = ("tobii_research", "pyautogui", "mss")
+
+# runs in the child; prints one JSON line of timings
+CHILD = '''
+import json, os, sys, time
+# the test client is the benchmark's, not the server's
+from fastapi.testclient import TestClient
+start = time.perf_counter()
+
+class Blocked:
+    def find_spec(self, name, path=None, target=None):
+        if name.split(".")[0] in os.environ.get("BLOCK", "").split(","):
+            raise ImportError("blocked " + name)
+
+sys.meta_path.insert(0, Blocked())
+import main
+imported = time.perf_counter()
+
+def event(name, timestamp):
+    return {"agent": "bench", "event": name, "participantId": 1, "timestamp": timestamp}
+
+with TestClient(main.app) as client:
+    booted = time.perf_counter()
+    response = client.post("/capture-screenshot/", json=event("SELECT_TREATMENT", 1))
+    answered = time.perf_counter()
+    assert response.status_code == 200, response.text
+    read = float(os.environ.get("READ_SECONDS", 0))
+    if read:
+        assert client.post("/capture-screenshot/", json=event("OPEN_BOOK", 2)).status_code == 200
+        time.sleep(read)
+        assert client.post("/capture-screenshot/", json=event("CLOSE_BOOK", 3)).status_code == 200
+print(json.dumps({
+    "import": imported - start,
+    "startup": booted - imported,
+    "first_response": answered - booted,
+    "total": answered - start,
+    "hardware": sorted(m for m in sys.modules if m.split(".")[0] in %r),
+}))
+''' % (HARDWARE,)
+
+
+def child(env=None, args=(), cwd=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        result = subprocess.run(
+            [sys.executable, *args, "-c", CHILD],
+            cwd=cwd or tmp,
+            env={**os.environ, "PYTHONPATH": BACKEND, "EYE_TRACKER": "none", "SCREEN_GRABBER": "blank", **(env or {})},
+            capture_output=True,
+            text=True,
+        )
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def largest_imports(importtime, count):
+    '''The top-level packages with the largest cumulative -X importtime'''
+    totals = {}
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # only imports done directly by the interpreter or by main
+        depth = len(name) - len(name.lstrip())
+        if cumulative.strip().isdigit() and depth <= 3:
+            package = name.strip().split(".")[0]
+            totals[package] = max(totals.get(package, 0), int(cumulative))
+    return sorted(totals.items(), key=lambda item: -item[1])[:count]
+
+
+def summary(samples):
+    return f"min {min(samples) * 1000:7.1f} ms, median {statistics.median(samples) * 1000:7.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="imports to list")
+    parser.add_argument("--read-seconds", type=float, default=2., help="length of the replayed reading")
+    args = parser.parse_args()
+
+    runs = [child()[0] for _ in range(args.runs)]
+    print(f"{args.runs} cold starts, no tracker, blank screen:")
+    for key in ("import", "startup", "first_response", "total"):
+        print(f"  {key:<15} {summary([run[key] for run in runs])}")
+
+    _, importtime = child(args=("-X", "importtime"))
+    print("largest imports (cumulative):")
+    for package, microseconds in largest_imports(importtime, args.top):
+        print(f"  {package:<24} {microseconds / 1000:7.1f} ms")
+
+    headless, _ = child(env={"BLOCK": ",".join(HARDWARE)})
+    print(f"boots without {', '.join(HARDWARE)}: {headless['total'] * 1000:.1f} ms,"
+          f" hardware modules imported: {headless['hardware'] or 'none'}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        recording = gazefile.write_session(
+            os.path.join(tmp, "replay" + gazefile.SUFFIX), {"participantId": 1},
+            tobii_session(30)["data"],
+        )
+        replay, _ = child(
+            env={"EYE_TRACKER": f"replay:{recording}", "READ_SECONDS": str(args.read_seconds), "BLOCK": ",".join(HARDWARE)},
+            cwd=tmp,
+        )
+        written = [
+            name for name in os.listdir(os.path.join(tmp, "eye_tracker_data"))
+            if name.endswith(gazefile.SUFFIX)
+        ]
+        samples = sum(len(gazefile.open_session(os.path.join(tmp, "eye_tracker_data", name))) for name in written)
+    expected = args.read_seconds * 250
+    print(f"replayed {args.read_seconds:g} s of reading: {samples} samples recorded"
+          f" ({samples / expected:.0%} of {expected:.0f} at 250 Hz), hardware modules imported: {replay['hardware'] or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
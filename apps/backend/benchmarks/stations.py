@@ -0,0 +1,134 @@
+'''
+Load test of several reading stations against one capture server.
+
+Each station has its own replayed eye tracker (backends.ReplayTracking)
+sending gaze samples at --rate. A participant per station selects a
+treatment, opens a book, turns a page every --page-seconds and closes the
+book after --seconds, all stations at once, through /capture-screenshot/
+with a fake screen grabber. Reported for each number of stations: gaze
+samples recorded per second in total and per station (against what the
+trackers sent), events stored, request latency and the CPU the process used.
+Every station's recording must belong to its own participant.
+
+Run from apps/backend:
+
+    python -m benchmarks.stations --stations 1 2 4 8 --seconds 10 --rate 600
+'''
+
+import argparse
+import asyncio
+import os
+import resource
+import tempfile
+import time
+
+import httpx
+import numpy as np
+from fastapi import FastAPI
+
+import database
+import gazefile
+import models
+from backends import ReplayTracking
+from benchmarks.capture_load import fake_grabber
+from benchmarks.synthetic import tobii_session
+from capture import CapturePipeline
+from main import API
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def read_book(client, station, participant, seconds, page_seconds, latencies):
+    async def send(event):
+        payload = {
+            "timestamp": int(time.time() * 1000),
+            "agent": "USER",
+            "event": event,
+            "participantId": participant,
+            "station": station,
+        }
+        start = time.perf_counter()
+        response = await client.post("/capture-screenshot/", json=payload)
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+
+    await send("SELECT_TREATMENT")
+    await send("OPEN_BOOK")
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        await asyncio.sleep(min(page_seconds, max(end - time.monotonic(), 0)))
+        await send("NEXT_PAGE")
+    await send("CLOSE_BOOK")
+
+
+async def run(stations, packets, args):
+    names = {f"station-{i + 1}": f"replay-{i + 1}" for i in range(stations)}
+    sdk = ReplayTracking(packets, trackers=stations)
+    pipeline = CapturePipeline(grab=fake_grabber(args.grab_cost), delay=args.delay)
+    api = API(pipeline=pipeline, tracker=sdk, stations=names)
+    app = FastAPI()
+    app.include_router(api.router)
+    await api.startup_event()
+    for station in api.stations.stations.values():
+        station.manager.wait(5)
+
+    latencies = []
+    cpu = cpu_seconds()
+    start = time.perf_counter()
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        await asyncio.gather(*(
+            read_book(client, name, i + 1, args.seconds, args.page_seconds, latencies)
+            for i, name in enumerate(names)
+        ))
+        sent = sum(tracker.packets_sent for tracker in sdk.trackers)
+        await api.shutdown_event()
+    seconds = time.perf_counter() - start
+    cpu = cpu_seconds() - cpu
+
+    recorded = {}
+    for name in os.listdir("eye_tracker_data"):
+        session = gazefile.open_session(os.path.join("eye_tracker_data", name))
+        recorded[session.header["participantId"]] = len(session)
+    models.db.connect(reuse_if_open=True)
+    events = models.Events.select().count()
+    assert sorted(recorded) == list(range(1, stations + 1)), f"a recording per participant, got {sorted(recorded)}"
+    return recorded, sent, events, np.array(latencies), seconds, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--stations", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seconds", type=float, default=10, help="each book is open")
+    parser.add_argument("--rate", type=int, default=250, help="gaze samples per second per tracker")
+    parser.add_argument("--page-seconds", type=float, default=.5)
+    parser.add_argument("--delay", type=float, default=.05, help="seconds before the grab")
+    parser.add_argument("--grab-cost", type=float, default=.02, help="seconds per fake grab")
+    args = parser.parse_args()
+
+    packets = tobii_session(args.seconds + 5, rate=args.rate)["data"]
+    print(f"{args.rate} Hz per tracker, books open {args.seconds:g} s, a page every {args.page_seconds:g} s")
+    print(f"{'stations':>8} {'samples/s':>10} {'per station':>12} {'recorded':>9} {'events':>7}"
+          f" {'p50 ms':>7} {'p99 ms':>7} {'CPU':>6}")
+    cwd = os.getcwd()
+    for stations in args.stations:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            models.db.init(os.path.join(tmp, "events.db"))
+            try:
+                recorded, sent, events, latencies, seconds, cpu = asyncio.run(run(stations, packets, args))
+            finally:
+                database.close_database()
+                os.chdir(cwd)
+        total = sum(recorded.values())
+        print(
+            f"{stations:>8} {total / args.seconds:>10.0f} {total / stations / args.seconds:>12.0f}"
+            f" {total / sent:>9.1%} {events:>7} {np.percentile(latencies, 50) * 1000:>7.1f}"
+            f" {np.percentile(latencies, 99) * 1000:>7.1f} {cpu / seconds:>6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
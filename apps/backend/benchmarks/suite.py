@@ -0,0 +1,431 @@
+'''
+Runs a fixed set of timed scenarios and compares the results between commits.
+
+Every scenario builds its input with benchmarks.synthetic (seeded, so the
+same on every run and machine), runs once to warm up and is then timed
+--repeats times. The results, with the commit and the machine they come from,
+are written as JSON:
+
+    python -m benchmarks.suite run                      # results/<commit>.json
+    python -m benchmarks.suite run --scale 4 -k detection -k db
+    python -m benchmarks.suite compare results/1a2b3c4.json results/5d6e7f8.json
+
+compare sets the fastest time of every scenario (or the median, with
+--statistic median) against the baseline's and flags those more than
+--threshold slower (or faster); it exits with status 1 if anything
+regressed, so it can gate a CI job. The fastest of the repeats is the least
+disturbed by whatever else the machine is doing. Results are only
+comparable between runs of the same --scale on the same machine.
+
+The benchmarks need the server's requirements and a few more:
+
+    pip install -r requirements_benchmarks.txt
+
+The other modules of this package are the detailed, one-off benchmarks
+behind each optimization; this one is for keeping track of them.
+'''
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import (
+    event_rows,
+    gaze_trace,
+    session_events,
+    tobii_session,
+)
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), "results")
+REPEATS = 5
+# a scenario is flagged when its time changes by more than this fraction
+THRESHOLD = 0.10
+STATISTICS = ("min", "median")
+FORMAT_VERSION = 1
+
+SCENARIOS = {}
+
+
+def scenario(name, unit):
+    '''
+    Register a scenario. The decorated function takes the scale and a
+    scratch folder and returns (run, items): run() is what gets timed and
+    items how many `unit`s one run handles.
+    '''
+    def register(setup):
+        SCENARIOS[name] = (setup, unit)
+        return setup
+
+    return register
+
+
+@scenario("detection.ivt", "samples")
+def detection_ivt(scale, folder):
+    from velocityThreshold import detect_fix_ivt
+
+    df = gaze_trace(int(1_000_000 * scale))
+    return lambda: detect_fix_ivt(df, sacvel=80), len(df)
+
+
+@scenario("detection.idt", "samples")
+def detection_idt(scale, folder):
+    from velocityThreshold import detect_fix_idt
+
+    df = gaze_trace(int(60_000 * scale))
+    return lambda: detect_fix_idt(df, dispval=1., minwindow=25), len(df)
+
+
+@scenario("detection.saccades", "fixations")
+def detection_saccades(scale, folder):
+    from velocityThreshold import detect_fix_ivt, find_sacc_from_fix
+
+    # one participant's cohort: 40 pages of I-VT fixations
+    pages = [detect_fix_ivt(gaze_trace(int(25_000 * scale), seed=page), sacvel=80)[0] for page in range(40)]
+
+    def run():
+        for fixations in pages:
+            find_sacc_from_fix(fixations)
+
+    return run, sum(len(fixations) for fixations in pages)
+
+
+@scenario("reading.page_metrics", "fixations")
+def reading_page_metrics(scale, folder):
+    from reading import page_metrics
+    from velocityThreshold import detect_fix_ivt
+
+    fixations = detect_fix_ivt(gaze_trace(int(60_000 * scale)), sacvel=80)[0]
+    fixations = fixations.assign(
+        participant_id=1, book="Chasing Sunsets - ", page_event_id=np.arange(len(fixations)) // 40
+    )
+    return lambda: page_metrics(fixations), len(fixations)
+
+
+@scenario("windows.page", "windows")
+def windows_page(scale, folder):
+    from gazesession import GazeSession
+
+    session = tobii_session(600 * scale)
+    gaze = GazeSession(session)
+    # every page of the book, read twenty times over
+    pages = session_events(session, page_seconds=5)
+    bounds = list(zip((e["time"] for e in pages[:-1]), (e["time"] for e in pages[1:]))) * 20
+
+    def run():
+        for start, end in bounds:
+            gaze.window(start, end)["left_gaze_point_on_display_area"]
+
+    return run, len(bounds)
+
+
+@scenario("loading.json", "samples")
+def loading_json(scale, folder):
+    import simplejson
+
+    session = tobii_session(120 * scale)
+    path = os.path.join(folder, "[1]-2023-11-14_22-13-20.json")
+    with open(path, "w") as f:
+        f.write(simplejson.dumps(session, ignore_nan=True))
+
+    def run():
+        with open(path, "r") as f:
+            return json.load(f)
+
+    return run, len(session["data"])
+
+
+@scenario("loading.columnar", "samples")
+def loading_columnar(scale, folder):
+    import gazefile
+
+    session = tobii_session(120 * scale)
+    header = {k: v for k, v in session.items() if k != "data"}
+    path = gazefile.write_session(os.path.join(folder, "[1]-2023-11-14_22-13-20"), header, session["data"])
+
+    def run():
+        gaze = gazefile.open_session(path, mmap=False)
+        return gaze.load(*gaze.columns)
+
+    return run, len(session["data"])
+
+
+@contextlib.contextmanager
+def event_database(folder, participants):
+    import database
+    import models
+
+    models.db.init(os.path.join(folder, f"events-{participants}.db"), pragmas=models.PRAGMAS)
+    database.initialize_database()
+    rows = event_rows(participants)
+    with models.db.atomic():
+        for i in range(0, len(rows), 500):
+            models.Events.insert_many(rows[i:i + 500]).execute()
+    try:
+        yield len(rows)
+    finally:
+        database.close_database()
+
+
+@scenario("db.participant_events", "queries")
+def db_participant_events(scale, folder):
+    from models import Events
+
+    participants = int(40 * scale)
+    stack = contextlib.ExitStack()
+    stack.enter_context(event_database(folder, participants))
+
+    def run():
+        for p in range(1, participants + 1):
+            list(Events.select().where(Events.participant_id == p).order_by(Events.time).tuples())
+            Events.select().where((Events.participant_id == p) & (Events.event == "OPEN_BOOK")).first()
+
+    return Runner(run, stack), participants
+
+
+@scenario("db.events_pages", "rows")
+def db_events_pages(scale, folder):
+    from database import select_events
+
+    stack = contextlib.ExitStack()
+    rows = stack.enter_context(event_database(folder, int(40 * scale)))
+
+    def run():
+        after = None
+        while True:
+            page = list(select_events(after=after).limit(1000).dicts())
+            if len(page) < 1000:
+                break
+            after = (page[-1]["time"], page[-1]["id"])
+
+    return Runner(run, stack), rows
+
+
+@scenario("endpoint.events", "requests")
+def endpoint_events(scale, folder):
+    stack = contextlib.ExitStack()
+    stack.enter_context(event_database(folder, int(40 * scale)))
+    client = stack.enter_context(test_client())
+    participants = range(1, int(40 * scale) + 1)
+
+    def run():
+        for p in participants:
+            client.get("/events/", params={"participant_id": p}).raise_for_status()
+
+    return Runner(run, stack), len(participants)
+
+
+@scenario("endpoint.capture", "requests")
+def endpoint_capture(scale, folder):
+    from benchmarks.capture_load import fake_grabber
+    from capture import CapturePipeline
+
+    stack = contextlib.ExitStack()
+    stack.enter_context(event_database(folder, 1))
+    pipeline = CapturePipeline(grab=fake_grabber(0.), delay=0.)
+    client = stack.enter_context(test_client(pipeline))
+    requests = int(200 * scale)
+    counter = iter(range(10 ** 9))
+
+    def run():
+        for _ in range(requests):
+            client.post("/capture-screenshot/", json=dict(
+                timestamp=1_800_000_000_000 + next(counter), agent="USER",
+                event="NEXT_PAGE", participantId=1,
+            )).raise_for_status()
+
+    return Runner(run, stack), requests
+
+
+@contextlib.contextmanager
+def test_client(pipeline=None):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from main import API
+
+    app = FastAPI()
+    app.include_router(API(pipeline=pipeline).router)
+    # the handlers print every event
+    with contextlib.redirect_stdout(open(os.devnull, "w")), TestClient(app) as client:
+        yield client
+
+
+class Runner:
+    '''A scenario's run() together with what to close after timing it'''
+
+    def __init__(self, run, stack):
+        self.run = run
+        self.stack = stack
+
+    def __call__(self):
+        return self.run()
+
+    def close(self):
+        self.stack.close()
+
+
+def time_scenario(name, scale, repeats, folder):
+    setup, unit = SCENARIOS[name]
+    run, items = setup(scale, folder)
+    try:
+        run()
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+    finally:
+        if isinstance(run, Runner):
+            run.close()
+    median = statistics.median(seconds)
+    return {
+        "unit": unit,
+        "items": items,
+        "seconds": seconds,
+        "min": min(seconds),
+        "median": median,
+        "per_second": items / median if median else None,
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, bool(dirty)
+
+
+def machine():
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+    }
+
+
+def selected(patterns):
+    if not patterns:
+        return list(SCENARIOS)
+    return [name for name in SCENARIOS if any(p in name for p in patterns)]
+
+
+def run(args):
+    names = selected(args.k)
+    if not names:
+        raise SystemExit(f"No scenario matches {args.k}; there are {', '.join(SCENARIOS)}")
+    commit, dirty = git_commit()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            folder = os.path.join(tmp, name)
+            os.makedirs(folder)
+            result = results[name] = time_scenario(name, args.scale, args.repeats, folder)
+            print(
+                f"  {name:<24} median {result['median'] * 1000:9.1f} ms"
+                f"  min {result['min'] * 1000:9.1f} ms"
+                f"  {result['per_second']:12.0f} {result['unit']}/s"
+            )
+
+    report = {
+        "version": FORMAT_VERSION,
+        "commit": commit,
+        "dirty": dirty,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "scale": args.scale,
+        "repeats": args.repeats,
+        "machine": machine(),
+        "results": results,
+    }
+    out = args.out
+    if out is None:
+        name = (commit or time.strftime("%Y-%m-%d_%H-%M-%S")) + ("-dirty" if dirty else "")
+        out = os.path.join(RESULTS_FOLDER, name + ".json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    tmp = out + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp, out)
+    print(f"Wrote {out}")
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline["scale"] != current["scale"]:
+        print(f"Warning: scale {baseline['scale']} against {current['scale']}, times are not comparable")
+    if baseline["machine"] != current["machine"]:
+        print("Warning: the results come from different machines or library versions")
+
+    print(f"{baseline['commit']} -> {current['commit']}{' (dirty)' if current['dirty'] else ''}")
+    regressions = []
+    for name in sorted(set(baseline["results"]) | set(current["results"])):
+        old = baseline["results"].get(name)
+        new = current["results"].get(name)
+        if old is None or new is None:
+            print(f"  {name:<24} {'only in the baseline' if new is None else 'new'}")
+            continue
+        ratio = new[args.statistic] / old[args.statistic]
+        flag = ""
+        if ratio > 1 + args.threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - args.threshold:
+            flag = "faster"
+        print(
+            f"  {name:<24} {old[args.statistic] * 1000:9.1f} ms -> {new[args.statistic] * 1000:9.1f} ms"
+            f"  {ratio:6.2f}x  {flag}"
+        )
+    if regressions:
+        print(f"{len(regressions)} regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="time the scenarios and write the results")
+    run_parser.add_argument("-k", action="append", help="only scenarios whose name contains this")
+    run_parser.add_argument("--scale", type=float, default=1., help="multiplies every input size")
+    run_parser.add_argument("--repeats", type=int, default=REPEATS)
+    run_parser.add_argument("--out", help=f"results file, {RESULTS_FOLDER}/<commit>.json by default")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="flag scenarios that got slower")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    compare_parser.add_argument("--statistic", choices=STATISTICS, default="min")
+    compare_parser.set_defaults(handler=compare)
+
+    commands.add_parser("list", help="list the scenarios").set_defaults(
+        handler=lambda args: print("\n".join(f"{name} ({unit})" for name, (_, unit) in SCENARIOS.items()))
+    )
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+'''
+Deterministic synthetic gaze data and events for the benchmarks.
+
+Everything is drawn from numpy generators seeded by the caller, so the same
+arguments give the same data on every machine and every run.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+def gaze_trace(samples, rate=250, noise=0.02, seed=0):
+    '''
+    Return a reading-like gaze trace as the DataFrame the detectors take:
+    x and y in degrees, ts in seconds.
+
+    The trace alternates fixations of 100-400 ms, jittered by `noise` degrees,
+    with 20-40 ms saccades that mostly move right along a line and
+    occasionally jump back (regressions) or to the start of the next line.
+    '''
+    rng = np.random.default_rng(seed)
+    x = np.empty(samples)
+    y = np.empty(samples)
+
+    px, py = 2., 2.
+    i = 0
+    while i < samples:
+        fix = min(int(rng.uniform(.1, .4) * rate), samples - i)
+        x[i:i+fix] = px + rng.normal(0, noise, fix)
+        y[i:i+fix] = py + rng.normal(0, noise, fix)
+        i += fix
+
+        r = rng.random()
+        if r < .1 or px > 30:
+            tx, ty = 2., py + 1. if py < 20 else 2.
+        elif r < .25:
+            tx, ty = px - rng.uniform(1, 4), py
+        else:
+            tx, ty = px + rng.uniform(1, 3), py
+
+        sac = min(max(int(rng.uniform(.02, .04) * rate), 2), samples - i)
+        x[i:i+sac] = np.linspace(px, tx, sac + 2)[1:-1]
+        y[i:i+sac] = np.linspace(py, ty, sac + 2)[1:-1]
+        i += sac
+        px, py = tx, ty
+
+    ts = np.arange(samples) / rate
+    return pd.DataFrame({"x": x, "y": y, "ts": ts})
+
+
+def tobii_session(
+    seconds,
+    rate=250,
+    seed=0,
+    start_epoch=1_700_000_000.,
+    noise=0.02,
+    invalid=0.02,
+    participant_id=1,
+):
+    '''
+    Return a gaze recording shaped like the JSON files Tobii.stop_tracking
+    wrote: the session header plus "data", a list of as_dictionary=True
+    packets. Fixations are jittered by `noise` degrees (see gaze_trace) and
+    each eye is invalid in a fraction `invalid` of the samples.
+    '''
+    samples = int(seconds * rate)
+    rng = np.random.default_rng(seed)
+    trace = gaze_trace(samples, rate=rate, noise=noise, seed=seed)
+    gx = (trace.x.values / 34).clip(0, 1)
+    gy = (trace.y.values / 22).clip(0, 1)
+
+    system_start = 150_000_000_000
+    system = system_start + (trace.ts.values * 1_000_000).astype(np.int64)
+    device = system + 12_345_678
+    mono = system_start * 1_000 - 2_500_000
+
+    data = []
+    for i in range(samples):
+        packet = {
+            "device_time_stamp": int(device[i]),
+            "system_time_stamp": int(system[i]),
+        }
+        for eye, dx in (("left", -0.002), ("right", 0.002)):
+            valid = rng.random() >= invalid
+            if valid:
+                point = (float(gx[i] + dx), float(gy[i]))
+                pupil = float(3 + rng.normal(0, 0.1))
+            else:
+                point = (float("nan"), float("nan"))
+                pupil = float("nan")
+            packet[f"{eye}_gaze_point_on_display_area"] = point
+            packet[f"{eye}_gaze_point_in_user_coordinate_system"] = (
+                point[0] * 600 - 300, 300 - point[1] * 340, 50.
+            )
+            packet[f"{eye}_gaze_point_validity"] = int(valid)
+            packet[f"{eye}_pupil_diameter"] = pupil
+            packet[f"{eye}_pupil_validity"] = int(valid)
+            packet[f"{eye}_gaze_origin_in_user_coordinate_system"] = (
+                dx * 15000, 10., 600.
+            )
+            packet[f"{eye}_gaze_origin_in_trackbox_coordinate_system"] = (
+                0.5 + dx * 50, 0.5, 0.5
+            )
+            packet[f"{eye}_gaze_origin_validity"] = int(valid)
+        data.append(packet)
+
+    start_time = int(start_epoch * 1000)
+    return {
+        "participantId": participant_id,
+        "start_time": start_time,
+        "end_time": start_time + int(seconds * 1000),
+        "system_start_time_mono": mono,
+        "system_start_time_mono_delta": 1_000,
+        "system_start_time_epoch": start_epoch,
+        "system_end_time_mono": mono + seconds * 1e9,
+        "system_end_time_mono_delta": 1_000,
+        "system_end_time_epoch": start_epoch + seconds,
+        "data": data,
+    }
+
+
+def gaze_columns(seconds, rate=250, seed=0, pupils=False):
+    '''
+    Return the timestamp, gaze point and validity columns of a recording as
+    arrays, generated without building packets so that it scales to tens of
+    millions of samples. The trace is a random walk with saccade-sized jumps
+    rather than gaze_trace's reading pattern; about 2% of samples are invalid.
+    Pupil diameters are included when pupils is True.
+    '''
+    samples = int(seconds * rate)
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 0.0005, (samples, 2))
+    jumps = rng.random(samples) < 4 / rate
+    steps[jumps] += rng.normal(0, 0.05, (jumps.sum(), 2))
+    point = (0.5 + np.cumsum(steps, axis=0)) % 1.
+
+    columns = {
+        "system_time_stamp": 150_000_000_000 + np.arange(samples, dtype=np.int64) * int(1_000_000 / rate),
+    }
+    for eye, dx in (("left", -0.002), ("right", 0.002)):
+        valid = (rng.random(samples) > 0.02).astype(np.int8)
+        eye_point = point + (dx, 0.)
+        eye_point[valid == 0] = np.nan
+        columns[f"{eye}_gaze_point_on_display_area"] = eye_point
+        columns[f"{eye}_gaze_point_validity"] = valid
+        if pupils:
+            diameter = 3 + np.cumsum(rng.normal(0, 0.002, samples)) % 1.5
+            diameter[valid == 0] = np.nan
+            columns[f"{eye}_pupil_diameter"] = diameter
+            columns[f"{eye}_pupil_validity"] = valid
+    return columns
+
+
+BOOKS = ("Chasing Sunsets - ", "Smart Farming Tech - ", "Under the Tuscan Sun - ")
+
+
+def event_rows(participants, pages=60, seed=0, start=1_700_000_000_000):
+    '''
+    Return Events rows (as dicts) for a study: every participant selects a
+    treatment, then opens, pages through and closes each book, with the
+    occasional setting change in between. Times are epoch milliseconds.
+    '''
+    rng = np.random.default_rng(seed)
+    rows = []
+    time = start
+    for participant in range(1, participants + 1):
+        rows.append(dict(time=time, agent="SYSTEM", event="SELECT_TREATMENT",
+                         participant_id=participant, old_value=None,
+                         new_value=f"Treatment {participant % 3 + 1},{participant % 4 + 1}",
+                         screenshot_file=None))
+        for book in BOOKS:
+            time += int(rng.uniform(5_000, 30_000))
+            rows.append(dict(time=time, agent="USER", event="OPEN_BOOK",
+                             participant_id=participant, old_value=None, new_value=book,
+                             screenshot_file=f"screenshots/{participant}-{time}.png"))
+            for page in range(pages):
+                time += int(rng.uniform(4_000, 40_000))
+                if rng.random() < .05:
+                    rows.append(dict(time=time, agent="USER", event="CHANGE_FONT_SIZE",
+                                     participant_id=participant, old_value="18", new_value="24",
+                                     screenshot_file=f"screenshots/{participant}-{time}.png"))
+                    time += 500
+                event = "PREV_PAGE" if rng.random() < .05 else "NEXT_PAGE"
+                rows.append(dict(time=time, agent="USER", event=event,
+                                 participant_id=participant, old_value=str(page),
+                                 new_value=str(page + 1),
+                                 screenshot_file=f"screenshots/{participant}-{time}.png"))
+            time += int(rng.uniform(4_000, 40_000))
+            rows.append(dict(time=time, agent="USER", event="CLOSE_BOOK",
+                             participant_id=participant, old_value=None, new_value=book,
+                             screenshot_file=f"screenshots/{participant}-{time}.png"))
+        time += 3_600_000
+    return rows
+
+
+def events_table(db, model, participants, pages=60, seed=0):
+    '''Fill `model`'s table in the peewee database `db` with event_rows()'''
+    db.create_tables([model], safe=True)
+    rows = event_rows(participants, pages=pages, seed=seed)
+    with db.atomic():
+        for i in range(0, len(rows), 500):
+            model.insert_many(rows[i:i+500]).execute()
+    return len(rows)
+
+
+def session_events(session, page_seconds=20, book=BOOKS[0], seed=0):
+    '''
+    Return the Events rows (as dicts) of reading one book through a
+    tobii_session(): OPEN_BOOK at its start, a page event every page_seconds
+    or so and CLOSE_BOOK at its end, so every page has a gaze window.
+    '''
+    rng = np.random.default_rng(seed)
+    participant = session["participantId"]
+    start, end = session["start_time"], session["end_time"]
+
+    def row(time, event, old_value=None, new_value=None):
+        return dict(time=int(time), agent="USER", event=event, participant_id=participant,
+                    old_value=old_value, new_value=new_value,
+                    screenshot_file=f"screenshots/{participant}-{int(time)}.png")
+
+    rows = [row(start, "OPEN_BOOK", new_value=book)]
+    time = start
+    page = 0
+    while True:
+        time += int(rng.uniform(.5, 1.5) * page_seconds * 1000)
+        if time >= end:
+            break
+        rows.append(row(time, "NEXT_PAGE", str(page), str(page + 1)))
+        page += 1
+    rows.append(row(end, "CLOSE_BOOK", new_value=book))
+    return rows
@@ -0,0 +1,125 @@
+'''
+Times participant switches with the TrackerManager against finding the tracker per participant.
+
+Runs on a replayed tracker (backends.ReplayTracking) whose discovery takes
+--discovery-seconds, standing in for the SDK's find_all_eyetrackers():
+
+  switch    SELECT_TREATMENT then OPEN_BOOK for each participant: discovery
+            and licensing every time, as Tobii.__init__ did, against a
+            session from the manager that found the tracker once
+  retry     a tracker that is not found the first --misses times: how long
+            until it is ready, and that a book opened meanwhile is recorded
+            from when the tracker is found instead of failing
+  reconnect the connection is lost while a book is open; the recording
+            carries on once the tracker is found again
+
+Run from apps/backend:
+
+    python -m benchmarks.tracker_manager --participants 10 --discovery-seconds 1
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import gazefile
+from backends import ReplayTracking
+from benchmarks.legacy import select_treatment
+from benchmarks.synthetic import tobii_session
+from tobiilsl.tobii_tracking import TrackerManager
+
+RATE = 250
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def recorded_samples(folder="eye_tracker_data"):
+    '''Samples in each gaze session written to folder, and empty the folder'''
+    samples = [
+        len(gazefile.open_session(os.path.join(folder, name)))
+        for name in sorted(os.listdir(folder)) if name.endswith(gazefile.SUFFIX)
+    ]
+    shutil.rmtree(folder)
+    return samples
+
+
+def switches(manager, participants, read_seconds, legacy_sdk=None):
+    '''Seconds from SELECT_TREATMENT to the recording having started, per participant'''
+    seconds = []
+    for participant in range(1, participants + 1):
+        start = time.perf_counter()
+        if legacy_sdk is not None:
+            select_treatment(legacy_sdk, manager.license_path)
+        tobii = manager.session(participant)
+        tobii.start_tracking(now_ms())
+        seconds.append(time.perf_counter() - start)
+        time.sleep(read_seconds)
+        tobii.stop_tracking(now_ms())
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--participants", type=int, default=5)
+    parser.add_argument("--discovery-seconds", type=float, default=1., help="what the stand-in's discovery takes")
+    parser.add_argument("--read-seconds", type=float, default=.5, help="each participant's reading")
+    parser.add_argument("--misses", type=int, default=3, help="discoveries that find nothing")
+    args = parser.parse_args()
+
+    packets = tobii_session(10, rate=RATE)["data"]
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            sdk = ReplayTracking(packets, discovery_seconds=args.discovery_seconds)
+            manager = TrackerManager(sdk).start()
+            start = time.perf_counter()
+            manager.wait()
+            print(f"tracker found and licensed once in {time.perf_counter() - start:.2f} s")
+
+            print(f"{args.participants} participants, discovery taking {args.discovery_seconds:g} s:")
+            for name, legacy in (("per participant", sdk), ("manager", None)):
+                seconds = switches(manager, args.participants, args.read_seconds, legacy)
+                print(f"  {name:<16} switch {sum(seconds) / len(seconds) * 1000:8.1f} ms mean,"
+                      f" {max(seconds) * 1000:8.1f} ms max")
+            samples = recorded_samples()
+            expected = args.read_seconds * RATE
+            print(f"  recorded {min(samples)}-{max(samples)} samples per session (about {expected:.0f} expected)")
+            manager.stop()
+
+            sdk = ReplayTracking(packets, misses=args.misses)
+            manager = TrackerManager(sdk, retry=.1, max_retry=.4).start()
+            tobii = manager.session(1)
+            started = tobii.start_tracking(now_ms())
+            pending = manager.health()["pending"]
+            start = time.perf_counter()
+            manager.wait()
+            health = manager.health()
+            print(f"{args.misses} discoveries finding nothing, retrying from 0.1 s doubling up to 0.4 s:")
+            print(f"  ready after {time.perf_counter() - start:.2f} s and {health['attempts']} attempts")
+            time.sleep(.5)
+            print(f"  book opened while searching: started {started}, pending {pending},"
+                  f" recording once found {manager.health()['recording']}")
+            tobii.stop_tracking(now_ms())
+            print(f"  {recorded_samples()[0]} samples recorded in the 0.5 s after the tracker was found")
+
+            print("connection lost while reading:")
+            tobii = manager.session(2)
+            tobii.start_tracking(now_ms())
+            time.sleep(1)
+            manager.lost("unplugged")
+            time.sleep(.5)
+            tobii.stop_tracking(now_ms())
+            print(f"  state {manager.health()['state']}, {manager.health()['attempts']} attempts,"
+                  f" {recorded_samples()[0]} samples recorded in 1.5 s (about {1.5 * RATE:.0f} at {RATE} Hz)")
+            manager.stop()
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
+import metrics
+from database import EventWriter, clear_screenshot
+from models import CaptureStatus, EventData
+from screenshot import ScreenshotStore
+
+# How long to wait after an event arrives before grabbing the screen, so the
+# reader has had time to render whatever the event changed
+CAPTURE_DELAY = 0.5
+# Maximum number of events waiting for a screenshot before requests block
+QUEUE_SIZE = 256
+# How long a request may wait for a free queue slot before it is rejected
+ENQUEUE_TIMEOUT = 5.0
+# Number of events in flight at once; a worker spends most of its time
+# waiting out CAPTURE_DELAY, so this is much larger than GRAB_THREADS
+WORKERS = 32
+# Number of threads grabbing screenshots; encoding happens on the
+# ScreenshotStore's own threads
+GRAB_THREADS = 4
+# Number of finished jobs whose status is kept around for querying
+STATUS_HISTORY = 4096
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class CaptureJob:
+    def __init__(self, event_data: EventData, received_at: float):
+        self.id = str(uuid.uuid4())
+        self.event_data = event_data
+        self.received_at = received_at
+        self.status = "queued"
+        self.event_id: Optional[int] = None
+        self.screenshot_file: Optional[str] = None
+        self.error: Optional[str] = None
+
+    def describe(self):
+        return CaptureStatus(
+            capture_id=self.id,
+            status=self.status,
+            event_id=self.event_id,
+            screenshot_file=self.screenshot_file,
+            error=self.error,
+        )
+
+
+class CapturePipeline:
+    '''
+    Takes the delayed screenshot and the database insert for an event off the
+    request path.
+
+    Events are put on a bounded queue and picked up by a fixed number of
+    worker tasks. The screen grab runs on a thread pool and the inserts go
+    through an EventWriter, so SQLite only ever sees one writer and events
+    finishing together share a transaction.
+
+    grab(participant_id) returns the screenshot's path. By default the
+    ScreenshotStore's take() is used instead, which encodes and writes the
+    file on its own threads after the event has been stored; a job is done
+    once its file is written, and if that fails the job fails and the event
+    is left without a screenshot.
+    '''
+
+    def __init__(
+        self,
+        grab=None,
+        screenshots=None,
+        writer=None,
+        delay=CAPTURE_DELAY,
+        queue_size=QUEUE_SIZE,
+        workers=WORKERS,
+        grab_threads=GRAB_THREADS,
+        enqueue_timeout=ENQUEUE_TIMEOUT,
+    ):
+        self.screenshots = screenshots if screenshots is not None else ScreenshotStore()
+        # returns the screenshot's path and the Future of its encode, if any
+        if grab is None:
+            self.take = self.screenshots.take
+        else:
+            self.take = lambda participant_id: (grab(participant_id), None)
+        self.writer = writer if writer is not None else EventWriter()
+        self.delay = delay
+        self.queue_size = queue_size
+        self.workers = workers
+        self.grab_threads = grab_threads
+        self.enqueue_timeout = enqueue_timeout
+        self.jobs = OrderedDict()
+        self.queue = None
+        self.tasks = []
+        self.grab_executor = None
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.grab_executor = ThreadPoolExecutor(
+            max_workers=self.grab_threads, thread_name_prefix="capture-grab"
+        )
+        self.screenshots.start()
+        self.writer.start()
+        metrics.CAPTURE_QUEUE_DEPTH.set_function(self.queue.qsize)
+        self.tasks = [
+            asyncio.create_task(self.worker()) for _ in range(self.workers)
+        ]
+
+    async def submit(self, event_data: EventData) -> CaptureJob:
+        job = CaptureJob(event_data, time.monotonic())
+        try:
+            await asyncio.wait_for(self.queue.put(job), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            raise QueueFullError(
+                f"Capture queue is full ({self.queue.qsize()} events waiting)"
+            )
+        self.remember(job)
+        return job
+
+    def remember(self, job: CaptureJob):
+        self.jobs[job.id] = job
+        while len(self.jobs) > STATUS_HISTORY:
+            oldest = next(iter(self.jobs.values()))
+            if oldest.status not in ("done", "failed"):
+                break
+            self.jobs.popitem(last=False)
+
+    def status(self, capture_id: str) -> Optional[CaptureJob]:
+        return self.jobs.get(capture_id)
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        stages = {name: metrics.CAPTURE_STAGE_SECONDS.labels(name) for name in metrics.CAPTURE_STAGES}
+        while True:
+            job = await self.queue.get()
+            try:
+                now = time.monotonic()
+                stages["queue"].observe(now - job.received_at)
+                remaining = job.received_at + self.delay - now
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+
+                job.status = "capturing"
+                start = time.monotonic()
+                stages["sleep"].observe(start - now)
+                job.screenshot_file, encoding = await loop.run_in_executor(
+                    self.grab_executor, self.take, job.event_data.participantId
+                )
+                job.event_data.Screenshot_file = job.screenshot_file
+
+                job.status = "saving"
+                saving = time.monotonic()
+                stages["grab"].observe(saving - start)
+                event = await asyncio.wrap_future(
+                    self.writer.submit(job.event_data)
+                )
+                done = time.monotonic()
+                stages["insert"].observe(done - saving)
+                metrics.CAPTURE_SECONDS.observe(done - job.received_at)
+                job.event_id = event.id
+                if encoding is not None:
+                    await self.written(job, encoding)
+                job.status = "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                print(f"Capture {job.id} failed: {e}")
+            finally:
+                metrics.CAPTURE_EVENTS.labels(job.status).inc()
+                self.queue.task_done()
+
+    async def written(self, job, encoding):
+        '''Wait for the job's screenshot to be on disk, or take it off its event'''
+        try:
+            await asyncio.wrap_future(encoding)
+        except Exception as e:
+            # the event must not point at a file that was never written
+            await asyncio.wrap_future(self.writer.call(partial(clear_screenshot, job.event_id)))
+            job.screenshot_file = None
+            raise RuntimeError(f"Could not write screenshot: {e}") from e
+
+    async def drain(self):
+        '''Wait for every queued event to be stored, then stop the workers'''
+        if self.queue is None:
+            return
+        await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        # joining the grab, writer and encoder threads blocks, so it happens
+        # off the event loop, which keeps answering requests meanwhile
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def close(self):
+        self.grab_executor.shutdown(wait=True)
+        self.writer.close()
+        try:
+            self.screenshots.close()
+        except RuntimeError as e:
+            # the captures of those screenshots have failed with it already
+            print(e)
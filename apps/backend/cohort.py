@@ -0,0 +1,263 @@
+'''
+Runs the per-page gaze analysis for a whole cohort on a process pool.
+
+The notebooks walk participants and books one at a time: load the book's gaze
+file, cut it into pages, run detect_fix_ivt and find_sacc_from_fix on each
+page, plot. analyse_cohort() does the first part for every (participant, book)
+at once, one unit per worker process, and returns the concatenated result
+tables so the plotting can run on them afterwards:
+
+    segments = segment_events(participant_ids)
+    result = analyse_cohort(book_units(segments), workers=8, sacvel=80)
+    result.fixations, result.saccades, result.pupils, result.errors
+
+Each worker opens only its own book's recording. A unit that fails (missing
+or corrupt gaze file, a detector error) is reported in result.errors with its
+traceback and does not stop the others.
+
+With cache= a DetectorCache folder, each unit's tables are stored under a key
+of its gaze file's content, pages, eye, detector and parameters, and a rerun
+reads them back without opening the recording or running the detectors.
+'''
+
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import gazefile
+import kinematics
+from detectorcache import DetectorCache, code_digest
+from gazesession import GazeSession
+from segmentation import EYE_TRACKER_FOLDER
+from velocityThreshold import detect_fix_idt, detect_fix_ivt, find_sacc_from_fix
+
+DETECTORS = {
+    "ivt": detect_fix_ivt,
+    "idt": detect_fix_idt,
+}
+# what a unit's results depend on besides its inputs: this module and every
+# module of ours it imports (the detectors, kinematics, gazesession, geometry)
+UNIT_VERSION = code_digest(sys.modules[__name__])
+UNIT_COLUMNS = ("participant_id", "book", "page_event_id")
+PUPIL_COLUMNS = UNIT_COLUMNS + (
+    "eye",
+    "samples",
+    "valid",
+    "mean",
+    "std",
+    "min",
+    "max",
+)
+
+
+@dataclass
+class CohortUnit:
+    '''One book read by one participant: its gaze file and page windows'''
+    participant_id: int
+    book: str
+    gaze_file: str
+    dominant_eye: str = "right"
+    # (page_event_id, page_start, page_end), epoch milliseconds
+    pages: List[Tuple[int, int, int]] = field(default_factory=list)
+
+
+@dataclass
+class UnitResult:
+    unit: CohortUnit
+    fixations: Optional[pd.DataFrame] = None
+    saccades: Optional[pd.DataFrame] = None
+    pupils: Optional[pd.DataFrame] = None
+    error: Optional[str] = None
+    seconds: float = 0.
+
+
+@dataclass
+class CohortResult:
+    fixations: pd.DataFrame
+    saccades: pd.DataFrame
+    pupils: pd.DataFrame
+    # (unit, traceback) for every unit that failed
+    errors: List[Tuple[CohortUnit, str]]
+    seconds: float
+
+
+def book_units(segments, folder=EYE_TRACKER_FOLDER, dominant_eyes=None):
+    '''
+    Turn the per-page rows of segmentation.segment_events() into one
+    CohortUnit per book. The dominant eye defaults to the participant's in
+    participants.json.
+    '''
+    if dominant_eyes is None:
+        from utils import get_participant_dominant_eye
+
+        dominant_eyes = {
+            p: get_participant_dominant_eye(p) for p in segments.participant_id.unique()
+        }
+    units = []
+    keys = ["participant_id", "book", "book_start", "gaze_file"]
+    for (participant_id, book, _, gaze_file), pages in segments.groupby(keys, sort=False):
+        units.append(CohortUnit(
+            participant_id=int(participant_id),
+            book=book,
+            gaze_file=os.path.join(folder, gaze_file),
+            dominant_eye=dominant_eyes.get(participant_id, "right"),
+            pages=list(zip(
+                pages.page_event_id.tolist(),
+                pages.page_start.tolist(),
+                pages.page_end.tolist(),
+            )),
+        ))
+    return units
+
+
+def tag(table, unit, page_event_id):
+    table.insert(0, "participant_id", unit.participant_id)
+    table.insert(1, "book", unit.book)
+    table.insert(2, "page_event_id", page_event_id)
+    return table
+
+
+def pupil_summary(window, unit, page_event_id):
+    rows = []
+    for eye in ("left", "right"):
+        name = f"{eye}_pupil_diameter"
+        if name not in window.session.source:
+            continue
+        diameter = np.asarray(window[name], dtype=float)
+        valid = np.asarray(window[f"{eye}_pupil_validity"]) == 1
+        valid &= np.isfinite(diameter)
+        d = diameter[valid]
+        if len(d):
+            rows.append((eye, len(diameter), len(d), d.mean(), d.std(), d.min(), d.max()))
+        else:
+            rows.append((eye, len(diameter), 0, np.nan, np.nan, np.nan, np.nan))
+    return tag(pd.DataFrame(rows, columns=PUPIL_COLUMNS[3:]), unit, page_event_id)
+
+
+def analyse_unit(unit, detector="ivt", cache=None, **params):
+    '''
+    Detect fixations and saccades on every page of one book. Runs in a worker
+    process, so everything it needs comes in with the unit and errors are
+    returned rather than raised.
+    '''
+    start = time.perf_counter()
+    result = UnitResult(unit)
+    try:
+        # only reads the header; legacy JSON recordings get converted here
+        source = gazefile.open_session(unit.gaze_file)
+        if cache is not None:
+            cache = DetectorCache(cache) if isinstance(cache, str) else cache
+            key = cache.key(
+                "analyse_unit",
+                [detector, params, unit.dominant_eye, unit.pages, UNIT_VERSION],
+                cache.file_digest(source.path),
+            )
+            stored = cache.get("analyse_unit", key)
+            if stored is not None:
+                result.fixations, result.saccades, result.pupils = stored
+                result.seconds = time.perf_counter() - start
+                return result
+        detect = DETECTORS[detector]
+        session = GazeSession(source)
+        fixations = []
+        saccades = []
+        pupils = []
+        for page_event_id, page_start, page_end in unit.pages:
+            window = session.window(page_start, page_end)
+            pupils.append(pupil_summary(window, unit, page_event_id))
+
+            # the notebooks' page DataFrame: valid samples of the dominant
+            # eye, in degrees and seconds
+            x, y, valid = kinematics.eye_position(window, unit.dominant_eye)
+            df = pd.DataFrame({
+                "x": x[valid],
+                "y": y[valid],
+                "ts": window.timestamps[valid] / 1_000_000,
+            })
+            if df.empty:
+                continue
+            with np.errstate(invalid="ignore", divide="ignore"):
+                page_fixations, v, _ = detect(df, **params)
+                if page_fixations.empty:
+                    continue
+                page_saccades = find_sacc_from_fix(page_fixations, velocity=v)
+            fixations.append(tag(page_fixations, unit, page_event_id))
+            saccades.append(tag(page_saccades, unit, page_event_id))
+
+        result.fixations = pd.concat(fixations, ignore_index=True) if fixations else None
+        result.saccades = pd.concat(saccades, ignore_index=True) if saccades else None
+        result.pupils = pd.concat(pupils, ignore_index=True) if pupils else None
+        if cache is not None:
+            cache.put("analyse_unit", key, (result.fixations, result.saccades, result.pupils))
+    except Exception:
+        result.error = traceback.format_exc()
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def report_progress(done, total, result):
+    unit = result.unit
+    status = "failed" if result.error else f"{result.seconds:.2f}s"
+    print(f"[{done}/{total}] participant {unit.participant_id} {unit.book!r}: {status}")
+
+
+def concat(tables):
+    tables = [t for t in tables if t is not None]
+    if not tables:
+        return pd.DataFrame()
+    return pd.concat(tables, ignore_index=True)
+
+
+def analyse_cohort(units, workers=None, progress=report_progress, detector="ivt", cache=None, **params):
+    '''
+    Run analyse_unit for every unit on a pool of `workers` processes (all
+    cores by default; 0 runs everything in this process) and concatenate the
+    results. progress(done, total, unit_result) is called as units finish.
+    detector is "ivt" or "idt"; params go to the detector, e.g. sacvel=80.
+    cache is the folder of a DetectorCache to reuse unit results from.
+    '''
+    if detector not in DETECTORS:
+        raise ValueError(f"Unknown detector {detector}, expected one of {tuple(DETECTORS)}")
+    units = list(units)
+    start = time.perf_counter()
+    results = [None] * len(units)
+    done = 0
+
+    def finished(i, result):
+        nonlocal done
+        # results come back from the workers with a copy of their unit
+        result.unit = units[i]
+        results[i] = result
+        done += 1
+        if progress is not None:
+            progress(done, len(units), result)
+
+    if workers == 0:
+        for i, unit in enumerate(units):
+            finished(i, analyse_unit(unit, detector, cache, **params))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(analyse_unit, unit, detector, cache, **params): i for i, unit in enumerate(units)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    result = future.result()
+                except Exception:
+                    # the worker itself died (e.g. out of memory)
+                    result = UnitResult(units[i], error=traceback.format_exc())
+                finished(i, result)
+
+    return CohortResult(
+        fixations=concat(r.fixations for r in results),
+        saccades=concat(r.saccades for r in results),
+        pupils=concat(r.pupils for r in results),
+        errors=[(r.unit, r.error) for r in results if r.error],
+        seconds=time.perf_counter() - start,
+    )
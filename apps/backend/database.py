@@ -1,17 +1,46 @@
-from peewee import SqliteDatabase
-from models import EventData, Events
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, SimpleQueue
 
-# Define the SQLite database connection
-db = SqliteDatabase('events.db')
+from peewee import Tuple
 
-# Initialize the database and create tables if they don't exist
-def initialize_database():
-    db.connect()
-    db.create_tables([Events], safe=True)  # Use "safe=True" to avoid errors if tables already exist
+import metrics
+from models import NATURAL_KEY, EventData, Events, db
 
-# Insert event data into the database
-def insert_event_data(event_data: EventData):
-    return Events.create(
+# How long the writer waits for more events to share a transaction with
+GROUP_COMMIT_WINDOW = 0.005
+# Upper bound on the number of events committed together
+GROUP_COMMIT_MAX = 256
+
+# Initialize the database and create tables if they don't exist. Events must
+# be bound to target (it is to db, the server's database, by default)
+def initialize_database(target=db):
+    target.connect(reuse_if_open=True)
+    if target.table_exists(Events):
+        relax_natural_key_index(target)
+    # "safe=True" avoids errors if tables already exist, and creates the
+    # indexes of an existing table if they are missing, which is all the
+    # migration older databases need
+    target.create_tables([Events], safe=True)
+
+
+def relax_natural_key_index(target=db):
+    '''
+    Drop a unique index on the natural key, as databases created for a while
+    had. Two different events can share the key (two font size changes in
+    one millisecond), and the live server must store both; create_tables
+    builds the index again without the constraint.
+    '''
+    for index in target.get_indexes(Events._meta.table_name):
+        if index.unique and tuple(index.columns) == NATURAL_KEY:
+            target.execute_sql(f'DROP INDEX "{index.name}"')
+
+
+def event_fields(event_data: EventData):
+    return dict(
         time=event_data.timestamp,
         agent=event_data.agent,
         event=event_data.event,
@@ -21,6 +50,209 @@ def insert_event_data(event_data: EventData):
         screenshot_file=event_data.Screenshot_file
     )
 
+# Insert event data into the database
+def insert_event_data(event_data: EventData):
+    return Events.create(**event_fields(event_data))
+
+
+class EventWriter:
+    '''
+    Inserts events from a single thread, committing everything that arrives
+    within GROUP_COMMIT_WINDOW of the first waiting event in one transaction.
+
+    submit() returns a Future that resolves to the created Events row once its
+    transaction has committed. When a transaction fails its events are written
+    again one at a time, so only an event that can't be stored fails.
+    '''
+
+    def __init__(self, window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX):
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = SimpleQueue()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="event-writer", daemon=True)
+        self.thread.start()
+        metrics.EVENT_WRITER_QUEUE_DEPTH.set_function(self.queue.qsize)
+
+    def submit(self, event_data: EventData) -> Future:
+        future = Future()
+        self.queue.put((event_data, future))
+        return future
+
+    def call(self, function) -> Future:
+        '''Run function() on the writer thread, in the next transaction, and return its Future'''
+        future = Future()
+        self.queue.put((function, future))
+        return future
+
+    def next_batch(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except Empty:
+                break
+            if item is None:
+                # let close() see the sentinel after this batch is written
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                break
+            start = time.perf_counter()
+            try:
+                with db.atomic():
+                    events = [write(e) for e, _ in batch]
+            except Exception:
+                # the transaction was rolled back; write the events one at a
+                # time so only the one that can't be stored fails
+                self.run_each(batch)
+                continue
+            metrics.EVENT_COMMIT_SECONDS.observe(time.perf_counter() - start)
+            metrics.EVENT_BATCH_SIZE.observe(len(batch))
+            for event, (_, future) in zip(events, batch):
+                future.set_result(event)
+        db.close()
+
+    def run_each(self, batch):
+        for work, future in batch:
+            start = time.perf_counter()
+            try:
+                with db.atomic():
+                    event = write(work)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            metrics.EVENT_COMMIT_SECONDS.observe(time.perf_counter() - start)
+            metrics.EVENT_BATCH_SIZE.observe(1)
+            future.set_result(event)
+
+    def close(self):
+        '''Commit everything submitted so far and stop the writer thread'''
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+
+def write(work):
+    '''Store an event, or run one of EventWriter.call's functions'''
+    if isinstance(work, EventData):
+        return Events.create(**event_fields(work))
+    return work()
+
+
+def clear_screenshot(event_id):
+    '''Forget the screenshot of an event whose file could not be written'''
+    return Events.update(screenshot_file=None).where(Events.id == event_id).execute()
+
+
+EVENT_FIELDS = tuple(Events._meta.sorted_field_names)
+
+
+def parse_cursor(cursor: str):
+    '''Parse a "time:id" keyset cursor as returned with a page of events'''
+    try:
+        t, i = cursor.split(":")
+        return int(t), int(i)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def select_events(
+    participant_ids=None,
+    events=None,
+    start_time=None,
+    end_time=None,
+    after=None,
+    fields=None,
+):
+    '''
+    Build a query for events ordered by (time, id), optionally filtered and
+    starting after a (time, id) keyset cursor. time and id are always
+    selected so the caller can produce the next cursor.
+    '''
+    fields = list(fields or EVENT_FIELDS)
+    unknown = set(fields) - set(EVENT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    for required in ("id", "time"):
+        if required not in fields:
+            fields.append(required)
+
+    query = Events.select(*[Events._meta.fields[f] for f in fields])
+    if participant_ids:
+        query = query.where(Events.participant_id.in_(participant_ids))
+    if events:
+        query = query.where(Events.event.in_(events))
+    if start_time is not None:
+        query = query.where(Events.time >= start_time)
+    if end_time is not None:
+        query = query.where(Events.time <= end_time)
+    if after is not None:
+        query = query.where(Tuple(Events.time, Events.id) > Tuple(*after))
+    return query.order_by(Events.time, Events.id)
+
+
+def screenshot_timeline(participant_id, start_time=None, end_time=None):
+    '''
+    Return id, time, event and screenshot_file of every event of a
+    participant that has a screenshot, in order, from one query.
+    '''
+    query = select_events(
+        participant_ids=[participant_id],
+        start_time=start_time,
+        end_time=end_time,
+        fields=["id", "time", "event", "screenshot_file"],
+    )
+    return list(query.where(Events.screenshot_file.is_null(False)).dicts())
+
+
+def stream_events(query, batch_size=500):
+    '''
+    Yield the rows of a query as lists of up to batch_size dicts, fetched from
+    one cursor on a connection of its own. The connection may be used from
+    whichever thread asks for the next batch, which is how Starlette iterates
+    a synchronous response body (one thread pool hop per batch, not per row).
+    '''
+    sql, params = query.sql()
+    conn = sqlite3.connect(db.database, check_same_thread=False)
+    try:
+        cursor = conn.execute(sql, params)
+        names = [d[0] for d in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [dict(zip(names, row)) for row in rows]
+    finally:
+        conn.close()
+
 # Close the database connection
 def close_database():
     db.close()
+
+
+if __name__ == "__main__":
+    # python database.py other-station/events.db ... brings older databases up
+    # to the current schema (WAL mode and indexes)
+    for path in sys.argv[1:] or ["events.db"]:
+        db.init(path)
+        initialize_database()
+        close_database()
+        print(f"Migrated {path}")
@@ -0,0 +1,333 @@
+'''
+On-disk memoization of the velocityThreshold detectors.
+
+Results are content addressed: the key hashes the detector's name, its
+parameters (defaults filled in), the bytes of its input and CODE_VERSION, a
+hash of velocityThreshold.py and of every module of ours it imports
+(geometry.py). Changing a threshold, the gaze data or the detector code
+therefore gives a new key, and nothing has to be invalidated by hand for
+correctness:
+
+    cache = DetectorCache()
+    detect = cache.wrap(detect_fix_ivt)
+    fixations, v, labels = detect(df, sacvel=80)   # computed and stored
+    fixations, v, labels = detect(df, sacvel=80)   # read back
+
+Entries are single .npz files holding every column of every returned
+DataFrame or array. The cache is bounded to max_bytes; the least recently
+read entries are evicted first. invalidate() drops a detector's entries, or
+everything.
+
+Gaze files are hashed by content too (file_digest), with the digest
+remembered per file size and modification time so a warm run does not
+re-read every recording.
+'''
+
+import ast
+import hashlib
+import inspect
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import velocityThreshold
+
+CACHE_FOLDER = ".detector_cache"
+MAX_BYTES = 2 << 30
+DIGESTS_FILE = "digests.json"
+
+
+def code_digest(*modules):
+    '''
+    Hash the source of the given modules together with every module next to
+    them that they import, directly or through one another
+    '''
+    sources = {}
+    pending = [os.path.abspath(inspect.getsourcefile(module)) for module in modules]
+    while pending:
+        path = pending.pop()
+        if path in sources:
+            continue
+        with open(path, "rb") as f:
+            sources[path] = f.read()
+        for node in ast.walk(ast.parse(sources[path])):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                local = os.path.join(os.path.dirname(path), name.split(".")[0] + ".py")
+                if os.path.exists(local):
+                    pending.append(local)
+
+    h = hashlib.blake2b(digest_size=16)
+    for path in sorted(sources):
+        h.update(os.path.basename(path).encode())
+        h.update(sources[path])
+    return h.hexdigest()
+
+
+CODE_VERSION = code_digest(velocityThreshold)
+
+
+def update_hash(h, value):
+    '''Feed a detector input or parameter into a hash, by content'''
+    if isinstance(value, pd.DataFrame):
+        h.update(b"frame")
+        for name in value.columns:
+            h.update(str(name).encode())
+            update_hash(h, value[name].to_numpy())
+    elif isinstance(value, np.ndarray) and value.dtype == object:
+        h.update(json.dumps(value.tolist(), default=str).encode())
+    elif isinstance(value, np.ndarray):
+        values = np.ascontiguousarray(value)
+        h.update(f"array{values.dtype.str}{values.shape}".encode())
+        h.update(values.view(np.uint8).reshape(-1) if values.size else b"")
+    else:
+        h.update(json.dumps(value, sort_keys=True, default=str).encode())
+
+
+def fingerprint(path):
+    '''Sizes and modification times of a file, or of every file in a directory'''
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(path)
+            for name in names
+        )
+    else:
+        files = [path]
+    return [
+        [os.path.relpath(f, path) if f != path else "", os.stat(f).st_size, os.stat(f).st_mtime_ns]
+        for f in files
+    ]
+
+
+class DetectorCache:
+    def __init__(self, root=CACHE_FOLDER, max_bytes=MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+        self._digests = None
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, name, params, *inputs):
+        h = hashlib.blake2b(digest_size=20)
+        update_hash(h, [name, CODE_VERSION, params])
+        for value in inputs:
+            update_hash(h, value)
+        return h.hexdigest()
+
+    def path(self, name, key):
+        return os.path.join(self.root, name, key + ".npz")
+
+    def get(self, name, key):
+        '''Return the stored outputs for a key, or None'''
+        path = self.path(name, key)
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                outputs = unpack(stored)
+        except (FileNotFoundError, ValueError, OSError, KeyError):
+            return None
+        try:
+            # the modification time is the entry's last use, for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return outputs
+
+    def put(self, name, key, outputs):
+        path = self.path(name, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            arrays = pack(outputs)
+        except TypeError as e:
+            print(f"Not caching {name} result: {e}")
+            return
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(path)
+        self.evict()
+
+    def entries(self):
+        '''Return (path, size, last used) for every entry'''
+        found = []
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".npz"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    found.append((path, stat.st_size, stat.st_mtime_ns))
+        return found
+
+    def size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self.entries())
+            return self._size
+
+    def evict(self):
+        '''Remove the least recently used entries until the cache fits max_bytes'''
+        if self.size() <= self.max_bytes:
+            return
+        with self._lock:
+            entries = sorted(self.entries(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._size = total
+
+    def invalidate(self, name=None):
+        '''Drop every entry of one detector, or all entries'''
+        with self._lock:
+            names = [name] if name is not None else [
+                d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d))
+            ]
+            for n in names:
+                folder = os.path.join(self.root, n)
+                if not os.path.isdir(folder):
+                    continue
+                for entry in os.listdir(folder):
+                    try:
+                        os.remove(os.path.join(folder, entry))
+                    except FileNotFoundError:
+                        pass
+            self._size = None
+
+    def file_digest(self, path):
+        '''
+        Return a content hash of a gaze file or session directory. The hash is
+        kept with the files' sizes and modification times and only
+        recomputed when those change.
+        '''
+        path = os.path.abspath(path)
+        stamp = fingerprint(path)
+        with self._lock:
+            if self._digests is None:
+                self._digests = self._read_digests()
+            known = self._digests.get(path)
+        if known is not None and known["fingerprint"] == stamp:
+            return known["digest"]
+
+        h = hashlib.blake2b(digest_size=20)
+        for name, _, _ in stamp:
+            h.update(name.encode())
+            with open(os.path.join(path, name) if name else path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+        digest = h.hexdigest()
+
+        with self._lock:
+            # merge with what other processes may have recorded meanwhile
+            self._digests = self._read_digests()
+            self._digests[path] = {"fingerprint": stamp, "digest": digest}
+            tmp = os.path.join(self.root, f"{DIGESTS_FILE}.{os.getpid()}.tmp")
+            with open(tmp, "w") as f:
+                json.dump(self._digests, f)
+            os.replace(tmp, os.path.join(self.root, DIGESTS_FILE))
+        return digest
+
+    def _read_digests(self):
+        try:
+            with open(os.path.join(self.root, DIGESTS_FILE), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def wrap(self, detector):
+        '''
+        Return a version of a detector (or of find_sacc_from_fix) that looks
+        its result up before computing it. Arguments are bound to the
+        detector's signature, so detect(df) and detect(df, sacvel=20.) share
+        an entry.
+        '''
+        signature = inspect.signature(detector)
+        name = detector.__name__
+
+        def cached(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = self.key(name, list(bound.arguments), *bound.arguments.values())
+            outputs = self.get(name, key)
+            if outputs is None:
+                outputs = detector(*args, **kwargs)
+                self.put(name, key, outputs)
+            return outputs
+
+        cached.__name__ = name
+        cached.__doc__ = detector.__doc__
+        return cached
+
+
+def pack(outputs):
+    '''Flatten a result (a value or tuple of DataFrames, arrays and Nones) into npz arrays'''
+    single = not isinstance(outputs, tuple)
+    values = (outputs,) if single else outputs
+    layout = []
+    arrays = {}
+    for i, value in enumerate(values):
+        if value is None:
+            layout.append(["none"])
+        elif isinstance(value, pd.DataFrame):
+            columns = [str(c) for c in value.columns]
+            objects = []
+            for j, c in enumerate(value.columns):
+                column = value[c].to_numpy()
+                if column.dtype == object:
+                    # strings (or the empty columns of a detector that found
+                    # nothing), stored without pickling
+                    objects.append(j)
+                    column = plain_array(column)
+                arrays[f"{i}_{j}"] = column
+            layout.append(["frame", columns, objects])
+        else:
+            value = np.asarray(value)
+            if value.dtype == object:
+                raise TypeError("object arrays are not supported")
+            layout.append(["array"])
+            arrays[f"{i}"] = value
+    arrays["layout"] = np.array(json.dumps({"single": single, "values": layout}))
+    return arrays
+
+
+def plain_array(column):
+    if len(column) == 0:
+        return np.empty(0)
+    if all(isinstance(v, str) for v in column):
+        return column.astype(str)
+    raise TypeError("object columns must hold strings")
+
+
+def unpack(stored):
+    layout = json.loads(str(stored["layout"]))
+    values = []
+    for i, entry in enumerate(layout["values"]):
+        if entry[0] == "none":
+            values.append(None)
+        elif entry[0] == "frame":
+            columns = {c: stored[f"{i}_{j}"] for j, c in enumerate(entry[1])}
+            for j in entry[2]:
+                columns[entry[1][j]] = columns[entry[1][j]].astype(object)
+            values.append(pd.DataFrame(columns, columns=entry[1]))
+        else:
+            values.append(stored[f"{i}"])
+    return values[0] if layout["single"] else tuple(values)
@@ -0,0 +1,409 @@
+'''
+Columnar on-disk format for gaze recordings.
+
+A session is a directory, e.g. eye_tracker_data/[12]-2023-11-30_14-02-11.gaze/,
+holding header.json with the session metadata (participant, start/end time,
+the mono/epoch clock anchors) and one .npy file per field of the Tobii gaze
+packet. Columns keep the packet key as their name, so
+packet["left_gaze_point_validity"] becomes session["left_gaze_point_validity"],
+and they are memory-mapped so reading one field of a long session does not
+touch the others.
+
+While recording, SessionRecorder streams samples into
+[...].gaze.partial/ as raw .bin columns plus an index of how many rows have
+been written. Closing the recorder renames it into place; a recording that
+never got closed (the backend crashed) is recovered up to its last indexed
+chunk when it is opened.
+
+Older sessions recorded as a single JSON document can be converted with
+
+    python gazefile.py eye_tracker_data/*.json
+'''
+
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+from operator import itemgetter
+
+import numpy as np
+
+FORMAT_VERSION = 1
+SUFFIX = ".gaze"
+HEADER_FILE = "header.json"
+INDEX_FILE = "index"
+PARTIAL_SUFFIX = ".partial"
+# An unclosed recording whose index hasn't changed for this many seconds is
+# assumed to be abandoned rather than still running
+STALE_AFTER = 60
+TIMESTAMP_COLUMNS = ("device_time_stamp", "system_time_stamp")
+
+
+def column_dtype(name):
+    if name in TIMESTAMP_COLUMNS:
+        return np.int64
+    if name.endswith("_validity"):
+        return np.int8
+    return np.float64
+
+
+def session_path(path):
+    '''Return the columnar session path for a gaze file, whatever its extension'''
+    base, ext = os.path.splitext(path)
+    if ext in (".json", SUFFIX):
+        return base + SUFFIX
+    return path + SUFFIX
+
+
+def packets_to_columns(packets):
+    '''Turn a list of Tobii gaze packet dicts into a dict of typed arrays'''
+    if len(packets) == 0:
+        return {}
+    columns = {}
+    for name in packets[0]:
+        # missing values (NaN written out as null) become NaN
+        values = [packet[name] for packet in packets]
+        columns[name] = np.array(values, dtype=column_dtype(name))
+    return columns
+
+
+def write_columns(path, header, columns):
+    '''
+    Write a session directory. The session is written next to its final
+    location and renamed into place, so a reader never sees half of it.
+    '''
+    path = session_path(path)
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+
+    header = dict(header)
+    header["version"] = FORMAT_VERSION
+    header["samples"] = lengths.pop() if lengths else 0
+    header["columns"] = {}
+    for name, values in columns.items():
+        values = np.ascontiguousarray(values)
+        np.save(os.path.join(tmp, name + ".npy"), values)
+        header["columns"][name] = {
+            "dtype": values.dtype.str,
+            "shape": list(values.shape[1:]),
+        }
+
+    with open(os.path.join(tmp, HEADER_FILE), "w") as f:
+        json.dump(header, f, indent=2)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp, path)
+    return path
+
+
+def write_session(path, header, packets):
+    '''Write the packets collected by the tracker callback as a session'''
+    return write_columns(path, header, packets_to_columns(packets))
+
+
+class GazeFile:
+    '''
+    A columnar gaze session. Header fields are available as attributes
+    (participantId, start_time, system_start_time_mono, ...) and columns by
+    indexing with the packet key. Columns are loaded lazily and cached.
+    '''
+
+    def __init__(self, path, mmap=True):
+        self.path = session_path(path)
+        self.mmap = mmap
+        with open(os.path.join(self.path, HEADER_FILE), "r") as f:
+            self.header = json.load(f)
+        self._columns = {}
+
+    def __getattr__(self, name):
+        header = self.__dict__.get("header", {})
+        if name in header:
+            return header[name]
+        raise AttributeError(name)
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            if name not in self.header["columns"]:
+                raise KeyError(name)
+            self._columns[name] = self._read_column(name)
+        return self._columns[name]
+
+    def _read_column(self, name):
+        npy = os.path.join(self.path, name + ".npy")
+        if os.path.exists(npy):
+            return np.load(npy, mmap_mode="r" if self.mmap else None)
+
+        # raw column streamed by SessionRecorder
+        column = self.header["columns"][name]
+        shape = (len(self),) + tuple(column["shape"])
+        if shape[0] == 0:
+            return np.empty(shape, dtype=column["dtype"])
+        values = np.memmap(
+            os.path.join(self.path, name + ".bin"),
+            dtype=column["dtype"], mode="r", shape=shape,
+        )
+        return values if self.mmap else np.array(values)
+
+    def __contains__(self, name):
+        return name in self.header["columns"]
+
+    def __len__(self):
+        return self.header["samples"]
+
+    @property
+    def columns(self):
+        return list(self.header["columns"])
+
+    def load(self, *names):
+        '''Return the named columns as a dict of arrays'''
+        return {name: self[name] for name in names}
+
+    def packets(self):
+        '''Yield the samples as packet dicts, the way the JSON files held them'''
+        names = self.columns
+        arrays = [np.asarray(self[name]) for name in names]
+        for i in range(len(self)):
+            yield {
+                name: tuple(values[i].tolist()) if values.ndim > 1 else values[i].item()
+                for name, values in zip(names, arrays)
+            }
+
+
+def convert_json(json_path, out_path=None):
+    '''Convert a JSON gaze file written by Tobii.stop_tracking to a session'''
+    with open(json_path, "r") as f:
+        gaze_data = json.load(f)
+    packets = gaze_data.pop("data")
+    return write_session(out_path or json_path, gaze_data, packets)
+
+
+class SessionRecorder:
+    '''
+    Streams gaze samples to a session on disk while they are being recorded.
+
+    push() is the tracker callback. It only turns the packet into a tuple of
+    its values and appends it to a bounded deque; a writer thread drains the
+    deque every flush_interval seconds (or as soon as chunk_size samples are
+    waiting), appends each column to its .bin file and records the new row
+    count in the index. Files are fsynced every fsync_interval seconds. When
+    more than capacity samples are waiting the newest are dropped and counted
+    in self.dropped rather than letting memory grow.
+    '''
+
+    def __init__(
+        self,
+        path,
+        header,
+        chunk_size=4096,
+        capacity=1 << 16,
+        flush_interval=0.25,
+        fsync_interval=2.0,
+    ):
+        self.path = session_path(path)
+        self.partial = self.path + PARTIAL_SUFFIX
+        self.header = dict(header)
+        self.chunk_size = chunk_size
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+
+        self.buffer = deque()
+        self.names = None
+        self.values = None
+        self.files = {}
+        self.rows = 0
+        self.dropped = 0
+        self.bytes_written = 0
+
+        if os.path.exists(self.partial):
+            shutil.rmtree(self.partial)
+        os.makedirs(self.partial)
+        self.index = open(os.path.join(self.partial, INDEX_FILE), "a")
+        self._write_header()
+
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = threading.Thread(
+            target=self._run, name="gaze-writer", daemon=True
+        )
+        self.thread.start()
+
+    def push(self, gaze_data):
+        if self.values is None:
+            self.names = list(gaze_data)
+            self.values = itemgetter(*self.names)
+        if len(self.buffer) >= self.capacity:
+            self.dropped += 1
+            return
+        self.buffer.append(self.values(gaze_data))
+        if len(self.buffer) >= self.chunk_size:
+            self.wakeup.set()
+
+    def _write_header(self):
+        header = dict(self.header)
+        header["version"] = FORMAT_VERSION
+        header["samples"] = self.rows
+        header["dropped"] = self.dropped
+        header["columns"] = {}
+        for name, f in self.files.items():
+            header["columns"][name] = f["schema"]
+
+        tmp = os.path.join(self.partial, HEADER_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(header, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.partial, HEADER_FILE))
+
+    def _open_columns(self, columns):
+        for name, values in columns.items():
+            self.files[name] = {
+                "file": open(os.path.join(self.partial, name + ".bin"), "ab"),
+                "schema": {
+                    "dtype": values.dtype.str,
+                    "shape": list(values.shape[1:]),
+                },
+            }
+        self._write_header()
+
+    def _flush(self):
+        count = min(len(self.buffer), self.chunk_size)
+        if count == 0:
+            return 0
+        popleft = self.buffer.popleft
+        records = [popleft() for _ in range(count)]
+
+        columns = {
+            name: np.array(values, dtype=column_dtype(name))
+            for name, values in zip(self.names, zip(*records))
+        }
+        if not self.files:
+            self._open_columns(columns)
+        for name, values in columns.items():
+            data = np.ascontiguousarray(values).tobytes()
+            self.files[name]["file"].write(data)
+            self.bytes_written += len(data)
+
+        self.rows += count
+        for f in self.files.values():
+            f["file"].flush()
+        self.index.write(f"{self.rows}\n")
+        self.index.flush()
+        return count
+
+    def _fsync(self):
+        for f in self.files.values():
+            os.fsync(f["file"].fileno())
+        os.fsync(self.index.fileno())
+
+    def _run(self):
+        last_sync = time.monotonic()
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            while self._flush() == self.chunk_size:
+                pass
+            if time.monotonic() - last_sync >= self.fsync_interval:
+                self._fsync()
+                last_sync = time.monotonic()
+            if self.stopping and not self.buffer:
+                break
+
+    def close(self, **header):
+        '''
+        Write out every buffered sample, add the given fields to the header and
+        move the session into place. Returns the session path.
+        '''
+        self.stopping = True
+        self.wakeup.set()
+        self.thread.join()
+
+        self._fsync()
+        for f in self.files.values():
+            f["file"].close()
+        self.index.close()
+
+        self.header.update(header)
+        self._write_header()
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self.partial, self.path)
+        return self.path
+
+    def discard(self):
+        '''Stop writing and delete the partial session, for a recording that never started'''
+        self.buffer.clear()
+        self.stopping = True
+        self.wakeup.set()
+        self.thread.join()
+        for f in self.files.values():
+            f["file"].close()
+        self.index.close()
+        shutil.rmtree(self.partial, ignore_errors=True)
+
+
+def recover(path):
+    '''
+    Turn a recording that was never closed into a session holding every
+    sample up to the last chunk that fully reached the disk.
+    '''
+    columnar = session_path(path)
+    partial = columnar + PARTIAL_SUFFIX
+    index = os.path.join(partial, INDEX_FILE)
+    if os.path.exists(index) and time.time() - os.path.getmtime(index) < STALE_AFTER:
+        raise RuntimeError(f"{partial} is still being recorded")
+
+    with open(os.path.join(partial, HEADER_FILE), "r") as f:
+        header = json.load(f)
+
+    rows = 0
+    if os.path.exists(index):
+        with open(index, "r") as f:
+            lines = [line for line in f.read().split("\n") if line.strip()]
+        if lines:
+            rows = int(lines[-1])
+
+    for name, column in header["columns"].items():
+        row_bytes = np.dtype(column["dtype"]).itemsize * int(np.prod(column["shape"]))
+        size = os.path.getsize(os.path.join(partial, name + ".bin"))
+        rows = min(rows, size // row_bytes)
+    header["samples"] = rows
+    header["recovered"] = True
+
+    with open(os.path.join(partial, HEADER_FILE), "w") as f:
+        json.dump(header, f, indent=2)
+    os.rename(partial, columnar)
+    return columnar
+
+
+def open_session(path, mmap=True, convert=True):
+    '''
+    Open the session for a gaze file. `path` may name the session directory
+    or the legacy .json file; a JSON file without a session next to it is
+    converted first unless convert is False, and an interrupted recording is
+    recovered.
+    '''
+    columnar = session_path(path)
+    if not os.path.isdir(columnar) and os.path.isdir(columnar + PARTIAL_SUFFIX):
+        recover(columnar)
+    if not os.path.isdir(columnar):
+        json_path = os.path.splitext(columnar)[0] + ".json"
+        if not convert or not os.path.exists(json_path):
+            raise FileNotFoundError(f"No gaze session at {columnar}")
+        convert_json(json_path)
+    return GazeFile(columnar, mmap=mmap)
+
+
+if __name__ == "__main__":
+    for json_path in sys.argv[1:]:
+        print(f"{json_path} -> {convert_json(json_path)}")
@@ -0,0 +1,156 @@
+'''
+Time-indexed access to a gaze recording.
+
+GazeSession answers the two questions the analysis keeps asking of a
+recording, "which samples fall between these two event times" and "what is
+the first valid sample at or after this event", with binary searches over the
+sorted timestamps instead of scanning every packet:
+
+    session = GazeSession.open("eye_tracker_data/[12]-2023-11-30_14-02-11.json")
+    page = session.window(page_start_ms, page_end_ms)
+    points = page["left_gaze_point_on_display_area"]
+
+Event times are epoch milliseconds as stored in the Events table; they are
+mapped onto the tracker's system_time_stamp clock exactly as
+utils.extract_gaze_data_between_timestamps_proper does.
+'''
+
+import math
+
+import numpy as np
+
+import gazefile
+from gazefile import GazeFile
+
+TIMESTAMP_IDENT = "system_time_stamp"
+
+
+class GazeWindow:
+    '''
+    The samples of a session between two indices. Columns are slices of the
+    session's arrays, so no sample data is copied.
+    '''
+
+    def __init__(self, session, start, stop):
+        self.session = session
+        self.start = start
+        self.stop = stop
+
+    def __getitem__(self, name):
+        return self.session[name][self.start:self.stop]
+
+    def __len__(self):
+        return self.stop - self.start
+
+    @property
+    def timestamps(self):
+        return self.session.timestamps[self.start:self.stop]
+
+    def valid(self, *properties):
+        '''Return a boolean mask of the samples where every property is valid'''
+        return self.session.valid_mask(*properties)[self.start:self.stop]
+
+
+class GazeSession:
+    '''
+    A gaze recording with its clock mapping worked out once.
+
+    Built from a GazeFile or from the dict json.load gives for the old JSON
+    recordings. If the samples were not recorded in timestamp order they are
+    sorted once on first access, and column lookups return the sorted copy.
+    '''
+
+    def __init__(self, source):
+        if isinstance(source, GazeFile):
+            self.header = dict(source.header)
+            self.source = source
+        else:
+            self.header = {k: v for k, v in source.items() if k != "data"}
+            self.source = gazefile.packets_to_columns(source["data"])
+        self._columns = {}
+        self._valid = {}
+
+        ts = np.asarray(self.source[TIMESTAMP_IDENT])
+        if len(ts) and np.any(ts[1:] < ts[:-1]):
+            self.order = np.argsort(ts, kind="stable")
+        else:
+            self.order = None
+        self.timestamps = self[TIMESTAMP_IDENT]
+
+        # clock mapping, as in utils.extract_gaze_data_between_timestamps_proper
+        if len(ts):
+            self.T_s_0 = ts[0].item()  # microseconds, first sample as recorded
+            system_start_time_mono = self.header["system_start_time_mono"] / 1_000
+            delta = self.T_s_0 - system_start_time_mono
+            self.T_E_0 = self.header["system_start_time_epoch"] * 1_000_000 + delta
+
+    @classmethod
+    def open(cls, path):
+        return cls(gazefile.open_session(path))
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            values = self.source[name]
+            if self.order is not None:
+                values = np.asarray(values)[self.order]
+            self._columns[name] = values
+        return self._columns[name]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def to_system_time(self, timestamp):
+        '''Map an epoch timestamp in milliseconds to system_time_stamp microseconds'''
+        return self.T_s_0 + (timestamp * 1_000 - self.T_E_0)
+
+    def window_bounds(self, start_time, end_time):
+        '''Return the index range of the samples between two epoch timestamps (ms), inclusive'''
+        if len(self) == 0:
+            return 0, 0
+        lower = math.ceil(self.to_system_time(start_time))
+        upper = math.floor(self.to_system_time(end_time))
+        start = int(np.searchsorted(self.timestamps, lower, side="left"))
+        stop = int(np.searchsorted(self.timestamps, upper, side="right"))
+        return start, max(start, stop)
+
+    def window(self, start_time, end_time):
+        '''Return the samples between two epoch timestamps (ms), inclusive'''
+        return GazeWindow(self, *self.window_bounds(start_time, end_time))
+
+    def valid_mask(self, *properties):
+        return self._valid_index(properties)[0]
+
+    def _valid_index(self, properties):
+        # one mask and one sorted array of valid sample indices per set of
+        # validity columns, built on first use
+        key = tuple(sorted(properties))
+        if key not in self._valid:
+            mask = np.ones(len(self), dtype=bool)
+            for prop in key:
+                mask &= np.asarray(self[prop]) == 1
+            self._valid[key] = (mask, np.flatnonzero(mask))
+        return self._valid[key]
+
+    def first_valid(self, timestamp, properties_to_check_validity=()):
+        '''
+        Return the index of the first sample at or after an epoch timestamp
+        (ms) where every listed validity column is 1, or None.
+        '''
+        if len(self) == 0:
+            return None
+        lower = math.ceil(self.to_system_time(timestamp))
+        start = np.searchsorted(self.timestamps, lower, side="left")
+        valid = self._valid_index(properties_to_check_validity)[1]
+        k = np.searchsorted(valid, start, side="left")
+        if k == len(valid):
+            return None
+        return int(valid[k])
+
+    def packet(self, i):
+        '''Return sample i as a packet dict, like the JSON recordings held them'''
+        names = self.source.columns if isinstance(self.source, GazeFile) else list(self.source)
+        packet = {}
+        for name in names:
+            value = self[name][i]
+            packet[name] = tuple(value.tolist()) if np.ndim(value) else value.item()
+        return packet
@@ -0,0 +1,52 @@
+# Screen and viewing geometry of the reading station, and the fixation and
+# saccade definitions built on it, shared by the analysis (utils, kinematics,
+# velocityThreshold, reading) and the live detection in the backend, which
+# runs without pandas
+
+import numpy as np
+
+X_PIXELS = 2560
+Y_PIXELS = 1440
+SCREEN_HEIGHT = 0.336  # meters
+DISTANCE_FROM_SCREEN = 0.6  # meters
+
+# 0.168 is half the height of the screen in meters
+# 0.6 is the distance from the screen in meters
+# we assume square pixels, and that the participant doesn't move
+# don't account for the geometric distortion on the edges
+# https://osdoc.cogsci.nl/4.0/visualangle/
+DEGREES_PER_PIXEL = np.rad2deg(np.arctan2(.5 * SCREEN_HEIGHT, DISTANCE_FROM_SCREEN)) / (.5 * Y_PIXELS)
+
+# Saccade directions, classified by saccade_codes for reading.py and
+# livedetection.py. Angles are in degrees, measured clockwise on the
+# screen (y down) from a move to the right: forward up to FORWARD_BAND either
+# side of the reading direction, regressions in REGRESSION_BAND and return
+# sweeps (back and down to the next line) in RETURN_SWEEP_BAND, whose lower
+# bound is exclusive
+SACCADE_TYPES = ("forward", "regression", "return_sweep", "other")
+FORWARD_BAND = 20
+REGRESSION_BAND = (45, 182)
+RETURN_SWEEP_BAND = (182, 200)
+FORWARD, REGRESSION, RETURN_SWEEP, OTHER = range(len(SACCADE_TYPES))
+
+# The columns of the fixation and saccade tables of velocityThreshold's
+# detectors, and of the events of livedetection's
+FIXATION_COLUMNS = ("ts", "len", "i", "n", "x", "y", "sx", "sy", "rho")
+SACCADE_COLUMNS = ("ts", "len", "i", "n", "dxy", "dts")
+
+
+def saccade_codes(dx, dy):
+    '''
+    Return the SACCADE_TYPES index (int8) of every move of dx, dy (screen
+    coordinates, y down). NaN moves are "other".
+    '''
+    angle = np.rad2deg(np.arctan2(dy, dx))
+    angle = np.where(angle < 0, angle + 360, angle)
+    angle = 360 - angle
+    codes = np.full(np.shape(angle), OTHER, dtype=np.int8)
+    # assigned from the last band to the first, so that the first band an
+    # angle falls in wins, as in the chain of ifs they replace
+    codes[(angle > RETURN_SWEEP_BAND[0]) & (angle <= RETURN_SWEEP_BAND[1])] = RETURN_SWEEP
+    codes[(angle >= REGRESSION_BAND[0]) & (angle <= REGRESSION_BAND[1])] = REGRESSION
+    codes[((angle >= 0) & (angle <= FORWARD_BAND)) | ((angle >= 360 - FORWARD_BAND) & (angle <= 360))] = FORWARD
+    return codes
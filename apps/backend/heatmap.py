@@ -0,0 +1,278 @@
+'''
+Gaze heatmaps and scanpaths drawn over the screenshots, with NumPy and Pillow
+instead of a matplotlib scatter per page.
+
+The gaze points of a window are binned into a 2D histogram of BIN x BIN
+screen pixel cells (np.bincount), blurred with a Gaussian of SIGMA_DEGREES
+of visual angle one axis at a time, coloured, scaled up to the screenshot
+and alpha blended onto it:
+
+    session = GazeSession.open("eye_tracker_data/[12]-2023-11-30_14-02-11.gaze")
+    window = session.window(page_start, page_end)
+    image = render(window, "screenshots/3f2c....png", out="page.png")
+
+Given fixations (a detect_fix_ivt / detect_fix_idt table), weight="duration"
+takes the heat from the fixation centroids weighted by their duration instead
+of from the raw samples, and scanpath=True draws the fixations and the
+saccades between them. render_participant() does this for every page of a
+participant.
+'''
+
+import math
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw
+
+from geometry import DEGREES_PER_PIXEL, X_PIXELS, Y_PIXELS
+from kinematics import binocular_position, eye_position
+
+# screen pixels per histogram cell
+BIN = 4
+# standard deviation of the blur, about the size of the fovea
+SIGMA_DEGREES = 1.
+# opacity of the hottest cells; cells below THRESHOLD of the maximum are
+# left transparent
+ALPHA = 0.6
+THRESHOLD = 0.05
+# blue - cyan - green - yellow - red, from cold to hot
+COLORMAP_STOPS = (
+    (0., (0, 0, 255)),
+    (.25, (0, 255, 255)),
+    (.5, (0, 255, 0)),
+    (.75, (255, 255, 0)),
+    (1., (255, 0, 0)),
+)
+SCANPATH_COLOR = (255, 0, 255)
+WEIGHTS = ("samples", "duration")
+# PNG compression of the exported images: fast rather than small, they are
+# for looking at
+EXPORT_LEVEL = 1
+
+
+def colormap(stops=COLORMAP_STOPS, levels=256):
+    '''Return a (levels, 3) uint8 lookup table interpolated between the stops'''
+    at = np.linspace(0, 1, levels)
+    positions = [s[0] for s in stops]
+    return np.stack([
+        np.interp(at, positions, [s[1][channel] for s in stops])
+        for channel in range(3)
+    ], axis=1).round().astype(np.uint8)
+
+
+COLORMAP = colormap()
+
+
+def gaze_points(window, eye="binocular"):
+    '''Return x and y of the valid samples of a window, as display fractions (0-1)'''
+    if eye == "binocular":
+        x, y, valid = binocular_position(window)
+    else:
+        x, y, valid = eye_position(window, eye)
+    return x[valid] / (X_PIXELS * DEGREES_PER_PIXEL), y[valid] / (Y_PIXELS * DEGREES_PER_PIXEL)
+
+
+def fixation_points(fixations):
+    '''Return x and y (display fractions) and duration of every fixation'''
+    x = fixations.x.to_numpy(dtype=float) / (X_PIXELS * DEGREES_PER_PIXEL)
+    y = fixations.y.to_numpy(dtype=float) / (Y_PIXELS * DEGREES_PER_PIXEL)
+    return x, y, fixations["len"].to_numpy(dtype=float)
+
+
+@lru_cache(maxsize=16)
+def gaussian_matrix(n, sigma):
+    '''
+    Return the (n, n) matrix that blurs a length-n signal with a Gaussian of
+    sigma cells, truncated at 3 sigma. Blurring with a matrix product keeps
+    the whole blur inside BLAS.
+    '''
+    offsets = np.arange(n)
+    distance = offsets[:, None] - offsets[None, :]
+    kernel = np.exp(-0.5 * (distance / sigma) ** 2)
+    kernel[np.abs(distance) > 3 * sigma] = 0
+    kernel /= np.exp(-0.5 * (np.arange(-math.ceil(3 * sigma), math.ceil(3 * sigma) + 1) / sigma) ** 2).sum()
+    return kernel.astype(np.float32)
+
+
+def density(x, y, size, weights=None, sigma=None, bin=BIN):
+    '''
+    Return the blurred gaze density of points given as display fractions,
+    on a grid of bin x bin pixel cells over an image of `size` (width,
+    height), scaled so its maximum is 1. sigma is in screen pixels and
+    defaults to SIGMA_DEGREES.
+    '''
+    width, height = size
+    if sigma is None:
+        # the display is X_PIXELS wide whatever the screenshot's size
+        sigma = SIGMA_DEGREES / DEGREES_PER_PIXEL * width / X_PIXELS
+    columns = math.ceil(width / bin)
+    rows = math.ceil(height / bin)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    ix = np.floor(x * (width / bin))
+    iy = np.floor(y * (height / bin))
+    inside = (ix >= 0) & (ix < columns) & (iy >= 0) & (iy < rows)
+    cells = iy[inside].astype(np.intp) * columns + ix[inside].astype(np.intp)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)[inside]
+    counts = np.bincount(cells, weights, minlength=rows * columns)
+    counts = counts.reshape(rows, columns).astype(np.float32)
+
+    cell_sigma = max(sigma / bin, 1e-3)
+    heat = gaussian_matrix(rows, cell_sigma) @ counts @ gaussian_matrix(columns, cell_sigma)
+    peak = heat.max()
+    if peak > 0:
+        heat /= peak
+    return heat
+
+
+def colorize(heat, alpha=ALPHA, threshold=THRESHOLD, lut=COLORMAP):
+    '''Return an RGBA uint8 image of a density, transparent where it is cold'''
+    levels = np.clip(heat * (len(lut) - 1), 0, len(lut) - 1).astype(np.intp)
+    rgba = np.empty(heat.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = lut[levels]
+    opacity = np.clip((heat - threshold) / (1 - threshold), 0, 1) * (alpha * 255)
+    rgba[..., 3] = opacity.astype(np.uint8)
+    return rgba
+
+
+def composite(screenshot, rgba):
+    '''Blend an RGBA overlay, scaled to the screenshot, onto it'''
+    if screenshot.mode != "RGB":
+        screenshot = screenshot.convert("RGB")
+    overlay = Image.fromarray(rgba, "RGBA").resize(screenshot.size, Image.Resampling.BILINEAR)
+    overlay = np.asarray(overlay)
+    a = overlay[..., 3:].astype(np.uint16)
+    # integer "over" blend in place; 255 * 255 fits in uint16, and
+    # (x + 128 + ((x + 128) >> 8)) >> 8 is x / 255 rounded, without a division
+    blended = np.asarray(screenshot, dtype=np.uint16)
+    blended *= 255 - a
+    blended += overlay[..., :3] * a
+    blended += 128
+    blended += blended >> 8
+    blended >>= 8
+    return Image.fromarray(blended.astype(np.uint8), "RGB")
+
+
+def draw_scanpath(image, fixations, color=SCANPATH_COLOR):
+    '''Draw the fixations (area by duration) and the saccades between them'''
+    x, y, duration = fixation_points(fixations)
+    x = x * image.width
+    y = y * image.height
+    draw = ImageDraw.Draw(image)
+    points = [(float(a), float(b)) for a, b in zip(x, y) if np.isfinite(a) and np.isfinite(b)]
+    if len(points) > 1:
+        draw.line(points, fill=color, width=2)
+    # a 250 ms fixation gets a radius of 15 px on a 2560 px wide screenshot
+    radii = 15 * np.sqrt(np.nan_to_num(duration) / .25) * image.width / X_PIXELS
+    for (a, b), r in zip(points, radii):
+        draw.ellipse((a - r, b - r, a + r, b + r), outline=color, width=2)
+    return image
+
+
+def render(
+    window,
+    screenshot,
+    out=None,
+    eye="binocular",
+    fixations=None,
+    weight="samples",
+    scanpath=False,
+    sigma=None,
+):
+    '''
+    Return the screenshot (a path or an Image) with the heatmap of a gaze
+    window over it, saved as PNG to `out` if given. window may also be an
+    (x, y) pair of display fractions.
+
+    weight is "samples" (every gaze sample counts the same) or "duration"
+    (fixation centroids weighted by duration). "duration" and scanpath=True
+    need the page's fixations.
+    '''
+    if weight not in WEIGHTS:
+        raise ValueError(f"Unknown weight {weight}, expected one of {WEIGHTS}")
+    if (weight == "duration" or scanpath) and fixations is None:
+        raise ValueError("Duration weighting and scanpaths need the fixations")
+    if not isinstance(screenshot, Image.Image):
+        with Image.open(screenshot) as opened:
+            screenshot = opened.convert("RGB")
+    if weight == "duration":
+        x, y, weights = fixation_points(fixations)
+    elif isinstance(window, tuple):
+        (x, y), weights = window, None
+    else:
+        (x, y), weights = gaze_points(window, eye), None
+
+    image = composite(screenshot, colorize(density(x, y, screenshot.size, weights, sigma)))
+    if scanpath:
+        draw_scanpath(image, fixations)
+    if out is not None:
+        image.save(out, format="PNG", compress_level=EXPORT_LEVEL)
+    return image
+
+
+def page_fixations(window, eye, **params):
+    '''detect_fix_ivt on a page, as cohort.analyse_unit runs it'''
+    from velocityThreshold import detect_fix_ivt
+
+    x, y, valid = eye_position(window, eye) if eye != "binocular" else binocular_position(window)
+    df = pd.DataFrame({"x": x[valid], "y": y[valid], "ts": window.timestamps[valid] / 1_000_000})
+    if df.empty:
+        return None
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fixations = detect_fix_ivt(df, **params)[0]
+    return None if fixations.empty else fixations
+
+
+def render_participant(
+    participant_id,
+    out_folder,
+    eye=None,
+    weight="samples",
+    scanpath=False,
+    folder=None,
+    **params,
+):
+    '''
+    Render every page of every book of a participant over the screenshot of
+    its page event, to out_folder/<participant>-<page_event_id>.png.
+
+    eye defaults to the participant's dominant eye. weight is "samples" for
+    the raw gaze or "duration" for I-VT fixations (params go to
+    detect_fix_ivt, e.g. sacvel=80). Returns the paths written.
+    '''
+    from segmentation import EYE_TRACKER_FOLDER, gaze_windows, segment_events
+    from utils import get_participant_dominant_eye
+
+    if weight not in WEIGHTS:
+        raise ValueError(f"Unknown weight {weight}, expected one of {WEIGHTS}")
+    eye = eye or get_participant_dominant_eye(participant_id)
+    os.makedirs(out_folder, exist_ok=True)
+    segments = segment_events([participant_id])
+    segments = segments[segments.screenshot_file.notna()]
+
+    written = []
+    for segment, window in gaze_windows(segments, folder or EYE_TRACKER_FOLDER):
+        if not os.path.exists(segment.screenshot_file):
+            print(f"Screenshot {segment.screenshot_file} is missing, skipping page {segment.page_event_id}")
+            continue
+        fixations = None
+        if weight == "duration" or scanpath:
+            fixations = page_fixations(window, eye, **params)
+            if fixations is None:
+                continue
+        out = os.path.join(out_folder, f"{participant_id}-{segment.page_event_id}.png")
+        render(
+            window,
+            segment.screenshot_file,
+            out=out,
+            eye=eye,
+            fixations=fixations,
+            weight=weight,
+            scanpath=scanpath,
+        )
+        written.append(out)
+    return written
@@ -0,0 +1,168 @@
+'''
+Sample-to-sample gaze kinematics in degrees of visual angle.
+
+Takes the column arrays of a recording (a GazeSession, a GazeWindow of one, a
+GazeFile or a plain dict of arrays) and returns velocity and acceleration in
+deg/s and deg/s^2 for one eye or both:
+
+    session = GazeSession.open("eye_tracker_data/[12]-2023-11-30_14-02-11.gaze")
+    k = kinematics(session, eye="left", smoothing="savgol")
+    k.velocity[k.valid]
+
+Display-area coordinates are converted with X_PIXELS, Y_PIXELS and
+DEGREES_PER_PIXEL from geometry, as velocity.ipynb did. The velocity of a sample
+is measured from the previous one, and is NaN (and the sample invalid) unless
+both samples are valid. Everything is computed with whole-array operations
+into arrays allocated once, so hours of 250 Hz data take about a second.
+'''
+
+import numpy as np
+import pandas as pd
+
+from geometry import DEGREES_PER_PIXEL, X_PIXELS, Y_PIXELS
+
+TIMESTAMP_IDENT = "system_time_stamp"
+EYES = ("left", "right", "binocular")
+SMOOTHING = (None, "savgol", "movavg")
+
+
+def point_column(eye):
+    return f"{eye}_gaze_point_on_display_area"
+
+
+def validity_column(eye):
+    return f"{eye}_gaze_point_validity"
+
+
+def eye_position(columns, eye):
+    '''
+    Return x and y of one eye in degrees of visual angle from the top left of
+    the display, and a boolean mask of the valid samples. Invalid samples are
+    NaN.
+    '''
+    points = np.asarray(columns[point_column(eye)], dtype=float)
+    valid = np.asarray(columns[validity_column(eye)]) == 1
+    x = np.multiply(points[:, 0], X_PIXELS * DEGREES_PER_PIXEL)
+    y = np.multiply(points[:, 1], Y_PIXELS * DEGREES_PER_PIXEL)
+    valid &= np.isfinite(x) & np.isfinite(y)
+    x[~valid] = np.nan
+    y[~valid] = np.nan
+    return x, y, valid
+
+
+def binocular_position(columns):
+    '''
+    Return the mean position of both eyes, or of the one valid eye where only
+    one is, as eye_position does for a single eye.
+    '''
+    lx, ly, lvalid = eye_position(columns, "left")
+    rx, ry, rvalid = eye_position(columns, "right")
+    both = lvalid & rvalid
+    # start from whichever eye is valid, then average where both are
+    x = np.where(lvalid, lx, rx)
+    y = np.where(lvalid, ly, ry)
+    x[both] += rx[both]
+    x[both] /= 2
+    y[both] += ry[both]
+    y[both] /= 2
+    return x, y, lvalid | rvalid
+
+
+def savgol_coefficients(window, polyorder):
+    '''Return the Savitzky-Golay smoothing kernel for an odd window length'''
+    if window % 2 == 0 or window <= polyorder:
+        raise ValueError("window must be odd and longer than polyorder")
+    half = window // 2
+    offsets = np.arange(-half, half + 1, dtype=float)
+    # least squares fit of a polynomial over the window, evaluated at the
+    # centre: the first row of the pseudo-inverse of the Vandermonde matrix
+    return np.linalg.pinv(np.vander(offsets, polyorder + 1, increasing=True))[0]
+
+
+def smooth(values, smoothing, window=5, polyorder=2):
+    '''
+    Return values smoothed with a centered moving average or Savitzky-Golay
+    filter of `window` samples. The first and last window // 2 samples are
+    left as they are; NaNs spread to the samples whose window contains them.
+    '''
+    if smoothing is None or window <= 1 or len(values) < window:
+        return values
+    if smoothing == "movavg":
+        kernel = np.full(window, 1 / window)
+    elif smoothing == "savgol":
+        kernel = savgol_coefficients(window, polyorder)
+    else:
+        raise ValueError(f"Unknown smoothing {smoothing}, expected one of {SMOOTHING}")
+    half = window // 2
+    out = values.copy()
+    out[half:len(values) - half] = np.convolve(values, kernel[::-1], mode="valid")
+    return out
+
+
+def derivative(values, seconds, out):
+    '''Write the backward difference of values per second into out'''
+    out[0] = np.nan
+    np.subtract(values[1:], values[:-1], out=out[1:])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        np.divide(out[1:], seconds, out=out[1:])
+    return out
+
+
+def kinematics(columns, eye="binocular", smoothing=None, window=5, polyorder=2):
+    '''
+    Return a DataFrame of ts (system_time_stamp, microseconds), x and y
+    (degrees), velocity (deg/s), acceleration (deg/s^2) and valid for every
+    sample of a recording.
+
+    eye is "left", "right" or "binocular". smoothing is None, "movavg" or
+    "savgol" and is applied to the positions before they are differentiated.
+    '''
+    if eye == "binocular":
+        x, y, valid = binocular_position(columns)
+    elif eye in EYES:
+        x, y, valid = eye_position(columns, eye)
+    else:
+        raise ValueError(f"Unknown eye {eye}, expected one of {EYES}")
+    x = smooth(x, smoothing, window, polyorder)
+    y = smooth(y, smoothing, window, polyorder)
+
+    ts = np.asarray(columns[TIMESTAMP_IDENT])
+    n = len(ts)
+    velocity = np.empty(n)
+    acceleration = np.empty(n)
+    if n:
+        seconds = np.diff(ts) / 1_000_000
+        # per-axis velocities, then the speed in place of the y one
+        vx = derivative(x, seconds, np.empty(n))
+        derivative(y, seconds, velocity)
+        np.hypot(vx, velocity, out=velocity)
+        del vx
+
+        valid = valid.copy()
+        valid[1:] &= valid[:-1]
+        valid[0] = False
+        valid &= np.isfinite(velocity)
+        velocity[~valid] = np.nan
+        derivative(velocity, seconds, acceleration)
+
+    return pd.DataFrame({
+        "ts": ts,
+        "x": x,
+        "y": y,
+        "velocity": velocity,
+        "acceleration": acceleration,
+        "valid": valid,
+    }, copy=False)
+
+
+def detector_input(k):
+    '''
+    Return the valid samples of kinematics() as the x, y (degrees), ts
+    (seconds) DataFrame the detectors in velocityThreshold take.
+    '''
+    samples = k[k.valid]
+    return pd.DataFrame({
+        "x": samples.x.values,
+        "y": samples.y.values,
+        "ts": samples.ts.values / 1_000_000,
+    })
@@ -0,0 +1,429 @@
+'''
+Fixation and saccade detection while a book is being read.
+
+The offline detectors in velocityThreshold.py run on a whole recording after
+stop_tracking. OnlineIVT and OnlineIDT make the same decisions one sample at
+a time, in constant memory, so that fed the samples of a recording they emit
+the same fixations (and, through SaccadeBuilder, the same saccades as
+find_sacc_from_fix) as the offline detectors:
+
+    detector = OnlineIVT(sacvel=80)
+    for x, y, ts in samples:
+        for fixation in detector.push(x, y, ts):
+            ...
+    remaining = detector.finish()
+
+An I-VT fixation is emitted at the sample that ends it; an I-DT fixation at
+the sample that breaks its dispersion. Either way an event is known one sample
+after it is over.
+
+LiveSession wraps a detector for the tracker callback: it takes Tobii gaze
+packets, keeps the per-book aggregates (fixation count, mean fixation
+duration, regression rate, ...) and the most recent events for the /live/
+endpoints.
+'''
+
+import math
+import threading
+import time
+from collections import deque
+
+# velocityThreshold and reading take these from geometry too; importing
+# them would bring in pandas, which the backend does without
+from geometry import (
+    DEGREES_PER_PIXEL,
+    FIXATION_COLUMNS,
+    SACCADE_COLUMNS,
+    SACCADE_TYPES,
+    X_PIXELS,
+    Y_PIXELS,
+    saccade_codes,
+)
+from participants import metadata
+
+RECENT_EVENTS = 512
+
+
+class FixationStats:
+    '''Running mean and covariance (ddof=1, like np.cov) of a fixation's samples'''
+
+    __slots__ = ("start", "ts0", "ts1", "n", "mx", "my", "cxx", "cyy", "cxy")
+
+    def __init__(self, start, ts):
+        self.start = start
+        self.ts0 = ts
+        self.ts1 = ts
+        self.n = 0
+        self.mx = self.my = 0.
+        self.cxx = self.cyy = self.cxy = 0.
+
+    def add(self, x, y, ts):
+        # Welford's update, which stays accurate for small spreads around
+        # large coordinates
+        self.n += 1
+        dx = x - self.mx
+        dy = y - self.my
+        self.mx += dx / self.n
+        self.my += dy / self.n
+        self.cxx += dx * (x - self.mx)
+        self.cyy += dy * (y - self.my)
+        self.cxy += dx * (y - self.my)
+        self.ts1 = ts
+
+    def describe(self):
+        '''Return the fixation as a dict with the columns of describe_fixations'''
+        if self.n > 1:
+            sx = math.sqrt(self.cxx / (self.n - 1))
+            sy = math.sqrt(self.cyy / (self.n - 1))
+            # numpy's corrcoef gives NaN for a fixation without spread
+            rho = self.cxy / (self.n - 1) / (sx * sy) if sx * sy else math.nan
+        else:
+            sx = sy = rho = 0.
+        return {
+            "ts": self.ts0,
+            "len": self.ts1 - self.ts0,
+            "i": self.start,
+            "n": self.n,
+            "x": self.mx,
+            "y": self.my,
+            "sx": sx,
+            "sy": sy,
+            "rho": rho,
+        }
+
+
+class OnlineIVT:
+    '''
+    detect_fix_ivt one sample at a time. A fixation is a run of samples slower
+    than sacvel together with the sample before the run; a run still going at
+    the end of the recording loses its last sample, as it does offline.
+    '''
+
+    def __init__(self, sacvel=20.):
+        self.sacvel = sacvel
+        self.i = -1
+        self.prev = None
+        self.fixation = None
+
+    def push(self, x, y, ts):
+        '''Add a sample (degrees, seconds) and return the fixations it ends'''
+        self.i += 1
+        prev = self.prev
+        self.prev = (x, y, ts)
+        if prev is None:
+            # detect_fix_ivt gives the first sample a velocity of 10000
+            return ()
+
+        distance = math.hypot(x - prev[0], y - prev[1])
+        dt = ts - prev[2]
+        if dt:
+            v = distance / dt
+        else:
+            v = math.inf if distance > 0 else math.nan
+        slow = v < self.sacvel
+
+        fixation = self.fixation
+        if fixation is None:
+            if slow:
+                fixation = self.fixation = FixationStats(self.i - 1, prev[2])
+                fixation.add(*prev)
+            return ()
+
+        # the previous sample was slow, so it belongs to the fixation unless
+        # the recording ends with it
+        fixation.add(*prev)
+        if slow:
+            return ()
+        self.fixation = None
+        return (fixation.describe(),)
+
+    def finish(self):
+        '''Return the fixation still running at the end of the recording'''
+        fixation, self.fixation = self.fixation, None
+        return () if fixation is None else (fixation.describe(),)
+
+
+class OnlineDispersion:
+    '''
+    SlidingDispersion for samples that arrive one at a time: the monotonic
+    deques hold (index, value) pairs, so nothing older than the window is kept.
+    '''
+
+    def __init__(self):
+        self.last_nan = -1
+        self.minx = deque()
+        self.maxx = deque()
+        self.miny = deque()
+        self.maxy = deque()
+
+    def push(self, j, x, y):
+        if x != x or y != y:
+            self.last_nan = j
+            return
+        minx, maxx, miny, maxy = self.minx, self.maxx, self.miny, self.maxy
+        while minx and minx[-1][1] >= x:
+            minx.pop()
+        minx.append((j, x))
+        while maxx and maxx[-1][1] <= x:
+            maxx.pop()
+        maxx.append((j, x))
+        while miny and miny[-1][1] >= y:
+            miny.pop()
+        miny.append((j, y))
+        while maxy and maxy[-1][1] <= y:
+            maxy.pop()
+        maxy.append((j, y))
+
+    def dispersion(self, start):
+        if self.last_nan >= start:
+            return math.nan
+        for q in (self.minx, self.maxx, self.miny, self.maxy):
+            while q and q[0][0] < start:
+                q.popleft()
+        if not self.minx:
+            return math.nan
+        return (self.maxx[0][1] - self.minx[0][1]) + (self.maxy[0][1] - self.miny[0][1])
+
+
+class OnlineIDT:
+    '''
+    detect_fix_idt one sample at a time. Outside a fixation the last
+    minwindow+1 samples are buffered; once they are within dispval they start
+    a fixation that grows until a sample breaks the dispersion.
+    '''
+
+    def __init__(self, dispval=1, minwindow=6):
+        self.dispval = dispval
+        self.minwindow = minwindow
+        self.i = -1
+        self.start = 0
+        self.window = OnlineDispersion()
+        self.buffer = deque()
+        self.fixation = None
+        self.pending = None
+
+    def push(self, x, y, ts):
+        '''Add a sample (degrees, seconds) and return the fixations it ends'''
+        self.i += 1
+        self.window.push(self.i, x, y)
+
+        fixation = self.fixation
+        if fixation is not None:
+            # the previous sample is part of the fixation whatever this one is
+            fixation.add(*self.pending)
+            if self.window.dispersion(self.start) <= self.dispval:
+                self.pending = (x, y, ts)
+                return ()
+            # this sample breaks the fixation and starts the next search
+            self.fixation = None
+            self.pending = None
+            self.start = self.i
+            self.window = OnlineDispersion()
+            self.window.push(self.i, x, y)
+            self.buffer.append((x, y, ts))
+            return (fixation.describe(),)
+
+        self.buffer.append((x, y, ts))
+        if len(self.buffer) <= self.minwindow:
+            return ()
+        if self.window.dispersion(self.start) <= self.dispval:
+            fixation = self.fixation = FixationStats(self.start, self.buffer[0][2])
+            for _ in range(self.minwindow):
+                fixation.add(*self.buffer.popleft())
+            self.pending = self.buffer.popleft()
+        else:
+            self.buffer.popleft()
+            self.start += 1
+        return ()
+
+    def finish(self):
+        '''Return the fixations in the samples not yet decided on'''
+        if self.fixation is not None:
+            fixation, self.fixation = self.fixation, None
+            fixation.add(*self.pending)
+            return (fixation.describe(),)
+
+        # fewer than minwindow+1 samples left: the offline loop, on them alone
+        samples = list(self.buffer)
+        self.buffer.clear()
+        fixations = []
+        i = 0
+        n = len(samples)
+        while i < n:
+            window = OnlineDispersion()
+            for j in range(i, n):
+                window.push(j, samples[j][0], samples[j][1])
+            # windows at the end of a recording are cut short, and then
+            # cover every remaining sample
+            if window.dispersion(i) <= self.dispval:
+                fixation = FixationStats(self.start + i, samples[i][2])
+                for sample in samples[i:]:
+                    fixation.add(*sample)
+                fixations.append(fixation.describe())
+                break
+            i += 1
+        return tuple(fixations)
+
+
+def saccade_type(dx, dy):
+    '''Classify a movement on the screen (y down) with geometry.saccade_codes, as reading.py does'''
+    return SACCADE_TYPES[int(saccade_codes(dx, dy))]
+
+
+class SaccadeBuilder:
+    '''
+    find_sacc_from_fix over a stream of fixations: each fixation after the
+    first gives the saccade from the previous one, if they are not adjacent.
+    '''
+
+    def __init__(self):
+        self.prev = None
+        self.end = None
+
+    def push(self, fixation):
+        '''Add the next fixation and return the saccade that led to it, if any'''
+        saccade = None
+        if self.prev is None:
+            # as in find_sacc_from_fix, the first saccade is measured from
+            # the start of the first fixation
+            end = (fixation["i"], fixation["ts"])
+        else:
+            pi, pts = self.end
+            a = max(0, pi - 1)
+            b = fixation["i"]
+            if a != b:
+                dx = fixation["x"] - self.prev[0]
+                dy = fixation["y"] - self.prev[1]
+                dts = fixation["ts"] - pts
+                saccade = {
+                    "ts": pts,
+                    "len": dts,
+                    "i": a,
+                    "n": b - a,
+                    "dxy": math.hypot(dx, dy),
+                    "dts": dts * 1000,
+                    "type": saccade_type(dx, dy),
+                }
+            end = (fixation["i"] + fixation["n"], fixation["ts"] + fixation["len"])
+        self.prev = (fixation["x"], fixation["y"])
+        self.end = end
+        return saccade
+
+
+def dominant_eye(participant_id):
+    '''The participant's dominant eye from participants.json, right if unknown'''
+    try:
+        participant = metadata.participant(participant_id)
+    except (OSError, ValueError):
+        participant = None
+    eye = participant.dominant_eye if participant is not None else None
+    return (eye or "right").lower()
+
+
+class LiveSession:
+    '''
+    Online detection for one book, fed from the tracker callback. push() takes
+    a gaze packet as Tobii delivers it; snapshot() and events() are read from
+    the API while the book is open and after it is closed.
+    '''
+
+    def __init__(self, participant_id, book_start, eye="right", detector="ivt", recent=RECENT_EVENTS, **params):
+        self.participant_id = participant_id
+        self.book_start = book_start
+        self.eye = eye
+        self.detector_name = detector
+        self.detector = OnlineIVT(**params) if detector == "ivt" else OnlineIDT(**params)
+        self.saccades = SaccadeBuilder()
+        self.point = f"{eye}_gaze_point_on_display_area"
+        self.validity = f"{eye}_gaze_point_validity"
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=recent)
+        self.seq = 0
+        self.active = True
+
+        self.samples = 0
+        self.valid_samples = 0
+        self.fixation_count = 0
+        self.fixation_time = 0.
+        self.saccade_counts = dict.fromkeys(SACCADE_TYPES, 0)
+        self.last_event_time = None
+        self.callback_time = 0.
+
+    def push(self, packet):
+        start = time.perf_counter()
+        self.samples += 1
+        if packet[self.validity] == 1:
+            point = packet[self.point]
+            self.valid_samples += 1
+            fixations = self.detector.push(
+                point[0] * X_PIXELS * DEGREES_PER_PIXEL,
+                point[1] * Y_PIXELS * DEGREES_PER_PIXEL,
+                packet["system_time_stamp"] / 1_000_000,
+            )
+            if fixations:
+                self.record(fixations)
+        self.callback_time += time.perf_counter() - start
+
+    def finish(self):
+        with self.lock:
+            self.active = False
+        self.record(self.detector.finish())
+
+    def record(self, fixations):
+        with self.lock:
+            for fixation in fixations:
+                self.fixation_count += 1
+                self.fixation_time += fixation["len"]
+                self.seq += 1
+                self.recent.append((self.seq, "fixation", fixation))
+                saccade = self.saccades.push(fixation)
+                if saccade is not None:
+                    self.saccade_counts[saccade["type"]] += 1
+                    self.seq += 1
+                    self.recent.append((self.seq, "saccade", saccade))
+            self.last_event_time = time.time()
+
+    def snapshot(self):
+        '''The running aggregates for the book'''
+        with self.lock:
+            saccades = sum(self.saccade_counts.values())
+            return {
+                "participant_id": self.participant_id,
+                "book_start": self.book_start,
+                "active": self.active,
+                "detector": self.detector_name,
+                "eye": self.eye,
+                "samples": self.samples,
+                "valid_samples": self.valid_samples,
+                "fixation_count": self.fixation_count,
+                "mean_fixation_duration_ms": (
+                    self.fixation_time / self.fixation_count * 1000 if self.fixation_count else None
+                ),
+                "saccade_count": saccades,
+                "saccade_types": dict(self.saccade_counts),
+                "regression_rate": (
+                    self.saccade_counts["regression"] / saccades if saccades else None
+                ),
+                "mean_callback_us": (
+                    self.callback_time / self.samples * 1e6 if self.samples else None
+                ),
+                "last_seq": self.seq,
+            }
+
+    def events(self, after=0):
+        '''
+        The recent fixations and saccades with a sequence number above after,
+        with NaN (e.g. the rho of a fixation on a line) given as None
+        '''
+        with self.lock:
+            return [
+                {"seq": seq, "type": kind, **{k: json_value(v) for k, v in event.items()}}
+                for seq, kind, event in self.recent
+                if seq > after
+            ]
+
+
+def json_value(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
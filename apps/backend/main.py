@@ -1,21 +1,59 @@
-import time
-from typing import List
-from fastapi import APIRouter, FastAPI, HTTPException
-from database import close_database, initialize_database, insert_event_data
-from models import EventData, Events, EventResponse
-from screenshot import capture_screenshot
+import asyncio
+import json
+import os
+from typing import List, Optional
+from fastapi import APIRouter, FastAPI, HTTPException, Query
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from capture import CapturePipeline, QueueFullError
+from database import close_database, initialize_database, parse_cursor, screenshot_timeline, select_events, stream_events
+from models import CaptureStatus, EventData, Events, EventResponse
 from fastapi.middleware.cors import CORSMiddleware
-import pyautogui
-import subprocess
+import backends
 import tobiilsl.tobii_tracking as tobii
+import metrics
+import profiler
+from screenshot import ScreenshotStore
+from stations import DEFAULT_STATION, Stations
+from thumbnails import ThumbnailStore
 
-PROCESS = None
+# Where gaze data and screenshots come from, see backends.py: "tobii", "none"
+# or "replay:<gaze session>", and "mss", "blank" or "replay:<folder>"
+EYE_TRACKER = os.environ.get("EYE_TRACKER", "tobii")
+SCREEN_GRABBER = os.environ.get("SCREEN_GRABBER", "mss")
+# The tracker of each reading station by serial number, as
+# "station=serial,station=serial"; see stations.py
+STATION_TRACKERS = dict(
+    pair.split("=", 1) for pair in os.environ.get("STATION_TRACKERS", "").split(",") if pair
+)
+EVENTS_PAGE_SIZE = 1000
+EVENTS_MAX_PAGE_SIZE = 10000
+# How often /live/stream looks for new fixations and saccades
+LIVE_POLL_INTERVAL = 0.25
+# Screenshot and thumbnail file names are unique, so browsers may keep them
+SCREENSHOT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Whether a request may ask for a sampling profile with ?profile=<seconds>:
+# set PROFILING=1 to allow it
+PROFILING = os.environ.get("PROFILING", "0") == "1"
+# Whether the server keeps /metrics: set METRICS=0 to turn the counters off
+METRICS = os.environ.get("METRICS", "1") == "1"
 
 
 class API:
-    tobii: None
-
-    def __init__(self):
+    def __init__(
+        self,
+        pipeline=None,
+        thumbnails=None,
+        tracker=EYE_TRACKER,
+        screen=SCREEN_GRABBER,
+        stations=STATION_TRACKERS,
+    ):
+        # finds the trackers at startup; None records events and screenshots only
+        backend = backends.tracker_backend(tracker)
+        self.stations = Stations(backend, stations) if backend is not None else None
+        self.pipeline = pipeline if pipeline is not None else CapturePipeline(
+            screenshots=ScreenshotStore(grab=backends.screen_grabber(screen)),
+        )
+        self.thumbnails = thumbnails if thumbnails is not None else ThumbnailStore()
         self.router = APIRouter()
         self.router.add_api_route(
             "/capture-screenshot/",
@@ -24,53 +62,233 @@ class API:
             response_model=EventResponse,
             description="Receive log, capture screenshot, and store in database."
         )
+        self.router.add_api_route(
+            "/capture-screenshot/{capture_id}",
+            self.get_capture_status,
+            methods=["GET"],
+            response_model=CaptureStatus,
+            description="Report whether the screenshot and database entry for an event are done."
+        )
         self.router.add_event_handler("startup", self.startup_event)
         self.router.add_event_handler("shutdown", self.shutdown_event)
-        self.router.add_api_route("/events/", self.get_all_events, methods=["GET"])
+        self.router.add_api_route(
+            "/events/",
+            self.get_all_events,
+            methods=["GET"],
+            description="List events ordered by (time, id), a page at a time, or stream them all as NDJSON."
+        )
+        self.router.add_api_route(
+            "/live/",
+            self.get_live_stats,
+            methods=["GET"],
+            description="Running fixation and saccade statistics for the book being read at a station, by a participant, or opened last."
+        )
+        self.router.add_api_route(
+            "/live/events",
+            self.get_live_events,
+            methods=["GET"],
+            description="Fixations and saccades detected since sequence number `after`."
+        )
+        self.router.add_api_route(
+            "/live/stream",
+            self.stream_live_events,
+            methods=["GET"],
+            description="Server-sent events with every fixation, saccade and updated statistics."
+        )
+        self.router.add_api_route(
+            "/participants/{participant_id}/screenshots",
+            self.get_screenshot_timeline,
+            methods=["GET"],
+            description="Every event of a participant that has a screenshot, with the URL of its thumbnail."
+        )
+        self.router.add_api_route(
+            "/screenshots/{event_id}",
+            self.get_screenshot,
+            methods=["GET"],
+            description="The screenshot of an event, as the smallest thumbnail at least `width` pixels wide if given."
+        )
+        self.router.add_api_route(
+            "/tracker",
+            self.get_tracker_health,
+            methods=["GET"],
+            description="Whether each station's eye tracker is found and licensed, and which participant it is recording."
+        )
+        self.router.add_api_route(
+            "/metrics",
+            self.get_metrics,
+            methods=["GET"],
+            description="Stage timings, queue depths, gaze rate and bytes written, in the Prometheus text format."
+        )
 
     async def take_screenshot(self, event_data: EventData):
         try:
             print(event_data)
-            if event_data.event == "SELECT_TREATMENT":
-                self.tobii = tobii.Tobii(event_data.participantId)
-            elif event_data.event == "OPEN_BOOK":
-                self.tobii.start_tracking(event_data.timestamp)
-            elif event_data.event == "CLOSE_BOOK":
-                self.tobii.stop_tracking(event_data.timestamp)
-            
-            # You can access the event data from the request's JSON body
-            time.sleep(0.5)
-            screenshot_filename = capture_screenshot()
-
-            # Add the screenshot filename to the event data
-            event_data.Screenshot_file = screenshot_filename
-
-            # Call the insert_event_data function
-            event = insert_event_data(event_data)
-
-
-            return EventResponse(
-                id=event.id,  # Replace with the actual ID
-                timestamp=event_data.timestamp,
-                agent=event_data.agent,
-                event=event_data.event,
-                participant_id=event_data.participantId,
-                old_value=""
-                if event_data.oldValue is None
-                else str(event_data.oldValue),
-                new_value=""
-                if event_data.newValue is None
-                else str(event_data.newValue),
-                screenshot_file=screenshot_filename,  # Make sure this field is included
-            )
+            # The screenshot and the database insert happen in the background,
+            # the reader only needs to know that the event was accepted. It is
+            # stored whatever the eye tracker does
+            job = await self.pipeline.submit(event_data)
+        except QueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=400, detail="Validation failed: " + str(e))
 
-    async def get_all_events(self):
-        events = Events.select()
-        return events
+        tracker_error = None
+        # without an eye tracker the events and screenshots are still stored
+        if self.stations is not None:
+            try:
+                await self.stations.handle(event_data)
+            except Exception as e:
+                print(f"Station {event_data.station or DEFAULT_STATION} could not handle {event_data.event}: {e}")
+                tracker_error = str(e)
+
+        return EventResponse(
+            id=None,
+            capture_id=job.id,
+            status=job.status,
+            timestamp=event_data.timestamp,
+            agent=event_data.agent,
+            event=event_data.event,
+            participant_id=event_data.participantId,
+            old_value=""
+            if event_data.oldValue is None
+            else str(event_data.oldValue),
+            new_value=""
+            if event_data.newValue is None
+            else str(event_data.newValue),
+            screenshot_file=None,
+            tracker_error=tracker_error,
+        )
+
+    async def get_capture_status(self, capture_id: str):
+        job = self.pipeline.status(capture_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown capture id: " + capture_id)
+        return job.describe()
+
+    def get_all_events(
+        self,
+        participant_id: Optional[List[int]] = Query(None),
+        event: Optional[List[str]] = Query(None),
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+        fields: Optional[str] = Query(None, description="Comma separated columns to return"),
+        cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+        limit: Optional[int] = Query(None, ge=1, le=EVENTS_MAX_PAGE_SIZE),
+        format: str = Query("json", pattern="^(json|ndjson)$"),
+    ):
+        # plain def, so FastAPI runs the queries on its thread pool instead of
+        # the event loop
+        try:
+            projection = fields.split(",") if fields else None
+            query = select_events(
+                participant_ids=participant_id,
+                events=event,
+                start_time=start_time,
+                end_time=end_time,
+                after=parse_cursor(cursor) if cursor else None,
+                fields=projection,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        def project(row):
+            if projection is None:
+                return row
+            return {f: row[f] for f in projection}
+
+        if format == "ndjson":
+            # the whole result (or `limit` rows) straight from a database
+            # cursor, so memory use doesn't depend on the size of the table
+            if limit is not None:
+                query = query.limit(limit)
+            chunks = (
+                "".join(json.dumps(project(row)) + "\n" for row in batch)
+                for batch in stream_events(query)
+            )
+            return StreamingResponse(chunks, media_type="application/x-ndjson")
+
+        limit = limit or EVENTS_PAGE_SIZE
+        rows = list(query.limit(limit).dicts())
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = f"{rows[-1]['time']}:{rows[-1]['id']}"
+        return {"events": [project(row) for row in rows], "next_cursor": next_cursor}
+
+    def get_screenshot_timeline(
+        self,
+        participant_id: int,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+        width: int = Query(160, ge=1),
+    ):
+        rows = screenshot_timeline(participant_id, start_time, end_time)
+        for row in rows:
+            row["thumbnail"] = f"/screenshots/{row['id']}?width={width}"
+        return rows
+
+    def get_screenshot(self, event_id: int, width: Optional[int] = Query(None, ge=1)):
+        # plain def: building a missing thumbnail decodes the full screenshot
+        event = Events.get_or_none(Events.id == event_id)
+        if event is None or not event.screenshot_file:
+            raise HTTPException(status_code=404, detail=f"No screenshot for event {event_id}")
+        try:
+            if width is None:
+                path = event.screenshot_file
+                if not os.path.exists(path):
+                    raise FileNotFoundError(path)
+            else:
+                path = self.thumbnails.get(event.screenshot_file, width)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail=f"Screenshot file of event {event_id} is missing")
+        return FileResponse(path, headers={"Cache-Control": SCREENSHOT_CACHE_CONTROL})
+
+    async def get_tracker_health(self):
+        return {"stations": self.stations.health() if self.stations is not None else {}}
+
+    async def get_metrics(self):
+        if not metrics.ENABLED:
+            raise HTTPException(status_code=404, detail="Metrics are disabled")
+        return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+    def live_session(self, station=None, participant_id=None):
+        live = self.stations.live(station, participant_id) if self.stations is not None else None
+        if live is None:
+            raise HTTPException(status_code=404, detail="No book has been opened yet")
+        return live
+
+    async def get_live_stats(self, station: Optional[str] = None, participant_id: Optional[int] = None):
+        return self.live_session(station, participant_id).snapshot()
+
+    async def get_live_events(
+        self, after: int = 0, station: Optional[str] = None, participant_id: Optional[int] = None,
+    ):
+        live = self.live_session(station, participant_id)
+        return {"events": live.events(after), "last_seq": live.snapshot()["last_seq"]}
+
+    async def stream_live_events(
+        self, after: int = 0, station: Optional[str] = None, participant_id: Optional[int] = None,
+    ):
+        live = self.live_session(station, participant_id)
+
+        async def stream():
+            seq = after
+            while True:
+                events = live.events(seq)
+                stats = live.snapshot()
+                for event in events:
+                    seq = event["seq"]
+                    yield f"id: {seq}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                if events or not stats["active"]:
+                    yield f"event: stats\ndata: {json.dumps(stats)}\n\n"
+                if not stats["active"] and seq >= stats["last_seq"]:
+                    # the book was closed and everything has been sent
+                    return
+                await asyncio.sleep(LIVE_POLL_INTERVAL)
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
 
     async def startup_event(self):
+        metrics.enable(METRICS)
         initialize_database()
         
         import os
@@ -79,11 +297,42 @@ class API:
         if not os.path.exists("screenshots"):
             os.makedirs("screenshots")
 
+        self.pipeline.start()
+        if self.stations is not None:
+            self.stations.start()
+
     async def shutdown_event(self):
+        if self.stations is not None:
+            await self.stations.stop()
+        await self.pipeline.drain()
         close_database()
 
 
+async def profile_request(request, call_next):
+    '''Profile every thread while a request made with ?profile=<seconds> runs, see profiler.py'''
+    seconds = request.query_params.get("profile")
+    if seconds is None or not PROFILING:
+        return await call_next(request)
+    try:
+        seconds = float(seconds or 0)
+    except ValueError:
+        return JSONResponse({"detail": "profile must be a number of seconds"}, status_code=400)
+    sampler = profiler.start()
+    if sampler is None:
+        return JSONResponse({"detail": "Another request is being profiled"}, status_code=409)
+    path = profiler.profile_path(f"{request.method} {request.url.path}")
+    try:
+        response = await call_next(request)
+    finally:
+        # keeps sampling in the background until `seconds` have passed, so
+        # the capture of an event shows up after its request has returned
+        sampler.finish(seconds, path)
+    response.headers["X-Profile"] = path
+    return response
+
+
 app = FastAPI()
+app.middleware("http")(profile_request)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # You can specify origins here or restrict to specific domains
@@ -0,0 +1,330 @@
+'''
+Merging the events.db of other stations into this one.
+
+An event of the other station is the same as a stored one when it has the
+same natural key (participant_id, time, event, agent) and the same old and
+new values, so merge() upserts on those: an event that is already stored is
+left alone (it only gains a screenshot it was missing), and merging the same
+database again adds nothing. Different events sharing a key are all kept.
+The other station's ids are not copied; merged events get ids of this
+database.
+
+    result = merge("station-2/events.db")
+    print(result["inserted"], result["rows_per_second"])
+
+Screenshot paths are rewritten into one shared store (screenshots/ by
+default) as <store>/<file name>; the files have uuid names, so they do not
+collide between stations. With copy_screenshots, the files of the merged rows
+are copied there from the other station's folder once the merge has
+committed, so a merge that fails copies nothing.
+
+The whole merge is one transaction. The target remembers, per source, the
+highest id it has merged, so a nightly merge of a growing database only reads
+the rows added since the last one.
+
+    python merge.py station-2/events.db station-3/events.db --into events.db
+
+Databases merged with the old utils.merge_databases hold a copy of every
+event for each time it was run. remove_duplicates() deletes those copies,
+only when asked, after backing the database up and exporting the rows it
+drops; it refuses if events sharing a natural key differ in their values or
+screenshot, since those are not copies:
+
+    python merge.py --remove-duplicates --into events.db --dry-run
+'''
+
+import argparse
+import csv
+import os
+import shutil
+import sqlite3
+import time
+
+from peewee import SqliteDatabase
+
+import database
+import models
+from screenshot import FOLDER as SCREENSHOT_FOLDER
+
+# page cache of the merging connection; the natural key index is probed for
+# every row, so the more of it stays in memory the better
+CACHE_KIB = 256 * 1024
+COLUMNS = ("time", "agent", "event", "participant_id", "old_value", "new_value", "screenshot_file")
+MERGED_SOURCES_TABLE = "merged_sources"
+# rows of a refused duplicate removal that are printed
+LISTED_ROWS = 20
+
+
+def store_path(path, store=SCREENSHOT_FOLDER):
+    '''Return where a screenshot of another station lives in the shared store'''
+    if path is None:
+        return None
+    return os.path.join(store, os.path.basename(path.replace("\\", "/")))
+
+
+def migrate(path):
+    '''
+    Bring a database up to the current schema, natural key index included.
+    It is opened on a connection of its own; models.db keeps pointing at the
+    server's database.
+    '''
+    target = SqliteDatabase(path, pragmas=models.PRAGMAS)
+    with target.bind_ctx([models.Events]):
+        database.initialize_database(target)
+    target.close()
+
+
+def connect(target):
+    conn = sqlite3.connect(target, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=wal")
+    conn.execute("PRAGMA synchronous=normal")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_KIB}")
+    conn.execute("PRAGMA temp_store=memory")
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {MERGED_SOURCES_TABLE}"
+        " (source TEXT PRIMARY KEY, last_id INTEGER NOT NULL)"
+    )
+    return conn
+
+
+def same_event(a, b):
+    '''SQL condition for rows a and b being the same event: natural key and values'''
+    return " AND ".join(
+        [f"{a}.{c} = {b}.{c}" for c in models.NATURAL_KEY]
+        + [f"{a}.{c} IS {b}.{c}" for c in ("old_value", "new_value")]
+    )
+
+
+def copy_screenshot_files(conn, source_folder, store, after_id, last_id):
+    '''Copy the screenshots of the source rows after after_id, up to last_id, into the store'''
+    copied = missing = 0
+    rows = conn.execute(
+        "SELECT DISTINCT screenshot_file FROM source.events"
+        " WHERE id > ? AND id <= ? AND screenshot_file IS NOT NULL",
+        (after_id, last_id),
+    )
+    os.makedirs(store, exist_ok=True)
+    for (path,) in rows:
+        destination = store_path(path, store)
+        if os.path.exists(destination):
+            continue
+        if not os.path.isabs(path):
+            path = os.path.join(source_folder, path)
+        if not os.path.exists(path):
+            missing += 1
+            continue
+        tmp = destination + ".tmp"
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, destination)
+        copied += 1
+    return copied, missing
+
+
+def merge(
+    source,
+    target="events.db",
+    store=SCREENSHOT_FOLDER,
+    copy_screenshots=False,
+    source_folder=None,
+    full=False,
+):
+    '''
+    Upsert the events of the database at `source` into the one at `target`,
+    in one transaction, and return counts and timings:
+    {"scanned", "inserted", "updated", "screenshots_copied",
+    "screenshots_missing", "seconds", "rows_per_second"}.
+
+    Screenshot paths are rewritten into `store`. With copy_screenshots the
+    files are copied there after the commit, resolving relative paths against
+    source_folder (by default the folder of the source database); if copying
+    fails, full=True copies them again. full=True reads every row of the
+    source instead of those added since its last merge.
+    '''
+    source = os.path.abspath(source)
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+    if os.path.abspath(target) == source:
+        raise ValueError("Cannot merge a database into itself")
+    start = time.perf_counter()
+    migrate(target)
+
+    conn = connect(target)
+    conn.create_function("store_path", 1, lambda path: store_path(path, store), deterministic=True)
+    conn.execute("ATTACH DATABASE ? AS source", (source,))
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"SELECT last_id FROM {MERGED_SOURCES_TABLE} WHERE source = ?", (source,)
+            ).fetchone()
+            last_id = 0 if full or row is None else row[0]
+            source_max = conn.execute("SELECT coalesce(max(id), 0) FROM source.events").fetchone()[0]
+            if source_max < last_id:
+                # the other station started a new database: read all of it
+                print(f"{source} has fewer rows than when it was last merged, merging all of it")
+                last_id = 0
+            scanned = conn.execute(
+                "SELECT count(*) FROM source.events WHERE id > ?", (last_id,)
+            ).fetchone()[0]
+
+            target_max = conn.execute("SELECT coalesce(max(id), 0) FROM main.events").fetchone()[0]
+            updated = conn.execute(
+                "UPDATE main.events AS e SET screenshot_file = store_path(s.screenshot_file)"
+                " FROM source.events AS s"
+                f" WHERE s.id > ? AND {same_event('e', 's')}"
+                " AND e.screenshot_file IS NULL AND s.screenshot_file IS NOT NULL",
+                (last_id,),
+            ).rowcount
+            columns = ", ".join(COLUMNS)
+            selected = ", ".join(f"s.{c}" for c in COLUMNS[:-1]) + ", store_path(s.screenshot_file)"
+            conn.execute(
+                f"INSERT INTO main.events ({columns})"
+                f" SELECT {selected} FROM source.events AS s WHERE s.id > ?"
+                f" AND NOT EXISTS (SELECT 1 FROM main.events AS e WHERE {same_event('e', 's')})"
+                " ORDER BY s.id",
+                (last_id,),
+            )
+            inserted = conn.execute(
+                "SELECT count(*) FROM main.events WHERE id > ?", (target_max,)
+            ).fetchone()[0]
+            conn.execute(
+                f"INSERT INTO {MERGED_SOURCES_TABLE} (source, last_id) VALUES (?, ?)"
+                " ON CONFLICT (source) DO UPDATE SET last_id = excluded.last_id",
+                (source, source_max),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        copied = missing = 0
+        if copy_screenshots:
+            copied, missing = copy_screenshot_files(
+                conn, source_folder or os.path.dirname(source), store, last_id, source_max
+            )
+    finally:
+        conn.execute("DETACH DATABASE source")
+        conn.close()
+
+    seconds = time.perf_counter() - start
+    return {
+        "scanned": scanned,
+        "inserted": inserted,
+        "updated": updated,
+        "screenshots_copied": copied,
+        "screenshots_missing": missing,
+        "seconds": seconds,
+        "rows_per_second": scanned / seconds if seconds else 0.,
+    }
+
+
+def remove_duplicates(path="events.db", dry_run=False, skip_different=False):
+    '''
+    Delete every copy but the first (lowest id) of the events that share a
+    natural key and have the same values and screenshot. The database is
+    backed up to <path>.<time>.bak first and the rows dropped are written to
+    <path>.<time>.dropped.csv; with dry_run only the CSV is written.
+
+    If events sharing a natural key differ, nothing is deleted and a
+    ValueError lists them, unless skip_different, which leaves those alone.
+    Returns {"dropped", "different", "backup", "export"}.
+    '''
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    stamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+    columns = ("id",) + COLUMNS
+    key = ", ".join(models.NATURAL_KEY)
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                f"CREATE TEMP TABLE duplicate_keys AS SELECT {key}, min(id) AS keep,"
+                " count(DISTINCT json_array(old_value, new_value, screenshot_file)) > 1 AS different"
+                f" FROM events GROUP BY {key} HAVING count(*) > 1"
+            )
+            selected = ", ".join(f"e.{c}" for c in columns)
+            joined = f"FROM events AS e JOIN temp.duplicate_keys AS d USING ({key})"
+            different = conn.execute(f"SELECT {selected} {joined} WHERE d.different ORDER BY {key}, e.id").fetchall()
+            if different and not skip_different:
+                listed = "\n".join("  " + " | ".join(map(str, row)) for row in different[:LISTED_ROWS])
+                more = f"\n  ... and {len(different) - LISTED_ROWS} more" if len(different) > LISTED_ROWS else ""
+                raise ValueError(
+                    f"{len(different)} events share a natural key but differ, so they are not copies;"
+                    f" nothing was removed:\n  {' | '.join(columns)}\n{listed}{more}"
+                )
+            dropped = conn.execute(
+                f"SELECT {selected} {joined} WHERE NOT d.different AND e.id != d.keep ORDER BY e.id"
+            ).fetchall()
+
+            export = f"{path}.{stamp}.dropped.csv"
+            with open(export, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                writer.writerows(dropped)
+            backup = None
+            if not dry_run and dropped:
+                backup = f"{path}.{stamp}.bak"
+                # through a second connection: WAL lets it read while this
+                # one holds the write lock, so the backup is what is deleted from
+                reader = sqlite3.connect(path)
+                target = sqlite3.connect(backup)
+                reader.backup(target)
+                target.close()
+                reader.close()
+                conn.execute(
+                    "DELETE FROM events WHERE id IN (SELECT e.id"
+                    f" {joined} WHERE NOT d.different AND e.id != d.keep)"
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return {"dropped": len(dropped), "different": len(different), "backup": backup, "export": export}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("sources", nargs="*", help="events.db of the other stations")
+    parser.add_argument("--into", default="events.db", help="database to merge into")
+    parser.add_argument("--store", default=SCREENSHOT_FOLDER, help="shared screenshot folder")
+    parser.add_argument("--copy-screenshots", action="store_true")
+    parser.add_argument("--full", action="store_true", help="read every row, not just the new ones")
+    parser.add_argument(
+        "--remove-duplicates", action="store_true",
+        help="delete the copies of events in --into that old merges made, after a backup",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="only export the rows that would be removed")
+    parser.add_argument(
+        "--skip-different", action="store_true",
+        help="leave events that share a natural key but differ alone instead of refusing",
+    )
+    args = parser.parse_args()
+
+    if args.remove_duplicates:
+        try:
+            result = remove_duplicates(args.into, args.dry_run, args.skip_different)
+        except ValueError as e:
+            parser.exit(1, f"{e}\n")
+        verb = "Would remove" if args.dry_run else "Removed"
+        print(f"{verb} {result['dropped']} duplicate events, listed in {result['export']}")
+        if result["backup"]:
+            print(f"Backed up {args.into} to {result['backup']}")
+        if result["different"]:
+            print(f"Left {result['different']} events that share a natural key but differ")
+
+    for source in args.sources:
+        result = merge(source, args.into, args.store, args.copy_screenshots, full=args.full)
+        print(
+            f"{source}: {result['inserted']} new, {result['updated']} updated"
+            f" of {result['scanned']} rows read in {result['seconds']:.1f} s"
+            f" ({result['rows_per_second']:.0f} rows/s)"
+        )
+        if result["screenshots_copied"] or result["screenshots_missing"]:
+            print(f"  {result['screenshots_copied']} screenshots copied, {result['screenshots_missing']} missing")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+'''
+Counters, gauges and histograms of the capture server, rendered in the
+Prometheus text format for /metrics.
+
+The metrics are module level objects; the code being measured updates them
+directly:
+
+    CAPTURE_STAGE_SECONDS.labels("grab").observe(seconds)
+    GAZE_SAMPLES.inc()
+
+and render() returns the text a Prometheus server scrapes. Gauges of things
+that already keep a count (queue sizes, bytes written) read it when scraped,
+through set_function(), so the hot paths pay nothing for them.
+
+With enable(False) every update returns right away and /metrics answers 404;
+the cost left on a hot path is one attribute lookup and a call.
+'''
+
+import math
+import threading
+import time
+from bisect import bisect_left
+
+ENABLED = True
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds, from a fast SQLite commit to a slow page turn
+SECONDS_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {escape_help(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for values, child in list(metric.children.items()):
+                labels = dict(zip(metric.labelnames, values))
+                lines.extend(child.samples(metric.name, labels))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def render(registry=REGISTRY):
+    return registry.render()
+
+
+def escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def sample(name, labels, value):
+    if labels:
+        pairs = ",".join(
+            '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for k, v in labels.items()
+        )
+        name = f"{name}{{{pairs}}}"
+    return f"{name} {format_value(value)}"
+
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+class Shards:
+    '''
+    Per-thread lists of numbers that are summed when read. Each thread only
+    ever adds to its own list, so updates need no lock (an uncontended lock
+    would double the cost of an update on the gaze callback).
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.shards = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def mine(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = [0] * self.size
+            with self.lock:
+                self.shards.append(shard)
+            return shard
+
+    def totals(self):
+        with self.lock:
+            shards = list(self.shards)
+        return [sum(values) for values in zip(*shards)] or [0] * self.size
+
+
+class CounterValue:
+    def __init__(self):
+        self.shards = Shards(1)
+
+    def inc(self, amount=1):
+        if not ENABLED:
+            return
+        self.shards.mine()[0] += amount
+
+    def samples(self, name, labels):
+        return [sample(name + "_total", labels, self.shards.totals()[0])]
+
+
+class GaugeValue:
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        if ENABLED:
+            self.value = value
+
+    def set_function(self, function):
+        '''Read the value from function() whenever the metrics are rendered'''
+        self.function = function
+
+    def get(self):
+        if self.function is None:
+            return self.value
+        try:
+            return self.function()
+        except Exception:
+            # e.g. the pipeline went away; a scrape must not fail for it
+            return math.nan
+
+    def samples(self, name, labels):
+        return [sample(name, labels, self.get())]
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # a count per bucket, the last one +Inf, then the sum
+        self.shards = Shards(len(buckets) + 2)
+
+    def observe(self, value):
+        if not ENABLED:
+            return
+        shard = self.shards.mine()
+        # the first bucket whose upper bound is >= value
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def time(self):
+        return Timer(self)
+
+    def samples(self, name, labels):
+        totals = self.shards.totals()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), totals[:-1]):
+            cumulative += count
+            lines.append(sample(name + "_bucket", {**labels, "le": format_value(float(bound))}, cumulative))
+        lines.append(sample(name + "_sum", labels, totals[-1]))
+        lines.append(sample(name + "_count", labels, cumulative))
+        return lines
+
+
+class Timer:
+    '''Context manager observing the seconds spent in its block'''
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.children = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+        # the value of a metric without labels is its only child
+        self.value = None if self.labelnames else self.labels()
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        '''Return the value of one combination of label values'''
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}")
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def new_child(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.value.inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def new_child(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self.value.set(value)
+
+    def set_function(self, function):
+        self.value.set_function(function)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(float(b) for b in sorted(buckets))
+        super().__init__(name, help, labels, registry)
+
+    def new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.value.observe(value)
+
+    def time(self):
+        return self.value.time()
+
+
+# -- the capture server's metrics --------------------------------------------
+
+CAPTURE_STAGES = ("queue", "sleep", "grab", "insert", "encode")
+CAPTURE_STAGE_SECONDS = Histogram(
+    "capture_stage_seconds",
+    "Time an event spends in each stage of /capture-screenshot/: waiting for a"
+    " worker, the render delay, the screen grab, the database insert and the"
+    " screenshot encode",
+    labels=["stage"],
+)
+for stage in CAPTURE_STAGES:
+    CAPTURE_STAGE_SECONDS.labels(stage)
+CAPTURE_SECONDS = Histogram(
+    "capture_seconds",
+    "Time from receiving an event to its database row being committed",
+)
+CAPTURE_EVENTS = Counter(
+    "capture_events", "Events handled by the capture pipeline, by outcome", labels=["status"],
+)
+CAPTURE_QUEUE_DEPTH = Gauge("capture_queue_depth", "Events waiting for a capture worker")
+EVENT_WRITER_QUEUE_DEPTH = Gauge("event_writer_queue_depth", "Events waiting to be inserted")
+EVENT_BATCH_SIZE = Histogram(
+    "event_batch_size",
+    "Events committed together by the EventWriter",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+EVENT_COMMIT_SECONDS = Histogram("event_commit_seconds", "Time to insert and commit one batch of events")
+SCREENSHOT_ENCODE_QUEUE_DEPTH = Gauge(
+    "screenshot_encode_queue_depth", "Screenshots grabbed and not yet written to disk",
+)
+SCREENSHOT_FRAMES = Counter(
+    "screenshot_frames", "Screens grabbed, by whether they were stored or were a duplicate", labels=["result"],
+)
+SCREENSHOT_BYTES = Counter("screenshot_bytes_written", "Bytes of screenshots written")
+
+# the tracker sends a sample every 4 ms at 250 Hz (1.7 ms at 600 Hz); these
+# resolve the jitter around that and catch gaps of a few samples
+GAZE_INTERVAL_BUCKETS = (.001, .0015, .002, .003, .0035, .004, .0045, .005, .006, .008, .012, .02, .05, .1, .5)
+GAZE_SAMPLES = Counter("gaze_samples", "Gaze samples received from the tracker")
+GAZE_SAMPLE_INTERVAL_SECONDS = Histogram(
+    "gaze_sample_interval_seconds",
+    "Time between consecutive gaze samples by the tracker's system clock",
+    buckets=GAZE_INTERVAL_BUCKETS,
+)
+GAZE_CALLBACK_SECONDS = Histogram(
+    "gaze_callback_seconds",
+    "Time spent in the tracker's gaze callback",
+    buckets=(.00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005),
+)
+GAZE_BUFFER_DEPTH = Gauge("gaze_buffer_depth", "Gaze samples waiting to be written to the sessions being recorded")
+GAZE_DROPPED = Gauge("gaze_dropped_samples", "Gaze samples dropped by the sessions being recorded")
+GAZE_SESSION_BYTES = Gauge("gaze_session_bytes_written", "Bytes written to the gaze sessions being recorded")
+GAZE_FINISHED_SESSION_BYTES = Histogram(
+    "gaze_session_bytes",
+    "Bytes written by each finished gaze session",
+    buckets=tuple(2 ** n for n in range(20, 34, 2)),
+)
+TRACKER_READY = Gauge(
+    "eye_tracker_ready", "1 while a station's eye tracker is found and licensed, else 0", labels=["station"],
+)
+TRACKER_DISCOVERIES = Counter(
+    "eye_tracker_discoveries", "Attempts to find and license a station's eye tracker", labels=["station"],
+)
@@ -8,20 +8,50 @@ class EventData(BaseModel):
     participantId: int
     oldValue: Optional[int|str] = None
     newValue: Optional[int|str ]= None
+    Screenshot_file: Optional[str] = None
+    # the reading station the event comes from, see stations.py
+    station: Optional[str] = None
 
 class EventResponse(BaseModel):
-    id: int
+    # The event is stored and its screenshot taken after the response is
+    # sent, so id and screenshot_file are always None here;
+    # /capture-screenshot/{capture_id} has them (as event_id and
+    # screenshot_file) once its status is "done"
+    id: Optional[int] = None
+    capture_id: str
+    status: str
     timestamp: int
     agent: str
     event: str
     participant_id: int
     old_value: Optional[int|str]
     new_value: Optional[int|str]
-    screenshot_file: str
+    screenshot_file: Optional[str] = None
+    # why the event's station could not start or stop its gaze recording;
+    # the event itself is stored all the same
+    tracker_error: Optional[str] = None
+
+class CaptureStatus(BaseModel):
+    capture_id: str
+    status: str
+    event_id: Optional[int]
+    screenshot_file: Optional[str] = None
+    error: Optional[str]
 
 
 from peewee import IntegerField, Model, CharField, SqliteDatabase, AutoField
-db = SqliteDatabase('events.db')
+
+# WAL lets the analysis read while the backend writes, and with it
+# synchronous=NORMAL only syncs at checkpoints instead of on every commit
+PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -64 * 1024,  # KiB
+    'temp_store': 'memory',
+}
+db = SqliteDatabase('events.db', pragmas=PRAGMAS)
+# the columns that identify an event whichever station recorded it
+NATURAL_KEY = ('participant_id', 'time', 'event', 'agent')
 
 class Events(Model):
     id = AutoField()
@@ -35,3 +65,14 @@ class Events(Model):
 
     class Meta:
         database = db
+        # every analysis query filters on participant, then event and/or time;
+        # the time index (which carries the rowid) serves /events/ pages,
+        # which are ordered by (time, id). merge.py finds the events another
+        # station's database shares with this one by their natural key; that
+        # index also serves the participant and time queries. It is not
+        # unique: two different events may share a key
+        indexes = (
+            (('participant_id', 'event', 'time'), False),
+            (NATURAL_KEY, False),
+            (('time',), False),
+        )
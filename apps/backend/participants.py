@@ -0,0 +1,121 @@
+'''
+participants.json and treatments.json, loaded once and reloaded when they
+change, for the analysis (utils) and for the live detection in the backend:
+
+    metadata.participant(12).dominant_eye
+    metadata.treatment("Treatment 1,2").options
+'''
+
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+PARTICIPANTS_FILE = "participants.json"
+TREATMENTS_FILE = "treatments.json"
+
+
+@dataclass(frozen=True)
+class Participant:
+    id: str
+    split: Optional[int] = None
+    group: Optional[int] = None
+    comprehension_score: Optional[int] = None
+    age: Optional[int] = None
+    dominant_eye: Optional[str] = None
+    visual_impairment: Tuple[str, ...] = ()
+    low_resolution: bool = False
+    # the entry as it is in participants.json
+    raw: dict = field(default_factory=dict, repr=False, compare=False)
+
+    @property
+    def treatment(self):
+        if self.split is None or self.group is None:
+            return None
+        return f"Treatment {self.split},{self.group}"
+
+    @classmethod
+    def from_json(cls, participant_id, entry):
+        return cls(
+            id=str(participant_id),
+            split=entry.get("split"),
+            group=entry.get("group"),
+            comprehension_score=entry.get("comprehension_score"),
+            age=entry.get("age"),
+            dominant_eye=entry.get("dominant_eye"),
+            visual_impairment=tuple(entry.get("visual_impairment") or ()),
+            low_resolution=bool(entry.get("low_resolution") or False),
+            raw=entry,
+        )
+
+
+@dataclass(frozen=True)
+class Treatment:
+    name: str
+    options: dict
+    # the entry as it is in treatments.json
+    raw: dict = field(default_factory=dict, repr=False, compare=False)
+
+
+class MetadataRegistry:
+    '''
+    participants.json and treatments.json, each loaded once and indexed by
+    participant id and exact treatment name. A file is reloaded when its
+    modification time or size changes, so edits show up without restarting
+    the notebook kernel.
+    '''
+
+    def __init__(self, participants_file=PARTICIPANTS_FILE, treatments_file=TREATMENTS_FILE):
+        self.participants_file = participants_file
+        self.treatments_file = treatments_file
+        self._cache = {}
+
+    def _load(self, path, build):
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with open(path, "r") as f:
+            value = build(json.load(f))
+        self._cache[path] = (stamp, value)
+        return value
+
+    def _participants(self):
+        return self._load(self.participants_file, lambda raw: (
+            raw,
+            {str(k): Participant.from_json(k, v) for k, v in raw.items()},
+        ))
+
+    def _treatments(self):
+        return self._load(self.treatments_file, lambda raw: (
+            raw,
+            {t["name"]: Treatment(t["name"], t.get("options", {}), t) for t in raw},
+        ))
+
+    def participants(self):
+        return self._participants()[1]
+
+    def participant(self, participant_id):
+        return self._participants()[1].get(str(participant_id))
+
+    def participants_json(self):
+        return self._participants()[0]
+
+    def treatments(self):
+        return self._treatments()[1]
+
+    def treatment(self, name):
+        treatments = self._treatments()[1]
+        treatment = treatments.get(name)
+        if treatment is None:
+            # callers used to get the first treatment whose name contains
+            # theirs, e.g. "1,2" for "Treatment 1,2"
+            treatment = next((t for n, t in treatments.items() if name in n), None)
+        return treatment
+
+    def invalidate(self):
+        self._cache.clear()
+
+
+metadata = MetadataRegistry()
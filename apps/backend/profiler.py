@@ -0,0 +1,142 @@
+'''
+A sampling profiler for the capture server, switched on per request.
+
+While it runs, a thread looks at the stack of every other thread every
+INTERVAL seconds (sys._current_frames) and counts each distinct stack. The
+result is written in the collapsed format flame graph tools read
+(flamegraph.pl, speedscope, inferno), one line per stack:
+
+    event-writer;run (database.py:120);create (peewee.py:6590) 42
+
+Every thread is sampled, not only the one serving the request, because the
+work of an event happens on the capture pipeline's workers and threads after
+the request has returned. A request made with ?profile=<seconds> is profiled
+for its own duration and for at least that many seconds, once the server is
+started with PROFILING=1, see main.py:
+
+    PROFILING=1 uvicorn main:app
+    curl -X POST 'localhost:8000/capture-screenshot/?profile=2' -d @event.json
+
+Only one request is profiled at a time: a second sampler would double the
+overhead and sample the first.
+
+The sampler needs the GIL to take a sample, so a thread holding it for long
+(a C call that does not release it) delays samples rather than showing up.
+'''
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# seconds between samples
+INTERVAL = 0.005
+FOLDER = "profiles"
+# longest a single profile may run, whatever the request asks for
+MAX_SECONDS = 60
+# held while a request's profile is sampling, see start()
+RUNNING = threading.Lock()
+
+
+class SamplingProfiler:
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.deadline = None
+        self.path = None
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+        # called once sampling has stopped
+        self.on_stop = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self.deadline = self.started + MAX_SECONDS
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.thread.start()
+        return self
+
+    def finish(self, at_least=0., path=None):
+        '''
+        Stop sampling once at_least seconds have passed since start() (right
+        away by default) and write the profile to path if given. Returns
+        without waiting; join() waits for the profile.
+        '''
+        with self.lock:
+            self.path = path
+            self.deadline = self.started + min(max(at_least, 0.), MAX_SECONDS)
+            stopped = not self.running
+        if stopped and path is not None:
+            # ran into MAX_SECONDS before the request was over
+            self.write(path)
+
+    def join(self):
+        self.thread.join()
+
+    def run(self):
+        me = threading.get_ident()
+        try:
+            while time.monotonic() < self.deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        self.stacks[(names.get(ident, str(ident)),) + stack(frame)] += 1
+                self.samples += 1
+                time.sleep(self.interval)
+        finally:
+            if self.on_stop is not None:
+                self.on_stop()
+        with self.lock:
+            self.running = False
+            path = self.path
+        if path is not None:
+            self.write(path)
+
+    def collapsed(self):
+        '''Return the stacks in the collapsed format, most frequent first'''
+        return "".join(
+            ";".join(frames) + f" {count}\n"
+            for frames, count in self.stacks.most_common()
+        )
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.collapsed())
+        os.replace(tmp, path)
+
+
+def start(interval=INTERVAL):
+    '''Start a profile for a request, or return None if one is already running'''
+    if not RUNNING.acquire(blocking=False):
+        return None
+    sampler = SamplingProfiler(interval)
+    sampler.on_stop = RUNNING.release
+    try:
+        return sampler.start()
+    except BaseException:
+        RUNNING.release()
+        raise
+
+
+def stack(frame):
+    '''Return the frames of a stack, outermost first'''
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
+
+
+def profile_path(name, folder=FOLDER):
+    '''A new file name for the profile of a request, e.g. "POST capture-screenshot"'''
+    safe = "_".join("".join(c if c.isalnum() or c == "-" else " " for c in name).split())
+    return os.path.join(folder, f"{time.strftime('%Y-%m-%d_%H-%M-%S')}-{time.time_ns() % 1_000_000_000}-{safe}.txt")
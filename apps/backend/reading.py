@@ -0,0 +1,136 @@
+'''
+Saccade directions and reading metrics for whole fixation tables.
+
+saccade_codes() (in geometry.py) classifies every movement between fixations
+at once with the angle bands utils.identify_saccade_type_with_color uses for
+one pair of points: forward, regression, return sweep or other. page_metrics() takes the
+fixations of any number of pages (e.g. cohort.analyse_cohort(...).fixations)
+and reduces them per page, and book_metrics() per book:
+
+    result = analyse_cohort(book_units(segments), sacvel=80)
+    pages = page_metrics(result.fixations)
+    books = book_metrics(pages)
+
+As in the notebooks, the saccades are the moves between successive fixations
+of a page. The number of lines read is estimated from the page's vertical
+extent of fixations and the median drop of its return sweeps (one line
+spacing). A page read once, line by line, has one return sweep fewer than
+lines; return_sweeps_per_line goes up when lines are reread and down when
+they are skipped.
+'''
+
+import numpy as np
+import pandas as pd
+
+# saccade_codes lives in geometry.py, so the live detection can classify
+# saccades without pandas
+from geometry import FORWARD, RETURN_SWEEP, SACCADE_TYPES, saccade_codes
+PAGE_KEYS = ["participant_id", "book", "page_event_id"]
+BOOK_KEYS = ["participant_id", "book"]
+
+
+def classify_saccades(start_x, start_y, end_x, end_y):
+    '''Return the type of every saccade between two arrays of points as a Categorical'''
+    dx = np.subtract(end_x, start_x, dtype=float)
+    dy = np.subtract(end_y, start_y, dtype=float)
+    return pd.Categorical.from_codes(saccade_codes(dx, dy), categories=SACCADE_TYPES)
+
+
+def fixation_transitions(fixations, keys=PAGE_KEYS):
+    '''
+    Return the move from every fixation to the next one of the same page:
+    the page keys, ts (of the first fixation), dx, dy, amplitude (degrees)
+    and type.
+    '''
+    fixations = fixations.sort_values(keys + ["ts"], kind="stable")
+    x = fixations.x.to_numpy(dtype=float)
+    y = fixations.y.to_numpy(dtype=float)
+    same_page = np.ones(max(len(fixations) - 1, 0), dtype=bool)
+    for key in keys:
+        values = fixations[key].to_numpy()
+        same_page &= values[1:] == values[:-1]
+
+    dx = (x[1:] - x[:-1])[same_page]
+    dy = (y[1:] - y[:-1])[same_page]
+    moves = fixations.iloc[:-1][keys + ["ts"]][same_page].reset_index(drop=True)
+    moves["dx"] = dx
+    moves["dy"] = dy
+    moves["amplitude"] = np.hypot(dx, dy)
+    moves["type"] = pd.Categorical.from_codes(saccade_codes(dx, dy), categories=SACCADE_TYPES)
+    return moves
+
+
+PAGE_METRIC_COLUMNS = [
+    "fixations",
+    "saccades",
+    *SACCADE_TYPES,
+    "regression_rate",
+    "lines",
+    "return_sweeps_per_line",
+    "mean_forward_amplitude",
+    "forward_amplitude_sum",
+]
+
+
+def page_metrics(fixations, keys=PAGE_KEYS):
+    '''
+    Return one row per page of a fixation table: fixation and saccade counts,
+    the count of each saccade type, regression_rate (regressions per
+    saccade), lines (estimated lines read), return_sweeps_per_line,
+    mean_forward_amplitude (degrees) and the forward_amplitude_sum it comes
+    from.
+    '''
+    if fixations.empty:
+        return pd.DataFrame(columns=keys + PAGE_METRIC_COLUMNS)
+    moves = fixation_transitions(fixations, keys)
+    code = moves["type"].cat.codes.to_numpy()
+    for i, name in enumerate(SACCADE_TYPES):
+        moves[name] = code == i
+    moves["forward_amplitude"] = np.where(code == FORWARD, moves.amplitude, np.nan)
+    moves["sweep_drop"] = np.where(code == RETURN_SWEEP, moves.dy, np.nan)
+
+    by_page = moves.groupby(keys, sort=False, observed=True)
+    counts = by_page[list(SACCADE_TYPES)].sum()
+    counts["saccades"] = by_page.size()
+    counts["forward_amplitude_sum"] = by_page.forward_amplitude.sum()
+    counts["line_spacing"] = by_page.sweep_drop.median()
+
+    by_page = fixations.groupby(keys, sort=False, observed=True)
+    pages = by_page.size().to_frame("fixations")
+    y_extent = by_page.y.max() - by_page.y.min()
+    # pages with a single fixation have no moves
+    pages = pages.join(counts, how="left")
+    totals = ["saccades", *SACCADE_TYPES]
+    pages[totals] = pages[totals].fillna(0).astype(int)
+    pages["forward_amplitude_sum"] = pages.forward_amplitude_sum.fillna(0.)
+
+    spacing = pages.line_spacing.where(pages.line_spacing > 0)
+    pages["lines"] = np.round(y_extent / spacing) + 1
+    pages["return_sweeps_per_line"] = pages.return_sweep / pages.lines
+    rates(pages)
+    return pages[PAGE_METRIC_COLUMNS].reset_index()
+
+
+def rates(totals):
+    '''Add the rates that are ratios of summed counts'''
+    totals["regression_rate"] = totals.regression / totals.saccades.where(totals.saccades > 0)
+    totals["mean_forward_amplitude"] = totals.forward_amplitude_sum / totals.forward.where(totals.forward > 0)
+
+
+def book_metrics(pages, keys=BOOK_KEYS):
+    '''
+    Return one row per book from the rows of page_metrics(). Counts and lines
+    are summed over the pages and the rates recomputed from the sums, so
+    every saccade weighs the same whatever its page. Pages without an
+    estimate of their lines are left out of return_sweeps_per_line.
+    '''
+    by_book = pages.groupby(keys, sort=False, observed=True)
+    books = by_book.size().to_frame("pages")
+    summed = ["fixations", "saccades", *SACCADE_TYPES, "forward_amplitude_sum"]
+    books[summed] = by_book[summed].sum()
+
+    by_book = pages[pages.lines.notna()].groupby(keys, sort=False, observed=True)
+    books["lines"] = by_book.lines.sum()
+    books["return_sweeps_per_line"] = by_book.return_sweep.sum() / books.lines
+    rates(books)
+    return books[["pages"] + PAGE_METRIC_COLUMNS].reset_index()
@@ -1,15 +1,288 @@
-from mss import mss
+'''
+Screenshots of the reader, grabbed on the capture threads and encoded in the
+background.
+
+ScreenshotStore.capture() only copies the screen's raw pixels (mss.grab) and
+decides the file name; compressing the frame to PNG, WebP or JPEG happens on
+the store's encoder threads. The returned path can be stored with the event
+right away, and close() waits until every file has been written. take()
+returns the encode's Future as well, for a caller that needs to know the file
+was written (the capture pipeline):
+
+    store = ScreenshotStore(format="webp", level=80)
+    store.start()
+    path = store.capture(participant_id)
+    ...
+    store.close()
+
+Consecutive pages of a book mostly look the same, so every frame gets a
+fingerprint: the mean of each colour channel over each BLOCK x BLOCK pixel
+block. A frame whose fingerprint is within DUPLICATE_TOLERANCE of the
+participant's last written screenshot is not encoded at all and capture()
+returns that screenshot's file, so several events can point at one file. A
+duplicate of a screenshot still being encoded gets that encode's Future from
+take(), so it fails with it if the file can't be written.
+
+With thumbnails=True (the default) the encoder threads also write the
+frame's thumbnail pyramid (thumbnails.py) for the review endpoints.
+'''
+
+import os
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-def capture_screenshot():
-    # Store the screenshot in a folder named screenshots
-    # Generate a unique identifier for the screenshot filename
-    # The unique identifier can be referenced in the database
-    folder = "screenshots"
-    screenshotID = uuid.uuid4()
-    screenshot_filename = f"{folder}/{screenshotID}.png"
+import numpy as np
+from PIL import Image
+
+import metrics
+from thumbnails import ThumbnailStore
+
+FOLDER = "screenshots"
+# which mss monitor to grab; 1 is the primary screen, as mss.shot used
+MONITOR = 1
+# file format and its compression setting: the zlib level (0-9) for png and
+# the quality (0-100) for webp and jpeg
+FORMAT = "png"
+LEVEL = 6
+FORMATS = {
+    "png": lambda level: {"format": "PNG", "compress_level": level},
+    "webp": lambda level: {"format": "WEBP", "quality": level, "method": 0},
+    "webp-lossless": lambda level: {"format": "WEBP", "lossless": True, "quality": level, "method": 0},
+    "jpeg": lambda level: {"format": "JPEG", "quality": level},
+}
+EXTENSIONS = {"png": "png", "webp": "webp", "webp-lossless": "webp", "jpeg": "jpg"}
+# Number of threads compressing frames; encoding dominates, so grabbing
+# never waits for it
+ENCODE_THREADS = 2
+# Side of the square pixel blocks averaged into a frame's fingerprint
+BLOCK = 16
+# Largest difference in any block's mean brightness (0-255) for two frames
+# to count as the same picture
+DUPLICATE_TOLERANCE = 1.
+
+
+class Frame:
+    '''The raw BGRA pixels of one grab'''
+
+    __slots__ = ("size", "bgra")
+
+    def __init__(self, size, bgra):
+        self.size = size
+        self.bgra = bgra
+
+    def image(self):
+        return Image.frombuffer("RGB", self.size, self.bgra, "raw", "BGRX", 0, 1)
+
+
+def fingerprint(frame, block=BLOCK):
+    '''Return the mean blue, green and red level of every block x block tile of a frame'''
+    width, height = frame.size
+    pixels = np.frombuffer(frame.bgra, dtype=np.uint8).reshape(height, width, 4)
+    rows = height // block * block
+    columns = width // block * block
+    # every channel, so a change of colour alone (a highlight, the theme's
+    # tint) is not taken for the same picture
+    bgr = pixels[:rows, :columns, :3].reshape(rows // block, block, columns // block, block, 3)
+    return bgr.sum(axis=(1, 3), dtype=np.uint32) / (block * block)
+
+
+def same_picture(a, b, tolerance=DUPLICATE_TOLERANCE):
+    return a is not None and a.shape == b.shape and np.abs(a - b).max() <= tolerance
 
-    with mss() as sct:
-        sct.shot(output=screenshot_filename)
 
-    return screenshot_filename
+class ScreenGrabber:
+    '''
+    mss.grab with one mss instance per thread, which is how mss must be used.
+    mss is imported on the first grab: it needs a display, and a server
+    without one may still start (see backends.py).
+    '''
+
+    def __init__(self, monitor=MONITOR):
+        self.monitor = monitor
+        self.local = threading.local()
+
+    def __call__(self):
+        sct = getattr(self.local, "sct", None)
+        if sct is None:
+            from mss import mss
+
+            sct = self.local.sct = mss()
+        shot = sct.grab(sct.monitors[self.monitor])
+        # raw is the grabbed buffer itself; shot.bgra would copy it
+        return Frame(tuple(shot.size), shot.raw)
+
+
+class ScreenshotStore:
+    def __init__(
+        self,
+        folder=FOLDER,
+        format=FORMAT,
+        level=LEVEL,
+        grab=None,
+        encode_threads=ENCODE_THREADS,
+        tolerance=DUPLICATE_TOLERANCE,
+        thumbnails=True,
+    ):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown screenshot format {format}, expected one of {tuple(FORMATS)}")
+        self.folder = folder
+        self.format = format
+        self.level = level
+        self.options = FORMATS[format](level)
+        self.grab = grab if grab is not None else ScreenGrabber()
+        self.encode_threads = encode_threads
+        self.tolerance = tolerance
+        self.thumbnails = ThumbnailStore(os.path.join(folder, "thumbnails")) if thumbnails else None
+        self.executor = None
+        self.lock = threading.Lock()
+        # participant id -> (fingerprint, file, frame number) of their last
+        # screenshot written to disk
+        self.previous = {}
+        # participant id -> (fingerprint, file, Future) of their screenshot
+        # being encoded
+        self.encoding = {}
+        self.pending = set()
+        self.frames = 0
+        self.duplicates = 0
+        self.bytes_written = 0
+        self.grab_seconds = 0.
+        self.encode_seconds = 0.
+
+    def start(self):
+        os.makedirs(self.folder, exist_ok=True)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.encode_threads, thread_name_prefix="screenshot-encode"
+            )
+        metrics.SCREENSHOT_ENCODE_QUEUE_DEPTH.set_function(lambda: len(self.pending))
+
+    def capture(self, participant_id=None):
+        '''
+        Grab the screen and return the path its screenshot is (or will be)
+        written to. Called from the capture threads, never the event loop.
+        '''
+        return self.take(participant_id)[0]
+
+    def take(self, participant_id=None):
+        '''
+        Grab the screen and return the path of its screenshot and the Future
+        of the encode writing it, which raises if the file could not be
+        written. A duplicate of a screenshot already on disk has no Future;
+        one of a screenshot still being encoded shares its Future.
+        '''
+        start = time.perf_counter()
+        frame = self.grab()
+        current = fingerprint(frame)
+        with self.lock:
+            self.frames += 1
+            number = self.frames
+            self.grab_seconds += time.perf_counter() - start
+            last, last_file, _ = self.previous.get(participant_id, (None, None, None))
+            if same_picture(last, current, self.tolerance):
+                self.duplicates += 1
+                metrics.SCREENSHOT_FRAMES.labels("duplicate").inc()
+                return last_file, None
+            waiting, waiting_file, encoding = self.encoding.get(participant_id, (None, None, None))
+            if same_picture(waiting, current, self.tolerance):
+                self.duplicates += 1
+                metrics.SCREENSHOT_FRAMES.labels("duplicate").inc()
+                return waiting_file, encoding
+            metrics.SCREENSHOT_FRAMES.labels("stored").inc()
+            filename = os.path.join(self.folder, f"{uuid.uuid4()}.{EXTENSIONS[self.format]}")
+            if self.executor is None:
+                self.start()
+            future = self.executor.submit(self.encode, frame, filename)
+            self.pending.add(future)
+            self.encoding[participant_id] = (current, filename, future)
+        future.add_done_callback(self.encoded)
+        # it becomes the participant's last screenshot once it is on disk
+        future.add_done_callback(lambda f: self.written(f, participant_id, (current, filename, number)))
+        return filename, future
+
+    def written(self, future, participant_id, previous):
+        with self.lock:
+            if self.encoding.get(participant_id, (None, None, None))[2] is future:
+                del self.encoding[participant_id]
+            if future.cancelled() or future.exception() is not None:
+                return
+            last = self.previous.get(participant_id)
+            # encodes can finish out of order; keep the latest frame
+            if last is None or last[2] < previous[2]:
+                self.previous[participant_id] = previous
+
+    def encode(self, frame, filename):
+        start = time.perf_counter()
+        tmp = filename + ".tmp"
+        try:
+            image = frame.image()
+            with open(tmp, "wb") as f:
+                image.save(f, **self.options)
+            os.replace(tmp, filename)
+            if self.thumbnails is not None:
+                self.thumbnails.build(filename, image)
+        except Exception as e:
+            print(f"Could not write screenshot {filename}: {e}")
+            raise
+        size = os.path.getsize(filename)
+        seconds = time.perf_counter() - start
+        with self.lock:
+            self.bytes_written += size
+            self.encode_seconds += seconds
+        metrics.SCREENSHOT_BYTES.inc(size)
+        metrics.CAPTURE_STAGE_SECONDS.labels("encode").observe(seconds)
+
+    def encoded(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def flush(self):
+        '''
+        Wait until every captured frame is on disk. Raises the first error if
+        any of them could not be written.
+        '''
+        with self.lock:
+            pending = list(self.pending)
+        errors = []
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise RuntimeError(
+                f"{len(errors)} screenshots could not be written, the first: {errors[0]}"
+            ) from errors[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "format": self.format,
+                "level": self.level,
+                "frames": self.frames,
+                "duplicates": self.duplicates,
+                "files": self.frames - self.duplicates,
+                "pending": len(self.pending),
+                "bytes_written": self.bytes_written,
+                "mean_grab_ms": 1000 * self.grab_seconds / self.frames if self.frames else None,
+                "encode_seconds": self.encode_seconds,
+            }
+
+
+def capture_screenshot():
+    '''Grab and write one screenshot synchronously, without deduplication'''
+    store = ScreenshotStore()
+    store.start()
+    try:
+        return store.capture()
+    finally:
+        store.close()
@@ -0,0 +1,130 @@
+'''
+Splits the Events table into books and pages for the whole cohort at once.
+
+Every analysis notebook used to rebuild this per participant with a query per
+book and per page. segment_events() does it in one ordered scan of the table
+and returns one row per page:
+
+    participant_id, book, book_start, book_end, gaze_file,
+    page_event_id, page_event, page_start, page_end, screenshot_file
+
+A book runs from OPEN_BOOK to the following CLOSE_BOOK (or to the next
+OPEN_BOOK / the participant's last event if it was never closed). Its pages
+start at the OPEN_BOOK and at every *_PAGE event, and each runs until the next
+page event or the end of the book. gaze_file is the recording
+Tobii.start_tracking made for the book.
+
+gaze_windows() then walks the pages with each gaze file opened only once.
+'''
+
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from gazesession import GazeSession
+from gazefile import SUFFIX
+from utils import Events
+
+EYE_TRACKER_FOLDER = "eye_tracker_data"
+
+SEGMENT_COLUMNS = (
+    "participant_id",
+    "book",
+    "book_start",
+    "book_end",
+    "gaze_file",
+    "page_event_id",
+    "page_event",
+    "page_start",
+    "page_end",
+    "screenshot_file",
+)
+
+
+def gaze_file_name(participant_id, open_book_time):
+    '''Return the name Tobii.start_tracking gives the recording of a book'''
+    date = datetime.fromtimestamp(open_book_time / 1000).strftime("%Y-%m-%d_%H-%M-%S")
+    return f"[{participant_id}]-{date}{SUFFIX}"
+
+
+def is_page_event(event):
+    return event == "OPEN_BOOK" or "_PAGE" in event
+
+
+def segment_events(participant_ids=None):
+    '''
+    Return a DataFrame with one row per page of every book read by the given
+    participants (everyone if None).
+    '''
+    query = Events.select(
+        Events.id,
+        Events.time,
+        Events.event,
+        Events.participant_id,
+        Events.new_value,
+        Events.screenshot_file,
+    )
+    if participant_ids is not None:
+        query = query.where(Events.participant_id.in_(list(participant_ids)))
+    query = query.order_by(Events.participant_id, Events.time, Events.id)
+
+    rows = []
+    book = None
+    pages = []
+    last = None
+
+    def close_book(end):
+        # page boundaries are only known once the book is over
+        for page, next_page in zip(pages, pages[1:] + [None]):
+            rows.append((
+                book[0],
+                book[1],
+                book[2],
+                end,
+                book[3],
+                page[0],
+                page[1],
+                page[2],
+                end if next_page is None else next_page[2],
+                page[3],
+            ))
+
+    for _id, time, event, participant_id, new_value, screenshot_file in query.tuples().iterator():
+        if book is not None and participant_id != book[0]:
+            close_book(last)
+            book = None
+
+        if event == "OPEN_BOOK":
+            if book is not None:
+                close_book(time)
+            book = (participant_id, new_value, time, gaze_file_name(participant_id, time))
+            pages = []
+        elif event == "CLOSE_BOOK" and book is not None:
+            close_book(time)
+            book = None
+
+        if book is not None and is_page_event(event):
+            pages.append((_id, event, time, screenshot_file))
+        last = time
+
+    if book is not None:
+        close_book(last)
+
+    return pd.DataFrame(rows, columns=SEGMENT_COLUMNS)
+
+
+def gaze_windows(segments, folder=EYE_TRACKER_FOLDER):
+    '''
+    Yield (segment, window) for every row of segment_events(), where window is
+    the GazeWindow of the page. Rows are grouped by gaze file so each
+    recording is opened once; books without a recording are skipped.
+    '''
+    for gaze_file, pages in segments.groupby("gaze_file", sort=False):
+        try:
+            session = GazeSession.open(os.path.join(folder, gaze_file))
+        except FileNotFoundError:
+            print(f"No gaze data for {gaze_file}, skipping")
+            continue
+        for segment in pages.itertuples(index=False):
+            yield segment, session.window(segment.page_start, segment.page_end)
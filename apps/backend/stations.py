@@ -0,0 +1,133 @@
+'''
+The reading stations driving one capture server, each with its own eye
+tracker and participant.
+
+An event names its station in EventData.station. The stations are the ones
+in STATION_TRACKERS (main.py), each with the serial number of its own
+tracker; events naming any other station are stored, but no gaze is recorded
+for them and the response says why. Without STATION_TRACKERS there is a
+single station, DEFAULT_STATION, which takes the first tracker found and
+gets the events that name no station.
+
+Every station has a TrackerManager for its tracker and the Tobii session of
+the participant it is recording, so two browsers opening and closing books at
+the same time never touch each other's recording.
+
+A station handles its events one at a time and in the order they arrived,
+on a thread of its own: starting and finishing a gaze recording creates and
+flushes files, which must not hold up the event loop or the other stations.
+
+    stations = Stations(sdk, {"left": "TPSP1-010203", "right": "TPSP1-040506"})
+    stations.start()
+    await stations.handle(event_data)
+    stations.live(station="left")
+'''
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from tobiilsl.tobii_tracking import TrackerManager
+
+DEFAULT_STATION = "default"
+
+
+class Station:
+    def __init__(self, name, manager):
+        self.name = name
+        self.manager = manager
+        # the session of the participant at this station
+        self.tobii = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"station-{name}")
+
+    def session(self, participant_id, timestamp):
+        '''The participant's session, swapped in if someone else was reading here'''
+        if self.tobii is None or self.tobii.participantId != participant_id:
+            self.tobii = self.manager.session(participant_id, timestamp)
+        return self.tobii
+
+    def handle(self, event_data):
+        if event_data.event == "SELECT_TREATMENT":
+            self.tobii = self.manager.session(event_data.participantId, event_data.timestamp)
+        elif event_data.event == "OPEN_BOOK":
+            self.session(event_data.participantId, event_data.timestamp).start_tracking(event_data.timestamp)
+        elif event_data.event == "CLOSE_BOOK":
+            self.session(event_data.participantId, event_data.timestamp).stop_tracking(event_data.timestamp)
+
+
+class Stations:
+    '''
+    The stations by name: those in `trackers` (station name -> serial number),
+    or DEFAULT_STATION when it is empty. A tracker serves one station only.
+    '''
+
+    def __init__(self, sdk, trackers=None, **options):
+        self.sdk = sdk
+        self.trackers = dict(trackers or {})
+        for name, serial_number in self.trackers.items():
+            if not serial_number:
+                raise ValueError(f"Station {name} has no tracker serial number")
+        serial_numbers = list(self.trackers.values())
+        if len(set(serial_numbers)) != len(serial_numbers):
+            raise ValueError(f"Every station needs a tracker of its own, got {self.trackers}")
+        # options are passed on to every TrackerManager, e.g. retry
+        self.stations = {
+            name: Station(name, TrackerManager(sdk, serial_number=serial_number, name=name, **options))
+            for name, serial_number in (self.trackers or {DEFAULT_STATION: None}).items()
+        }
+        # the station where a book was opened last, for /live without a station
+        self.latest = None
+
+    def get(self, name=None):
+        name = name or DEFAULT_STATION
+        station = self.stations.get(name)
+        if station is None:
+            if not self.trackers:
+                raise ValueError(f"Unknown station {name}: set STATION_TRACKERS to run several stations")
+            raise ValueError(f"Unknown station {name}, expected one of {', '.join(self.stations)}")
+        return station
+
+    def start(self):
+        for station in self.stations.values():
+            station.manager.start()
+
+    async def stop(self):
+        '''Finish the recordings in progress and stop looking for the trackers'''
+        loop = asyncio.get_running_loop()
+        # each on its station's thread, after the events it is still handling
+        await asyncio.gather(*(
+            loop.run_in_executor(station.executor, station.manager.stop)
+            for station in self.stations.values()
+        ))
+        for station in self.stations.values():
+            station.executor.shutdown()
+
+    async def handle(self, event_data):
+        '''Start, swap or stop the recording an event calls for, at its station'''
+        station = self.get(event_data.station)
+        if event_data.event == "OPEN_BOOK":
+            self.latest = station
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(station.executor, station.handle, event_data)
+
+    def live(self, station=None, participant_id=None):
+        '''
+        The live detection of a station's book, or of the station where the
+        participant is reading, or of the book opened last
+        '''
+        if station is not None:
+            candidates = [self.stations.get(station)]
+        elif participant_id is not None:
+            candidates = [
+                s for s in self.stations.values()
+                if s.tobii is not None and s.tobii.participantId == participant_id
+            ]
+        else:
+            candidates = [self.latest]
+        for candidate in candidates:
+            live = getattr(getattr(candidate, "tobii", None), "live", None)
+            if live is not None:
+                return live
+        return None
+
+    def health(self):
+        return {name: station.manager.health() for name, station in self.stations.items()}
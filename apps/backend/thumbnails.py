@@ -0,0 +1,129 @@
+'''
+Reduced copies of the screenshots, for reviewing a participant's events
+without decoding every full-size frame.
+
+Each screenshot gets a small pyramid of WebP thumbnails, one per width in
+WIDTHS, stored next to the screenshots as thumbnails/<width>/<name>.webp,
+where <name> is the screenshot's path relative to the screenshots folder.
+Screenshots from anywhere else are named by a hash of their full path:
+
+    thumbnails = ThumbnailStore()
+    path = thumbnails.get("screenshots/3f2c....png", 480)
+
+The ScreenshotStore builds them right after encoding a frame, from the
+pixels it already has; get() builds a level that is missing (older
+recordings) or older than its screenshot when it is first asked for. A
+requested width is served by the smallest level at least as wide, so a
+client asking for 300 pixels gets the 480 one.
+'''
+
+import hashlib
+import os
+import threading
+
+from PIL import Image
+
+FOLDER = os.path.join("screenshots", "thumbnails")
+# thumbnails of screenshots outside the screenshots folder, by path hash
+EXTERNAL = "external"
+# widths of the pyramid levels, smallest first
+WIDTHS = (160, 480, 1280)
+QUALITY = 80
+
+
+class ThumbnailStore:
+    def __init__(self, folder=FOLDER, widths=WIDTHS, quality=QUALITY):
+        self.folder = folder
+        self.widths = tuple(sorted(widths))
+        self.quality = quality
+        # one build at a time per screenshot, so concurrent requests for a
+        # timeline do not decode the same frame repeatedly
+        self._lock = threading.Lock()
+        self._building = {}
+
+    def level(self, width):
+        '''Return the pyramid width serving a requested width, or None for the original'''
+        for level in self.widths:
+            if level >= width:
+                return level
+        return None
+
+    def path(self, source, width):
+        # keyed by the whole path, so screenshots with the same file name in
+        # different folders (e.g. merged from another station) do not collide
+        root = os.path.abspath(os.path.dirname(self.folder))
+        relative = os.path.relpath(os.path.abspath(source), root)
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            digest = hashlib.sha1(os.path.abspath(source).encode()).hexdigest()
+            relative = os.path.join(EXTERNAL, digest + "-" + os.path.basename(source))
+        name = os.path.splitext(relative)[0]
+        return os.path.join(self.folder, str(width), name + ".webp")
+
+    def build(self, source, image=None, widths=None):
+        '''
+        Write the levels of a screenshot's pyramid (all of them by default),
+        from `image` if the caller has the decoded frame already. Returns
+        {width: path}.
+        '''
+        if image is None:
+            with Image.open(source) as opened:
+                image = opened.convert("RGB")
+        paths = {}
+        # each level is reduced from the next larger one, which is much
+        # cheaper than going back to the full frame every time
+        for width in sorted(widths or self.widths, reverse=True):
+            image = shrink(image, width)
+            path = self.path(source, width)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            image.save(tmp, format="WEBP", quality=self.quality, method=0)
+            os.replace(tmp, path)
+            paths[width] = path
+        return paths
+
+    def get(self, source, width):
+        '''
+        Return the file to serve for a screenshot at a width: a thumbnail,
+        built if needed, or the screenshot itself when it is wider than every
+        level. Raises FileNotFoundError if the screenshot does not exist.
+        '''
+        level = self.level(width)
+        if level is None:
+            if not os.path.exists(source):
+                raise FileNotFoundError(source)
+            return source
+        path = self.path(source, level)
+        source_mtime = os.stat(source).st_mtime_ns
+        if self.fresh(path, source_mtime):
+            return path
+
+        with self._lock:
+            building = self._building.get(source)
+            if building is None:
+                building = self._building[source] = threading.Lock()
+        with building:
+            if not self.fresh(path, source_mtime):
+                self.build(source, widths=[level])
+        with self._lock:
+            self._building.pop(source, None)
+        return path
+
+    @staticmethod
+    def fresh(path, source_mtime):
+        try:
+            return os.stat(path).st_mtime_ns >= source_mtime
+        except FileNotFoundError:
+            return False
+
+
+def shrink(image, width):
+    '''Resize an image to a width, keeping its aspect ratio'''
+    if width >= image.width:
+        return image
+    # a box reduction by the whole factor first, then Lanczos for the rest:
+    # close to Lanczos all the way at a fraction of the cost
+    factor = image.width // width
+    if factor >= 2:
+        image = image.reduce(factor)
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.Resampling.LANCZOS)
@@ -7,117 +7,446 @@ license_file = "license_file"
 
 from datetime import datetime
 import os
+import threading
 import time
-import simplejson
-import tobii_research as tr
-import json
+
+import gazefile
+import livedetection
+import metrics
+from backends import TobiiSDK
+
+# Detector run on the dominant eye while a book is open, see livedetection.py
+LIVE_DETECTOR = "ivt"
+LIVE_PARAMS = {"sacvel": 80}
+# Seconds between attempts to find and license the tracker, doubling after
+# every miss up to the maximum
+RETRY_SECONDS = 1.
+RETRY_MAX_SECONDS = 30.
+
+# the sessions recording right now, read by the gaze gauges
+RECORDING = set()
+RECORDING_LOCK = threading.Lock()
+
+
+def recorders():
+    with RECORDING_LOCK:
+        return [recorder for recorder in (s.recorder for s in RECORDING) if recorder is not None]
+
+
+metrics.GAZE_BUFFER_DEPTH.set_function(lambda: sum(len(r.buffer) for r in recorders()))
+metrics.GAZE_DROPPED.set_function(lambda: sum(r.dropped for r in recorders()))
+metrics.GAZE_SESSION_BYTES.set_function(lambda: sum(r.bytes_written for r in recorders()))
+
+
+class TrackerUnavailable(RuntimeError):
+    '''The eye tracker has not been found and licensed (yet)'''
+
+
+class TrackerManager:
+    '''
+    Finds and licenses the eye tracker once, in the background, and hands
+    out a recording session (Tobii) per participant on it:
+
+        manager = TrackerManager().start()
+        tobii = manager.session(participant_id)
+        tobii.start_tracking(start_time)
+        ...
+        tobii.stop_tracking(end_time)
+
+    Discovery that finds nothing, or a license that is refused, is retried
+    every RETRY_SECONDS, doubling up to RETRY_MAX_SECONDS, and health() says
+    where it stands. A book opened before the tracker is ready is pending:
+    its recording starts as soon as the tracker is found. When the SDK
+    reports the connection lost the tracker is looked for again, and a
+    session that was recording is subscribed to it as soon as it is back.
+
+    sdk is tobii_research or a stand-in with its API (backends.py). With a
+    serial_number the manager waits for that tracker, else it takes the
+    first one found; name is the reading station it serves (stations.py).
+    '''
+
+    def __init__(
+        self,
+        sdk=None,
+        license_path=os.path.join("tobiilsl", license_file),
+        retry=RETRY_SECONDS,
+        max_retry=RETRY_MAX_SECONDS,
+        serial_number=None,
+        name="default",
+    ):
+        self.sdk = sdk if sdk is not None else TobiiSDK()
+        self.serial_number = serial_number
+        self.name = name
+        self.license_path = license_path
+        self.retry = retry
+        self.max_retry = max_retry
+        self.tracker = None
+        self.state = "stopped"
+        self.attempts = 0
+        self.last_error = None
+        self.connected_at = None
+        self.next_attempt = None
+        # the session of the participant being recorded, or last recorded
+        self.active = None
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = None
+        metrics.TRACKER_READY.labels(name).set_function(lambda: int(self.tracker is not None))
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping = False
+            self.state = "searching"
+            self.thread = threading.Thread(target=self.run, name="tracker-manager", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        '''Finish the recording in progress, if any, and stop looking for the tracker'''
+        active = self.active
+        if active is not None and (active.recording or active.pending is not None):
+            active.stop_tracking(int(time.time() * 1000))
+        self.stopping = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.changed:
+            self.tracker = None
+            self.state = "stopped"
+            self.changed.notify_all()
+
+    def run(self):
+        delay = self.retry
+        while not self.stopping:
+            if self.tracker is not None:
+                # connected: sleep until lost() or stop()
+                self.wake.wait()
+                self.wake.clear()
+                continue
+            try:
+                self.connect()
+                if self.tracker is None:
+                    # lost again while the sessions were subscribing to it
+                    self.wake.clear()
+                    raise TrackerUnavailable(self.last_error or "Lost right after connecting")
+                delay = self.retry
+            except Exception as e:
+                with self.lock:
+                    self.last_error = str(e)
+                    self.next_attempt = time.time() + delay
+                print(f"Eye tracker not ready, trying again in {delay:g} s: {e}")
+                self.wake.wait(delay)
+                self.wake.clear()
+                delay = min(delay * 2, self.max_retry)
+
+    def connect(self):
+        with self.lock:
+            self.attempts += 1
+            self.next_attempt = None
+        metrics.TRACKER_DISCOVERIES.labels(self.name).inc()
+        trackers = self.sdk.find_all_eyetrackers()
+        if len(trackers) == 0:
+            raise TrackerUnavailable("No Eye Trackers found")
+        if self.serial_number is None:
+            # Pick first tracker
+            tracker = trackers[0]
+        else:
+            matching = [t for t in trackers if t.serial_number == self.serial_number]
+            if not matching:
+                raise TrackerUnavailable(
+                    f"No eye tracker with serial number {self.serial_number},"
+                    f" found {', '.join(t.serial_number for t in trackers)}"
+                )
+            tracker = matching[0]
+        print("Found Tobii Tracker at '%s'" % (tracker.address))
+        self.apply_license(tracker)
+        self.watch(tracker)
+        with self.changed:
+            self.tracker = tracker
+            self.state = "ready"
+            self.last_error = None
+            self.connected_at = time.time()
+            active = self.active
+            self.changed.notify_all()
+        if active is not None:
+            active.resume(tracker)
+
+    def apply_license(self, tracker):
+        if license_file == "" or not os.path.exists(self.license_path):
+            # e.g. a replayed tracker; a real one that needs a license fails
+            # to subscribe without it
+            print("No license file found")
+            return
+        with open(self.license_path, "rb") as f:
+            license = f.read()
+        res = tracker.apply_licenses(license)
+        # Returns: Tuple of FailedLicense objects for licenses that failed.
+        # Empty tuple if all licenses were successfully applied.
+        if len(res) != 0:
+            raise TrackerUnavailable(
+                "Failed to apply license from single key. Validation result: %s."
+                % (res[0].validation_result)
+            )
+        print("Successfully applied license from single key")
+
+    def watch(self, tracker):
+        '''Have the SDK tell us when the tracker goes away, if it can'''
+        stream = getattr(self.sdk, "EYETRACKER_NOTIFICATION_CONNECTION_LOST", None)
+        if stream is not None:
+            tracker.subscribe_to(stream, lambda data: self.lost("Connection lost"), as_dictionary=True)
+
+    def lost(self, reason):
+        '''Forget the tracker and look for it again'''
+        with self.changed:
+            if self.tracker is None:
+                return
+            self.tracker = None
+            self.state = "searching"
+            self.last_error = reason
+        print(f"Eye tracker lost: {reason}")
+        self.wake.set()
+
+    def connected(self):
+        '''Return the tracker, or raise TrackerUnavailable if it isn't ready'''
+        tracker = self.tracker
+        if tracker is None:
+            raise TrackerUnavailable(
+                f"The eye tracker is not ready ({self.state}"
+                + (f": {self.last_error})" if self.last_error else ")")
+            )
+        return tracker
+
+    def wait(self, timeout=None):
+        '''Wait up to timeout seconds for the tracker to be ready and return it'''
+        with self.changed:
+            self.changed.wait_for(lambda: self.tracker is not None or self.stopping, timeout)
+        return self.connected()
+
+    def session(self, participant_id, end_time=None):
+        '''
+        Return a new recording session for a participant. A recording the
+        previous participant left running is stopped at end_time (now if
+        not given).
+        '''
+        session = Tobii(participant_id, self)
+        with self.lock:
+            previous, self.active = self.active, session
+        if previous is not None and (previous.recording or previous.pending is not None):
+            previous.stop_tracking(end_time if end_time is not None else int(time.time() * 1000))
+        return session
+
+    def health(self):
+        with self.lock:
+            tracker = self.tracker
+            active = self.active
+            return {
+                "state": self.state,
+                "station": self.name,
+                "address": getattr(tracker, "address", None),
+                "model": getattr(tracker, "model", None),
+                "serial_number": getattr(tracker, "serial_number", None),
+                "connected_at": self.connected_at if tracker is not None else None,
+                "attempts": self.attempts,
+                "last_error": self.last_error,
+                "next_attempt": self.next_attempt,
+                "participant_id": active.participantId if active is not None else None,
+                "recording": active is not None and active.recording,
+                # a book is open, waiting for the tracker to start recording
+                "pending": active is not None and active.pending is not None,
+            }
 
 
 class Tobii:
-    setup: bool = False
-    tracker: tr.EyeTracker
+    '''One participant's recordings, made on the TrackerManager's tracker'''
+
+    tracker: object
     participantId: int
     start_time: datetime
     end_time: datetime
 
-    def __init__(self, participantId):
+    def __init__(self, participantId, manager):
         self.participantId = participantId
-        # Find Eye Tracker and Apply License (edit to suit actual tracker serial no)
-        trackers = tr.find_all_eyetrackers()
-        if len(trackers) == 0:
-            print("No Eye Trackers found!?")
-            exit(1)
-
-        # Pick first tracker
-        self.tracker = trackers[0]
-        self.gaze_datas = []
-        print("Found Tobii Tracker at '%s'" % (self.tracker.address))
-
-        # Apply license
-        if license_file != "":
-            import os
-
-            with open(os.path.join("tobiilsl", "license_file"), "rb") as f:
-                license = f.read()
-
-                res = self.tracker.apply_licenses(license)
-                # Returns: Tuple of FailedLicense objects for licenses that failed.
-                # Empty tuple if all licenses were successfully applied.
-
-                if len(res) == 0:
-                    print("Successfully applied license from single key")
-                    self.setup = True
-                else:
-                    print(
-                        "Failed to apply license from single key. Validation result: %s."
-                        % (res[0].validation_result)
-                    )
-                    exit
-        else:
-            print("No license file found")
+        self.manager = manager
+        self.tracker = None
+        self.recorder = None
+        self.live = None
+        # the start time of a book opened while the tracker was not ready
+        self.pending = None
+        self.last_sample_time = None
+        # start, stop and a resume after a reconnect come from different threads
+        self.lock = threading.RLock()
+
+    @property
+    def recording(self):
+        return self.recorder is not None
 
     def start_tracking(self, start_time):
-        if not self.setup:
-            print("Eye tracker not setup")
-            exit(1)
+        with self.lock:
+            return self._start_tracking(start_time)
+
+    def _start_tracking(self, start_time):
+        if self.recording:
+            # the book was opened again without being closed
+            self.stop_tracking(start_time)
+        tracker = self.manager.tracker
+        if tracker is None:
+            # recorded from when the manager finds the tracker, see resume()
+            self.pending = start_time
+            print(f"Eye tracker not ready, the recording of participant {self.participantId} starts once it is found")
+            return False
+        self.pending = None
         print("Tracking eye stuff")
-        self.gaze_datas = []
         self.system_start_time_mono_1 = time.monotonic_ns()
         self.system_start_time_epoch = time.time()
         self.system_start_time_mono_2 = time.monotonic_ns()
         self.start_time = start_time
-        self.tracker.subscribe_to(
-            tr.EYETRACKER_GAZE_DATA, self.gaze_data_callback, as_dictionary=True
-        )
-        return True
-
-    def stop_tracking(self, end_time):
-        if not self.setup:
-            print("Eye tracker not setup")
-            exit(1)
-        self.end_time = end_time
-        self.system_end_time_mono_1 = time.monotonic_ns()
-        self.system_end_time_epoch = time.time()
-        self.system_end_time_mono_2 = time.monotonic_ns()
-        self.tracker.unsubscribe_from(tr.EYETRACKER_GAZE_DATA, self.gaze_data_callback)
-        print("Not Tracking eye stuff")
 
         # generate filename based on date and time
         date = datetime.fromtimestamp(self.start_time/1000).strftime("%Y-%m-%d_%H-%M-%S")
         filename = os.path.join(
-            "eye_tracker_data", f"[{self.participantId}]-{date}.json"
+            "eye_tracker_data", f"[{self.participantId}]-{date}{gazefile.SUFFIX}"
         )
-        print(f"Outputting to file {filename}...")
+        print(f"Recording to file {filename}...")
         # create data directory if it doesn't exist
         if not os.path.exists("eye_tracker_data"):
             os.makedirs("eye_tracker_data")
 
-        data_to_write = {
+        self.recorder = gazefile.SessionRecorder(filename, {
             "participantId": self.participantId,
             "start_time": self.start_time,
-            "end_time": self.end_time,
             "system_start_time_mono": (self.system_start_time_mono_1 + self.system_start_time_mono_2) / 2,
             "system_start_time_mono_delta": (self.system_start_time_mono_2 - self.system_start_time_mono_1),
             "system_start_time_epoch": self.system_start_time_epoch,
-            "system_end_time_mono": (self.system_end_time_mono_1 + self.system_end_time_mono_2) / 2,
-            "system_end_time_mono_delta": (self.system_end_time_mono_2 - self.system_end_time_mono_1),
-            "system_end_time_epoch": self.system_end_time_epoch,
-            "data": self.gaze_datas,
-        }
+        })
+        self.live = livedetection.LiveSession(
+            self.participantId,
+            self.start_time,
+            eye=livedetection.dominant_eye(self.participantId),
+            detector=LIVE_DETECTOR,
+            **LIVE_PARAMS,
+        )
+        self.last_sample_time = None
+        try:
+            self.subscribe(tracker)
+        except Exception as e:
+            # nothing was recorded: no session is written, and the book waits
+            # for the tracker to be found again
+            print(f"Could not subscribe to the eye tracker: {e}")
+            self.recorder.discard()
+            self.recorder = None
+            self.live.finish()
+            self.tracker = None
+            self.pending = start_time
+            self.manager.lost(str(e))
+            return False
+        with RECORDING_LOCK:
+            RECORDING.add(self)
+        return True
 
-        with open(filename, "w") as f:
-            f.write(simplejson.dumps(data_to_write, ignore_nan=True))
+    def resume(self, tracker):
+        '''
+        Carry on recording from the tracker found after the connection was
+        lost, or start the recording of a book opened before it was found
+        '''
+        with self.lock:
+            if self.recording:
+                print(f"Resuming the recording of participant {self.participantId}")
+                self.subscribe(tracker)
+            elif self.pending is not None:
+                print(f"Starting the pending recording of participant {self.participantId}")
+                self._start_tracking(self.pending)
 
-        return True
+    def subscribe(self, tracker):
+        if self.tracker is not None:
+            # a reconnect: the lost tracker must not call back as well
+            try:
+                self.tracker.unsubscribe_from(self.manager.sdk.EYETRACKER_GAZE_DATA, self.gaze_data_callback)
+            except Exception:
+                pass
+        self.tracker = tracker
+        tracker.subscribe_to(
+            self.manager.sdk.EYETRACKER_GAZE_DATA, self.gaze_data_callback, as_dictionary=True
+        )
 
-    gaze_datas = []
+    def stop_tracking(self, end_time):
+        with self.lock:
+            return self._stop_tracking(end_time)
+
+    def _stop_tracking(self, end_time):
+        if self.pending is not None:
+            # the book was closed before the tracker was found
+            self.pending = None
+            print("Not tracking: the eye tracker was not found while the book was open")
+            return False
+        if not self.recording:
+            print("Not tracking")
+            return False
+        self.end_time = end_time
+        self.system_end_time_mono_1 = time.monotonic_ns()
+        self.system_end_time_epoch = time.time()
+        self.system_end_time_mono_2 = time.monotonic_ns()
+        try:
+            self.tracker.unsubscribe_from(self.manager.sdk.EYETRACKER_GAZE_DATA, self.gaze_data_callback)
+        except Exception as e:
+            # the tracker went away; what was recorded is still written
+            print(f"Could not unsubscribe from the eye tracker: {e}")
+        print("Not Tracking eye stuff")
+        if self.live is not None:
+            self.live.finish()
+
+        filename = self.recorder.close(
+            end_time=self.end_time,
+            system_end_time_mono=(self.system_end_time_mono_1 + self.system_end_time_mono_2) / 2,
+            system_end_time_mono_delta=(self.system_end_time_mono_2 - self.system_end_time_mono_1),
+            system_end_time_epoch=self.system_end_time_epoch,
+        )
+        if self.recorder.dropped:
+            print(f"Dropped {self.recorder.dropped} gaze samples")
+        print(f"Wrote {filename}")
+        metrics.GAZE_FINISHED_SESSION_BYTES.observe(self.recorder.bytes_written)
+        with RECORDING_LOCK:
+            RECORDING.discard(self)
+        self.recorder = None
+
+        return True
 
     def gaze_data_callback(self, gaze_data):
-        self.gaze_datas.append(gaze_data)
+        start = time.perf_counter()
+        # stop_tracking clears the recorder on another thread; a callback the
+        # SDK was already running when it unsubscribed finds it gone
+        recorder = self.recorder
+        if recorder is None:
+            return
+        recorder.push(gaze_data)
+        live = self.live
+        if live is not None and live.active:
+            try:
+                live.push(gaze_data)
+            except Exception as e:
+                # the recording matters more than the live view
+                print(f"Live detection stopped: {e}")
+                live.active = False
+        if metrics.ENABLED:
+            self.count_sample(gaze_data, start)
+
+    def count_sample(self, gaze_data, start):
+        '''Update the gaze metrics: callback rate, sample interval and callback time'''
+        metrics.GAZE_SAMPLES.inc()
+        sample_time = gaze_data.get("system_time_stamp")
+        if self.last_sample_time is not None and sample_time is not None:
+            # microseconds of the tracker's system clock
+            metrics.GAZE_SAMPLE_INTERVAL_SECONDS.observe((sample_time - self.last_sample_time) / 1_000_000)
+        self.last_sample_time = sample_time
+        metrics.GAZE_CALLBACK_SECONDS.observe(time.perf_counter() - start)
 
 
 if __name__ == "__main__":
-    tobii = Tobii(123)
-    tobii.start_tracking()
+    manager = TrackerManager().start()
+    manager.wait(10)
+    tobii = manager.session(123)
+    tobii.start_tracking(int(time.time() * 1000))
     time.sleep(1)
-    tobii.stop_tracking()
+    tobii.stop_tracking(int(time.time() * 1000))
+    manager.stop()
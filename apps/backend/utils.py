@@ -1,6 +1,7 @@
+import copy
 from datetime import datetime
-import json
 import math
+import os
 
 from IPython.display import display
 from PIL import Image
@@ -8,7 +9,15 @@ import numpy as np
 
 from peewee import IntegerField, Model, CharField, SqliteDatabase, AutoField
 
-db = SqliteDatabase("events.db")
+import gazefile
+from gazefile import GazeFile
+from gazesession import GazeSession
+from geometry import DEGREES_PER_PIXEL, DISTANCE_FROM_SCREEN, SCREEN_HEIGHT, X_PIXELS, Y_PIXELS
+from participants import PARTICIPANTS_FILE, TREATMENTS_FILE, MetadataRegistry, Participant, Treatment, metadata
+from reading import saccade_codes
+from thumbnails import ThumbnailStore
+
+db = SqliteDatabase("events.db", pragmas={"journal_mode": "wal", "cache_size": -64 * 1024})
 
 
 class Events(Model):
@@ -23,34 +32,14 @@ class Events(Model):
 
     class Meta:
         database = db
+        indexes = (
+            (("participant_id", "event", "time"), False),
+            (("participant_id", "time", "event", "agent"), False),
+        )
 
 
-def show_screenshot_for_record(_id):
-    events = (
-        Events.select().where(Events.id == _id).order_by(Events.time.asc()).limit(1)
-    )
-    if len(events) == 0:
-        print("No events found for id: ", _id)
-        return
-    event = events[0]
-    image_path = event.screenshot_file
-    print(_id)
-    display(Image.open(image_path))
-
-
-X_PIXELS = 2560
-Y_PIXELS = 1440
 TIMESTAMP_IDENT = "system_time_stamp"
 OFFSET = 10_000_000
-SCREEN_HEIGHT = 0.336  # meters
-DISTANCE_FROM_SCREEN = 0.6  # meters
-
-# 0.168 is half the height of the screen in meters
-# 0.6 is the distance from the screen in meters
-# we assume square pixels, and that the participant doesn't move
-# don't account for the geometric distortion on the edges
-# https://osdoc.cogsci.nl/4.0/visualangle/
-DEGREES_PER_PIXEL = np.rad2deg(np.arctan2(.5 * SCREEN_HEIGHT, DISTANCE_FROM_SCREEN)) / (.5 * Y_PIXELS)
 
 
 def extract_gaze_data_between_timestamps(gaze_data, start_time, end_time):
@@ -88,9 +77,44 @@ def extract_gaze_data_between_timestamps(gaze_data, start_time, end_time):
     return gaze_data_between_timestamps
 
 
+def load_gaze_data(gaze_file):
+    '''
+    Return a gaze recording as the dict the JSON recordings were loaded into:
+    the header fields, and the samples as packet dicts under "data". gaze_file
+    may name the .gaze session or the old .json file.
+    '''
+    session = gazefile.open_session(gaze_file)
+    return {**session.header, "data": list(session.packets())}
+
+
+def gaze_recordings(participant_id, folder="eye_tracker_data"):
+    '''
+    The paths of a participant's gaze recordings, one per recording whether it
+    is a .gaze session or an old .json file
+    '''
+    recordings = {}
+    for name in sorted(os.listdir(folder)):
+        base, ext = os.path.splitext(name)
+        if name.startswith(f"[{participant_id}]-") and ext in (".json", gazefile.SUFFIX):
+            # a converted JSON recording has its session next to it
+            recordings.setdefault(base, os.path.join(folder, name))
+    return list(recordings.values())
+
+
+def gaze_session(gaze_data):
+    if isinstance(gaze_data, GazeSession):
+        return gaze_data
+    return GazeSession(gaze_data)
+
+
 def extract_gaze_data_between_timestamps_proper(gaze_data, start_time, end_time):
-    # gaze data is the entire json file
+    # gaze data is the entire json file, a GazeFile or a GazeSession
     # start_time and end_time are in milliseconds
+    if isinstance(gaze_data, (GazeFile, GazeSession)):
+        session = gaze_session(gaze_data)
+        start, stop = session.window_bounds(start_time, end_time)
+        return {**session.header, "data": [session.packet(i) for i in range(start, stop)]}
+
     # Deepy copy gaze_data
     gaze_data = gaze_data.copy()
 
@@ -121,8 +145,14 @@ def extract_gaze_data_between_timestamps_proper(gaze_data, start_time, end_time)
 
 
 def find_gaze_packet_at_timestamp(gaze_data, timestamp, properties_to_check_validity):
-    # gaze data is the entire json file
+    # gaze data is the entire json file, a GazeFile or a GazeSession
     # timestamp is in milliseconds
+    if isinstance(gaze_data, (GazeFile, GazeSession)):
+        session = gaze_session(gaze_data)
+        i = session.first_valid(timestamp, properties_to_check_validity)
+        if i is None:
+            raise StopIteration
+        return session.packet(i)
 
     T_s_0 = gaze_data["data"][0][TIMESTAMP_IDENT] # microseconds
     system_start_time_mono = gaze_data['system_start_time_mono']  / 1_000 # convert nanoseconds to microseconds
@@ -157,141 +187,126 @@ def print_record(record):
     )
 
 
-def show_screenshot_for_record(_id):
-    events = Events.select().where(Events.id == _id).order_by(Events.time.asc()).limit(1)
-    if len(events) == 0:
-        print("No events found for id: ", _id)
-        return
-    event = events[0]
-    image_path = event.screenshot_file
-    print(_id)
-    display(Image.open(image_path))
+# width of the screenshots shown when reviewing many events; None shows the
+# full-size files
+REVIEW_WIDTH = 480
+thumbnails = ThumbnailStore()
+
+
+def screenshot_image(image_path, width=None):
+    if width is not None:
+        image_path = thumbnails.get(image_path, width)
+    return Image.open(image_path)
 
 
-def show_participant_screenshots(participant_events):
+def show_screenshot_for_record(_id, width=None):
+    show_screenshots_for_records([_id], width)
+
+
+def show_screenshots_for_records(ids, width=REVIEW_WIDTH):
+    # one query for all the ids, shown in the order they were given
+    events = {event.id: event for event in Events.select().where(Events.id.in_(list(ids)))}
+    for _id in ids:
+        event = events.get(_id)
+        if event is None:
+            print("No events found for id: ", _id)
+            continue
+        print(_id)
+        display(screenshot_image(event.screenshot_file, width))
+
+
+def participant_screenshot_events(participant_id):
+    return list(
+        Events.select()
+        .where(Events.participant_id == participant_id, Events.screenshot_file.is_null(False))
+        .order_by(Events.time, Events.id)
+    )
+
+
+def show_participant_screenshots(participant_events, width=REVIEW_WIDTH):
+    # participant_events may be a participant id, or events already selected
+    if isinstance(participant_events, int):
+        participant_events = participant_screenshot_events(participant_events)
     for event in participant_events:
-        image_path = event.screenshot_file
         print_record(event)
-        display(Image.open(image_path))
+        display(screenshot_image(event.screenshot_file, width))
+
 
 def is_participant_data_low_resolution(participant_id):
-    # read participants.json
-    with open("participants.json", "r") as f:
-        participants = json.load(f)
-    
-    participant = participants.get(str(participant_id))
+    participant = metadata.participant(participant_id)
     if participant is None:
         return False
-    
-    low_res = participant.get("low_resolution")
-    if low_res is None:
-        return False
-    else:
-        return low_res
+    return participant.low_resolution
 
 def load_participants_metadata():
-    # read participants.json
-    with open("participants.json", "r") as f:
-        participants = json.load(f)
-
-    return participants
+    # a deep copy, so callers can't change the cached entries under each other
+    return copy.deepcopy(metadata.participants_json())
     
 def get_participant_treatment(participant_id):
-    # read participants.json
-    with open("participants.json", "r") as f:
-        participants = json.load(f)
-    
-    participant = participants.get(str(participant_id))
+    participant = metadata.participant(participant_id)
     if participant is None:
        raise Exception(f"Participant {participant_id} not found in participants.json")
     
-    split = participant.get("split")
-    group = participant.get("group")
-    if split is None or group is None:
+    treatment = participant.treatment
+    if treatment is None:
         raise Exception(f"Participant {participant_id} does not have a treatment")
     
-    return f"Treatment {split},{group}"
+    return treatment
 
 def load_treatment_settings(treatment):
-    # read participants.json
-    with open("treatments.json", "r") as f:
-        treatments = json.load(f)
-    
-    treatment = next((t for t in treatments if treatment in t['name']), None)
-    if treatment is None:
+    settings = metadata.treatment(treatment)
+    if settings is None:
         raise Exception(f"Treatment {treatment} not found in treatments.json")
     
-    return treatment
+    return copy.deepcopy(settings.raw)
 
 def get_participant_dominant_eye(participant_id):
-    # read participants.json
-    with open("participants.json", "r") as f:
-        participants = json.load(f)
-    
-    participant = participants.get(str(participant_id))
+    participant = metadata.participant(participant_id)
     if participant is None:
         print(f"Participant {participant_id} not found in participants.json, defaulting to right eye")
         return "right"
     
-    eye = participant.get("dominant_eye")
+    eye = participant.dominant_eye
     if eye is None:
         print(f"Participant {participant_id} does not have a dominant eye, defaulting to right eye")
         return "right"
     else:
         return eye.lower()
 
+# plot colours of reading.SACCADE_TYPES
+SACCADE_COLORS = np.array([
+    "green",  # saccade
+    "red",  # regression
+    "blue",  # return sweep
+    "purple",  # unknown movement
+])
+
+
 def identify_saccade_type_with_color(point_a, point_b):
     dx = point_b[0] - point_a[0]
     dy = point_b[1] - point_a[1]
+    return str(SACCADE_COLORS[saccade_codes(dx, dy)])
 
-    angle_rad = np.arctan2(dy, dx)
 
-    # Convert the angle to degrees
-    angle = np.rad2deg(angle_rad)
+def identify_saccade_types_with_color(points_a, points_b):
+    '''identify_saccade_type_with_color for (n, 2) arrays of points, at once'''
+    points_a = np.asarray(points_a, dtype=float)
+    points_b = np.asarray(points_b, dtype=float)
+    codes = saccade_codes(points_b[:, 0] - points_a[:, 0], points_b[:, 1] - points_a[:, 1])
+    return SACCADE_COLORS[codes]
 
-    # Adjust the angle to be in the range of 0 to 360 degrees
-    if angle < 0:
-        angle = angle + 360
 
-    angle = 360 - angle
+def merge_databases(other_database_name, database_name="events.db", copy_screenshots=True):
+    '''
+    Merge the events of another station's database into this one. Events
+    already merged are skipped, so this can be run again after the other
+    station has recorded more; see merge.merge().
+    '''
+    from merge import merge
 
-    if 0 <= angle <= 20 or 340 <= angle <= 360:
-        color = "green" # saccade
-    elif 45 <= angle <= 182:
-        color = "red" # regression
-    elif 182 < angle <= 200:
-        color = "blue" # return sweep
-    else:
-        color = "purple" # unknown movement
-    
-    return color
-
-
-def merge_databases(other_database_name):
-    ###
-    db = SqliteDatabase("events.db")
-    db.connect()
-    db.execute_sql(
-        f"""
-        ATTACH '{other_database_name}' AS db2;
-        INSERT INTO events (
-            time,
-            agent,
-            event,
-            participant_id,
-            old_value,
-            new_value,
-            screenshot_file
-        )
-        SELECT
-            time,
-            agent,
-            event,
-            participant_id,
-            old_value,
-            new_value,
-            screenshot_file
-        FROM db2.events;
-        DETACH db2;
-        """
+    result = merge(other_database_name, database_name, copy_screenshots=copy_screenshots)
+    print(
+        f"Merged {result['inserted']} new events of {result['scanned']} read"
+        f" ({result['rows_per_second']:.0f} rows/s)"
     )
+    return result
@@ -1,7 +1,11 @@
+from collections import deque
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from geometry import FIXATION_COLUMNS, SACCADE_COLUMNS
+
 # First some helpful definitions
 
 def calcDelta(df):
@@ -41,156 +45,263 @@ def med(x, y, n):
     return np.sqrt(xs**2 + ys**2)
     
     
+def describe_fixations(x, y, ts, starts, lengths):
+    '''
+    Return a description of every fixation as a DataFrame, each fixation being
+    the samples [start, start+length). Fixations must not overlap.
+
+    All fixations are described at once with grouped reductions over the
+    samples they cover instead of calling np.cov once per fixation.
+    '''
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if len(starts) == 0:
+        return pd.DataFrame([], columns = FIXATION_COLUMNS)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    ts = np.asarray(ts)
+
+    # gather the samples of every fixation into one contiguous array, so each
+    # fixation is the segment starting at its offset
+    offsets = np.cumsum(lengths) - lengths
+    idx = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+    xs = x[idx]
+    ys = y[idx]
+
+    mx = np.add.reduceat(xs, offsets) / lengths
+    my = np.add.reduceat(ys, offsets) / lengths
+    dx = xs - np.repeat(mx, lengths)
+    dy = ys - np.repeat(my, lengths)
+
+    # sample covariance (ddof=1, like np.cov), zero for single sample fixations
+    multi = lengths > 1
+    ddof = np.where(multi, lengths - 1, 1)
+    sx = np.where(multi, np.sqrt(np.add.reduceat(dx * dx, offsets) / ddof), 0.)
+    sy = np.where(multi, np.sqrt(np.add.reduceat(dy * dy, offsets) / ddof), 0.)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rho = np.where(multi, np.add.reduceat(dx * dy, offsets) / ddof / (sx * sy), 0.)
+
+    return pd.DataFrame({
+        "ts": ts[starts],
+        "len": ts[starts + lengths - 1] - ts[starts],
+        "i": starts,
+        "n": lengths,
+        "x": mx,
+        "y": my,
+        "sx": sx,
+        "sy": sy,
+        "rho": rho,
+    })
+
 def detect_fix_ivt(df, sacvel = 20.):
     '''
     I-VT Saccadic Detection (Salvucci and Goldberg (2000))
     Code based very loosely on gians repo code (https://github.com/gian/eventdetect)
-    '''
-    
-    def describe_fix(fixation, fixnr):
-        '''return a description of the fixation (nparray!) as a tupple'''
-
-        start = fixation[0,0]
-        l = fixation[-1,0] - start
-        xs = fixation[:,1]
-        ys = fixation[:,2]
-
-        if len(fixation)>1:
-            cov = np.cov(xs, ys)
-            sx = np.sqrt(cov[0,0])
-            sy = np.sqrt(cov[1,1])
-            rho = cov[0,1] / (sx*sy)
-        else:
-            sx = sy = rho = 0
 
-        return (start, l, fixation[0,3], len(fixation), np.mean(xs), np.mean(ys), sx, sy, rho)
-    
+    Fixations are found as runs of samples below the velocity threshold. A
+    fixation starts at the sample before its run and ends at the sample that
+    breaks the run; a run lasting until the end of the recording has no such
+    sample and only gets labelled up to the end.
+    '''
     if df.size == 0:
-        return pd.DataFrame([], columns = ("ts", "len", "i", "n", "x", "y", "sx", "sy", "rho")), None, None
+        return pd.DataFrame([], columns = FIXATION_COLUMNS), None, None
     v = calcVelocity(df)
     x = df.x.values
     y = df.y.values
     ts = df.ts.values
     
     v[0] = 10000.
-    
-    labels = np.zeros(len(v))
-    fixnr = 1   
-    fixation = []
-    fixations = []
-    prev = 0
-    for i in range(len(v)):
-        if v[i] < sacvel:
-            fixation.append((ts[prev], x[prev], y[prev], prev))
-            labels[prev] = fixnr
-            prev = i
-        elif len(fixation)==0: # and v[i] >= sacvel:
-            prev = i
-            continue
-        else:
-            # emit fixation
-            labels[prev] = fixnr
-            fixation.append((ts[prev], x[prev], y[prev], prev))
-            
-            fixations.append(describe_fix(np.array(fixation), fixnr))
-            fixnr += 1
-            
-            fixation = []
-            prev = i
-            
-                
-    if len(fixation)>0:
-        labels[i] = fixnr
-        fixations.append(describe_fix(np.array(fixation), fixnr))
-        
-    fixations = pd.DataFrame(fixations, 
-                             columns = ("ts", "len", "i", "n", "x", "y", "sx", "sy", "rho"))
+    n = len(v)
+
+    slow = (v < sacvel).astype(np.int8)
+    edges = np.diff(slow, prepend=0, append=0)
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+
+    starts = run_starts - 1
+    lengths = run_ends - run_starts + 1
+    lengths[run_ends == n] -= 1
+
+    fixnr = np.arange(1, len(starts) + 1)
+    marks = np.zeros(n + 1)
+    marks[starts] += fixnr
+    marks[run_ends] -= fixnr
+    labels = np.cumsum(marks[:n])
+
+    fixations = describe_fixations(x, y, ts.astype(float), starts, lengths)
+    if len(fixations):
+        fixations["i"] = fixations["i"].astype(float)
     return fixations, v, labels
 
-def detect_fix_idt(df, dispval = 1, minwindow = 6):
+class SlidingDispersion:
     '''
-    I-DT Fixation Detetion (Salvucci and Goldberg (2000))
-    Code based very loosely on gians repo code (https://github.com/gian/eventdetect)
-    '''
-    
-    def dispersion(x, y, start, length):
+    Dispersion (max x - min x + max y - min y) of a window of samples that only
+    ever grows to the right or drops samples on the left.
 
-        if length == 0:
-            return np.nan()
+    Running min/max are kept in monotonic deques of sample indices, so every
+    sample is pushed and popped at most once. A window holding a NaN sample has
+    a NaN dispersion, like np.min/np.max would give.
+    '''
 
-        minxy = np.min((x[start:start+length+1], y[start:start+length+1]), axis=1)
-        maxxy = np.max((x[start:start+length+1], y[start:start+length+1]), axis=1)
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+        self.end = -1
+        self.last_nan = -1
+        self.minx = deque()
+        self.maxx = deque()
+        self.miny = deque()
+        self.maxy = deque()
 
-        return np.sum(maxxy - minxy)
-        
+    def extend(self, end):
+        '''Grow the window up to and including sample end'''
+        x, y = self.x, self.y
+        minx, maxx, miny, maxy = self.minx, self.maxx, self.miny, self.maxy
+        for j in range(self.end + 1, end + 1):
+            xj = x[j]
+            yj = y[j]
+            if xj != xj or yj != yj:
+                self.last_nan = j
+                continue
+            while minx and x[minx[-1]] >= xj:
+                minx.pop()
+            minx.append(j)
+            while maxx and x[maxx[-1]] <= xj:
+                maxx.pop()
+            maxx.append(j)
+            while miny and y[miny[-1]] >= yj:
+                miny.pop()
+            miny.append(j)
+            while maxy and y[maxy[-1]] <= yj:
+                maxy.pop()
+            maxy.append(j)
+        self.end = max(self.end, end)
 
-    def describe_fix(x, y, ts, start, length):
-        '''return a description of the fixation as a tupple'''
+    def dispersion(self, start):
+        '''Return the dispersion of the samples start..end'''
+        if self.last_nan >= start:
+            return np.nan
+        for q in (self.minx, self.maxx, self.miny, self.maxy):
+            while q and q[0] < start:
+                q.popleft()
+        x, y = self.x, self.y
+        return (x[self.maxx[0]] - x[self.minx[0]]) + (y[self.maxy[0]] - y[self.miny[0]])
 
-        s = ts[start]
-        l = ts[start+length-1] - s
-        
-        if length>1:
-            cov = np.cov(x[start:start+length], y[start:start+length])
-            sx = np.sqrt(cov[0,0])
-            sy = np.sqrt(cov[1,1])
-            rho = cov[0,1] / (sx*sy)
-        else:
-            sx = sy = rho = 0
+def detect_fix_idt(df, dispval = 1, minwindow = 6):
+    '''
+    I-DT Fixation Detetion (Salvucci and Goldberg (2000))
+    Code based very loosely on gians repo code (https://github.com/gian/eventdetect)
 
-        return (s, l, start, length, np.mean(x[start:start+length]), np.mean(y[start:start+length]), sx, sy, rho)
+    A window of minwindow+1 samples starting at i is checked against dispval
+    and, if it is within it, grown one sample at a time until it is not; the
+    fixation is every sample before the one that broke it. The window only
+    moves forward, so the whole pass is linear in the number of samples.
+    '''
 
     x = df.x.values
     y = df.y.values
     ts = df.ts.values
-    
-    fixations = []
+    n = len(x)
+
+    window = SlidingDispersion(x, y)
+    starts = []
+    lengths = []
     i = 0
-    while (i<len(x)):
+    while (i<n):
         
-        l = np.min((minwindow, len(x)-i))
-        d = dispersion(x, y, i, l)
+        l = min(minwindow, n-i)
+        window.extend(min(i+l, n-1))
+        d = window.dispersion(i)
         
         if (d<=dispval):
-            while ((d<=dispval) and (i+l < len(x))):
+            while ((d<=dispval) and (i+l < n)):
                 l += 1
-                d = dispersion(x, y, i, l)
+                window.extend(min(i+l, n-1))
+                d = window.dispersion(i)
                 
-            fixations.append(describe_fix(x, y, ts, i, l))
+            starts.append(i)
+            lengths.append(l)
             i += l
         else:
             i += 1
             
-    fixations = pd.DataFrame(fixations, 
-                             columns = ("ts", "len", "i", "n", "x", "y", "sx", "sy", "rho"))
+    fixations = describe_fixations(x, y, ts, starts, lengths)
     return fixations, None, None
 
-def find_sacc_from_fix(fixations):
-    '''Return saccades from periods between fixations'''
-    saccades = []
-    
-    # pi = px = py = pts = 
-    pi = fixations.i[0]
-    px = fixations.x[0]
-    py = fixations.y[0]
-    pts = fixations.ts[0]
-
-    for i, f in fixations[1:].iterrows():
-        a = np.max((0, pi-1))
-        b = f.i
-        dx = f.x - px
-        dy = f.y - py
-        dxy = np.sqrt(dx**2 + dy**2)
-        dts = f.ts - pts
-        
-        if a != b:
-            # saccades.append((a, b, b - a, dxy, dts*1000))
+def segment_peak_mean(v, starts, stops):
+    '''
+    Return the peak and mean of v over each of the samples [start, stop),
+    ignoring non-finite values. Segments with no finite sample get NaN.
+    '''
+    v = np.asarray(v, dtype=float)
+    finite = np.isfinite(v)
+    starts = np.clip(starts, 0, len(v))
+    stops = np.clip(stops, starts, len(v))
+
+    # prefix sums give every segment's sum and count of finite samples
+    total = np.concatenate(([0.], np.cumsum(np.where(finite, v, 0.))))
+    count = np.concatenate(([0], np.cumsum(finite)))
+    counts = count[stops] - count[starts]
+
+    # maximum.reduceat over [start, stop) pairs, with a -inf sentinel so
+    # that stop may be len(v)
+    padded = np.append(np.where(finite, v, -np.inf), -np.inf)
+    bounds = np.empty(2 * len(starts), dtype=np.int64)
+    bounds[0::2] = starts
+    bounds[1::2] = stops
+    peak = np.maximum.reduceat(padded, bounds)[0::2] if len(bounds) else np.empty(0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (total[stops] - total[starts]) / counts
+    peak = np.where(counts > 0, peak, np.nan)
+    mean = np.where(counts > 0, mean, np.nan)
+    return peak, mean
+
+def find_sacc_from_fix(fixations, velocity=None):
+    '''
+    Return saccades from periods between fixations
+
+    Each saccade runs from the end of one fixation to the start of the next,
+    computed for all pairs of consecutive fixations at once. Given the
+    per-sample velocity trace the fixations were detected on (e.g. the one
+    detect_fix_ivt returns), the saccades also get their peak and mean
+    velocity ("vpeak", "vmean") for main-sequence analysis.
+    '''
+    columns = SACCADE_COLUMNS if velocity is None else SACCADE_COLUMNS + ("vpeak", "vmean")
+    if len(fixations) < 2:
+        return pd.DataFrame([], columns = columns)
+
+    i = fixations.i.values.astype(float)
+    n = fixations.n.values.astype(float)
+    x = fixations.x.values.astype(float)
+    y = fixations.y.values.astype(float)
+    ts = fixations.ts.values.astype(float)
+    length = fixations.len.values.astype(float)
 
-            saccades.append((pts, dts, a, b - a, dxy, dts*1000))
+    # where the previous fixation ended; the first fixation is taken at its
+    # start, as the original loop did
+    prev_i = i + n
+    prev_i[0] = i[0]
+    prev_ts = ts + length
+    prev_ts[0] = ts[0]
 
-        pi = f.i + f.n
-        pts = f.ts + f.len
-        px = f.x
-        py = f.y
+    a = np.maximum(0, prev_i[:-1] - 1)
+    b = i[1:]
+    dxy = np.sqrt(np.diff(x)**2 + np.diff(y)**2)
+    dts = ts[1:] - prev_ts[:-1]
 
-    return pd.DataFrame(saccades, columns = ("ts", "len", "i", "n", "dxy", "dts"))
+    keep = a != b
+    saccades = pd.DataFrame({
+        "ts": prev_ts[:-1][keep],
+        "len": dts[keep],
+        "i": a[keep],
+        "n": (b - a)[keep],
+        "dxy": dxy[keep],
+        "dts": dts[keep] * 1000,
+    })
+    if velocity is not None:
+        starts = saccades.i.values.astype(np.int64)
+        stops = starts + saccades.n.values.astype(np.int64)
+        saccades["vpeak"], saccades["vmean"] = segment_peak_mean(velocity, starts, stops)
+    return saccades
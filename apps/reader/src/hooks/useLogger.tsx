@@ -6,6 +6,8 @@ import { MarginSize } from '../state'
 import { ColorScheme } from './theme'
 
 axios.defaults.baseURL = process.env.NEXT_PUBLIC_LOG_API_URL
+// Which reading station this browser is, when several share one backend
+const STATION = process.env.NEXT_PUBLIC_STATION || undefined
 
 interface Log {
   timestamp: number
@@ -14,6 +16,7 @@ interface Log {
   participantId?: number
   oldValue?: string
   newValue?: string
+  station?: string
 }
 
 interface UserLog {
@@ -81,7 +84,7 @@ const LoggerProvider = ({ children }: Props) => {
 
   const addLog = async (log: Log) => {
     try {
-      await axios.post('/capture-screenshot/', log)
+      await axios.post('/capture-screenshot/', { ...log, station: STATION })
     } catch (error) {
       console.log(error)
     }